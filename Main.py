@@ -1,16 +1,40 @@
+import os
+import sys
+import time
+from datetime import timedelta
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
 from Utilities_2 import (
-    calculate_first_response_times, 
-    calculate_subsequent_response_times,
-    compute_and_push_metrics,
-    compute_and_push_metrics_Repetitions,
-    compute_and_push_metrics_BotHandle,
+    calculate_response_times,
+    master_row,
+    upsert_master_rows,
     preprocess_data,
-    count_conversations_with_skills
+    count_conversations_with_skills,
+    compute_skill_matrix,
+    export_response_table,
+    split_by_day,
+    ConversationFrame
 )
-from fetch import fetch_data
+from fetch import fetch_data, iter_fetched_views
+import master_store
+from streaming import compute_streaming_metrics
+from incremental import compute_incremental_metrics
+from view_cache import load_view
+from instrumentation import RunReport
+from response_sketches import build_sketches, save_sketches
+from backends import compute_view
+from parallel_responses import calculate_response_times_parallel
+from result_cache import ResultCache, frame_fingerprint
+from event_store import append_events
 from datetime import datetime
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, OUTPUT_FORMAT = "parquet" needs it
+    pa = None
+
 # Configuration - this file is specifically for Sales Department data
 # VIEW_NAME = "Sales CC"   # This file processes Sales Department view
 # VIEW_NAME="Doctors"
@@ -28,64 +52,541 @@ BOT_FILTER = "bot"  # Case-insensitive bot filter
 # DEPARTMENT = "CC Sales"
 DEPARTMENT = "Sales MV"
 
+# Batch mode (python Main.py --batch) - every department below runs in its own worker process
+DEPARTMENTS = [
+    {"view_name": "Sales MV", "skill_filter": "gpt_mv_prospect", "department": "Sales MV"},
+    {"view_name": "Sales CC", "skill_filter": "gpt_cc_prospect", "department": "CC Sales"},
+    {"view_name": "Delighters", "skill_filter": "gpt_delighters", "department": "Delighters"},
+]
+MAX_WORKERS = None  # None uses one worker per CPU
+# Backfill mode (python Main.py --backfill [--batch] [--from=YYYY-MM-DD] [--to=YYYY-MM-DD]) rebuilds
+# the master rows of past days from the export, one row per day its conversations started
 
-# Main execution
-if __name__ == "__main__":
-    # Load and preprocess data
-    # Fetch data from Tableau
-    print(f"Fetching data for view: {VIEW_NAME}")
-    if fetch_data(VIEW_NAME, CSV_PATH):
-        print("Data fetched successfully from Tableau")
+# Set to a row count (e.g. 500_000) to sort exports on disk and process them in batches of
+# whole conversations, for exports that don't fit in memory
+STREAMING_CHUNKSIZE = None
+# Set to a directory (e.g. "checkpoints") to keep per-conversation state between runs and only
+# process messages newer than the last run's; metrics still cover the whole export, while the
+# FRT, non-initial and repetitions outputs (and events) only hold what the run computed
+CHECKPOINT_DIR = None
+# Typed columnar cache of fetched views (None to disable): unchanged exports skip parsing, and
+# views fetched less than CACHE_MAX_AGE seconds ago skip fetching as well
+CACHE_DIR = "view_cache"
+CACHE_MAX_AGE = None
+# Format of the sorted data, FRT and non-initial outputs: "csv", or "parquet" for typed files
+OUTPUT_FORMAT = "csv"
+# Directory of the JSON run reports (stage timings, CPU, rows and peak memory) of every
+# department and day (None to disable); PROFILE = "cprofile" or "sample" (or python Main.py
+# --profile[=sample]) also saves a profile of each run there
+REPORT_DIR = "run_reports"
+PROFILE = None
+
+MASTER_CSV_PATH = "Master Sheet.csv"  # Change this to your actual master CSV path
+# Master metrics backend: "csv" rewrites MASTER_CSV_PATH on every run, "sqlite" upserts into
+# MASTER_DB_PATH (seeded from the CSV on first use); export the CSV with python Main.py --export-master
+MASTER_BACKEND = "csv"
+MASTER_DB_PATH = "Master Sheet.db"
+# Keep mergeable response-time sketches next to the master CSV for percentile queries over
+# any days and departments (see response_sketches.py)
+RESPONSE_SKETCHES = True
+# Similarity threshold (e.g. 0.8) from which bot messages that differ by a name, number or
+# spacing are listed as near-duplicate repetitions next to the exact ones in the repetitions
+# CSV (None: exact repeats only); the master sheet keeps the exact figures. Not supported by
+# incremental runs or the duckdb backend
+REPETITION_SIMILARITY = None
+# Engine of the full (non-streaming, non-incremental) run: "pandas", or "duckdb" to compute the
+# metrics with SQL on the fetched CSV, on every core and spilling to disk past
+# BACKEND_MEMORY_LIMIT (e.g. "4GB"); see backends.py
+COMPUTE_BACKEND = "pandas"
+BACKEND_MEMORY_LIMIT = None
+# Processes sharing the response-time computation of a large view (None: one per CPU; lower it
+# in batch mode, where departments already run in parallel); see parallel_responses.py
+RESPONSE_WORKERS = 1
+# Directory of memoized results (None to disable): reruns on the same preprocessed data and
+# parameters reuse the response times, repetitions and bot handle results instead of computing
+# them, and the least recently used results are evicted past RESULT_CACHE_MAX_BYTES
+RESULT_CACHE_DIR = "result_cache"
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Partitioned Parquet dataset (needs pyarrow; None to disable) the raw response and repetition
+# events of every department and day are also stored in, for queries across days and departments
+# with event_store.query_responses / query_repetitions
+EVENT_STORE_DIR = "events"
+COLUMNS_TO_EDIT = ['AVG initial', 'AVG non_initial', 'Count of >=4 mins initial', 'Count of >=4 mins non_initial']
+REPETITION_COLUMNS_TO_EDIT = ['% of Repetition', 'Chats with repetitions', 'Total chats with bot interactions']
+BOT_HANDLE_COLUMNS_TO_EDIT = ['Total chats', 'Conversations Fully Handeled by Bot', 'Bot Handle Ratio']
+
+
+def write_output(df, name):
+    """Write an output table as name.csv, or as a typed name.parquet (needs pyarrow) when OUTPUT_FORMAT is "parquet" """
+    if OUTPUT_FORMAT == "parquet":
+        df.to_parquet(f"{name}.parquet", index=False)
     else:
-        print("Failed to fetch data from Tableau")
-        exit(1)
-    df=pd.read_csv(CSV_PATH)
-    current_datetime = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    day_month_year = datetime.now().strftime("%Y-%m-%d")
+        df.to_csv(f"{name}.csv", index=False)
+
+
+class DepartmentOutputs:
+    """
+    Writer of a department's raw outputs: FRT, non-initial and repetitions tables, response
+    sketches and events
+    
+    add() takes the results of a whole run, or those of one batch of whole conversations
+    after another (streaming): their tables are appended to what earlier batches wrote,
+    their sketches merged and their events stored as one more part, so no batch is kept.
+    close() finishes the files and saves the sketches.
+    """
+
+    def __init__(self, department, skill_filter, bot_filter, report, day_month_year, current_datetime):
+        self.department = department
+        self.skill_filter = skill_filter
+        self.bot_filter = bot_filter
+        self.report = report
+        self.frt_name = f"FRT_Raw_{department}_{day_month_year}"
+        self.non_initial_name = f"non_initial_response_times_{department}_{day_month_year}"
+        self.repetitions_name = f"repetitions_df_{department.lower()}_{current_datetime}"
+        self.batches = 0
+        self.sketches = {}
+        self._started = set()  # Outputs holding a table with columns
+        self._parquet_writers = {}
+
+    def _write(self, df, name, output_format=None):
+        """Write df as name.csv or name.parquet, or append it to what earlier batches wrote there"""
+        output_format = output_format or OUTPUT_FORMAT
+        if not len(df.columns):
+            # A batch without responses only creates the file when nothing was written yet
+            if name not in self._started and output_format == "parquet":
+                df.to_parquet(f"{name}.parquet", index=False)
+            elif name not in self._started:
+                df.to_csv(f"{name}.csv", index=False)
+            return
+        append = name in self._started
+        self._started.add(name)
+        if output_format == "parquet":
+            if pa is None:
+                raise ImportError('OUTPUT_FORMAT = "parquet" needs pyarrow (pip install pyarrow)')
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if not append:
+                self._parquet_writers[name] = pq.ParquetWriter(f"{name}.parquet", table.schema)
+            writer = self._parquet_writers[name]
+            writer.write_table(table.cast(writer.schema))
+        else:
+            df.to_csv(f"{name}.csv", index=False, mode='a' if append else 'w', header=not append)
 
-    df = preprocess_data(df, output_filename=f'{DEPARTMENT}_{day_month_year}.csv')
+    def add(self, FRT_df_Raw, non_initial_response_times, repetitions_df):
+        department = self.department
+        rows_in = len(FRT_df_Raw) + len(non_initial_response_times)
+        if RESPONSE_SKETCHES:
+            with self.report.stage("response sketches", rows_in=rows_in) as stage:
+                stage['department'] = department
+                sketches = build_sketches(FRT_df_Raw, non_initial_response_times, self.skill_filter, self.bot_filter)
+                for key, sketch in sketches.items():
+                    self.sketches[key] = self.sketches[key].merge(sketch) if key in self.sketches else sketch
+
+        with self.report.stage("write outputs", rows_in=rows_in) as stage:
+            stage['department'] = department
+            self._write(export_response_table(FRT_df_Raw, first_response=True), self.frt_name)
+            self._write(export_response_table(non_initial_response_times, first_response=False), self.non_initial_name)
+            if repetitions_df is not None:
+                self._write(repetitions_df, self.repetitions_name, output_format="csv")
+        if EVENT_STORE_DIR:
+            with self.report.stage("append events", rows_in=rows_in) as stage:
+                stage['department'] = department
+                # The event store is a by-product of the run: failing to write it doesn't fail the metrics
+                try:
+                    append_events(EVENT_STORE_DIR, department, FRT_df_Raw, non_initial_response_times, repetitions_df,
+                                  part=self.batches)
+                    stage['succeeded'] = True
+                except Exception as e:
+                    print(f"Could not store the events of {department}: {e}")
+                    stage.update(succeeded=False, error=repr(e))
+        self.batches += 1
+
+    def close(self):
+        if not self.batches:
+            # An empty export still gets its (empty) outputs
+            self.add(pd.DataFrame(), pd.DataFrame(), None)
+        for writer in self._parquet_writers.values():
+            writer.close()
+        if RESPONSE_SKETCHES:
+            with self.report.stage("save sketches") as stage:
+                stage['department'] = self.department
+                save_sketches(self.sketches, self.department, MASTER_CSV_PATH)
+
+
+def run_department(view_name, skill_filter, department, bot_filter=BOT_FILTER, fetched=False, report=None, profile=None):
+    """
+    Fetch, preprocess and compute every metric family for one department
     
-    # Calculate response times
-    FRT_df_Raw = calculate_first_response_times(df)
-    FRT_df_Raw.to_csv(f"FRT_Raw_{DEPARTMENT}_{day_month_year}.csv", index=False)
+    Raw outputs (sorted data, FRT, non-initial and repetitions CSVs) are written as in
+    the single-department run, but nothing is written to the master CSV. With fetched=True
+    the view's CSV was already downloaded and is used as is.
+    
+    Every stage is timed in report. Without one, the run gets its own RunReport (profiled
+    with profile, see instrumentation.py), written to REPORT_DIR when the run ends.
+    
+    Returns:
+        list: Master sheet rows for the response time, repetition and bot handle metrics
+    """
+    return run_view(view_name, {department: skill_filter}, bot_filter, fetched, report, profile)
+
+
+def run_view(view_name, departments, bot_filter=BOT_FILTER, fetched=False, report=None, profile=None):
+    """
+    Fetch and preprocess a view once and compute every metric family for each department reading it
     
-    non_initial_response_times = calculate_subsequent_response_times(df)
-    non_initial_response_times.to_csv(f"non_initial_response_times_{DEPARTMENT}_{day_month_year}.csv", index=False)
+    Like run_department, for a dict of department -> skill filter. The departments share
+    the response times and get their metrics from one compute_skill_matrix pass, derived
+    from one per-conversation summary; their sorted data is written once, named after the view.
     
-    # Compute metrics and push to master CSV
-    master_csv_path = "Master Sheet.csv"  # Change this to your actual master CSV path
+    Returns:
+        list: Master sheet rows of every department
+    """
+    if report is not None:
+        return _compute_view(view_name, departments, bot_filter, fetched, report)
+    report = RunReport(next(iter(departments)) if len(departments) == 1 else view_name, profile=profile)
+    try:
+        return _compute_view(view_name, departments, bot_filter, fetched, report)
+    except Exception as e:
+        report.fail(e)
+        raise
+    finally:
+        if REPORT_DIR:
+            report.write(REPORT_DIR)
+
+
+def _compute_view(view_name, departments, bot_filter, fetched, report):
+    csv_path = f"{view_name}.csv"
+    current_datetime = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    day_month_year = datetime.now().strftime("%Y-%m-%d")
+    use_backend = COMPUTE_BACKEND != "pandas" and not (CHECKPOINT_DIR or STREAMING_CHUNKSIZE)
+    use_cache = CACHE_DIR and not (CHECKPOINT_DIR or STREAMING_CHUNKSIZE or use_backend)
+    mode = ("incremental" if CHECKPOINT_DIR else "streaming" if STREAMING_CHUNKSIZE else COMPUTE_BACKEND if use_backend
+            else "cache" if use_cache else "full")
+    sorted_name = f'{next(iter(departments)) if len(departments) == 1 else view_name}_{day_month_year}'
+    report.details.update(view_name=view_name, skill_filters=departments, bot_filter=bot_filter, mode=mode)
+
+    def fetch(view_name, csv_path):
+        with report.stage("fetch") as stage:
+            stage['succeeded'] = fetch_data(view_name, csv_path)
+            if stage['succeeded']:
+                stage['bytes'] = os.path.getsize(csv_path)
+        return stage['succeeded']
+
+    if not use_cache and not fetched:
+        print(f"Fetching data for view: {view_name}")
+        if not fetch(view_name, csv_path):
+            raise RuntimeError(f"Failed to fetch data from Tableau for view: {view_name}")
+
+    # department -> (FRT, non-initial, metrics, repetition metrics, repetitions_df, bot handle metrics)
+    results = {}
+    # department -> (metrics, repetition metrics, bot handle metrics), once its outputs are written
+    figures = {}
+    if CHECKPOINT_DIR:
+        if REPETITION_SIMILARITY is not None:
+            # Checkpoints keep hashes of the bot texts, not the texts near duplicates are found on
+            raise ValueError("REPETITION_SIMILARITY is not supported by incremental runs (CHECKPOINT_DIR)")
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        for department, skill_filter in departments.items():
+            with report.stage("compute_incremental_metrics") as stage:
+                stage['department'] = department
+                results[department] = compute_incremental_metrics(
+                    csv_path, os.path.join(CHECKPOINT_DIR, f"{department}.pkl"), skill_filter, bot_filter
+                )
+    elif STREAMING_CHUNKSIZE:
+        # Sort and deduplicate on disk, then compute batch by batch of whole conversations; each
+        # batch's outputs are written as soon as it is computed, so only running totals are kept
+        for department, skill_filter in departments.items():
+            with report.stage("compute_streaming_metrics") as stage:
+                stage['department'] = department
+                outputs = DepartmentOutputs(department, skill_filter, bot_filter, report, day_month_year, current_datetime)
+                figures[department] = compute_streaming_metrics(
+                    csv_path, skill_filter, bot_filter, chunksize=STREAMING_CHUNKSIZE,
+                    output_filename=f'{department}_{day_month_year}.csv', on_batch=outputs.add,
+                    similarity=REPETITION_SIMILARITY
+                )
+                outputs.close()
+    elif use_backend:
+        if REPETITION_SIMILARITY is not None:
+            raise ValueError(f"REPETITION_SIMILARITY is only supported by the pandas backend, not {COMPUTE_BACKEND}")
+        with report.stage(f"compute_view ({COMPUTE_BACKEND})") as stage:
+            matrix, FRT_df_Raw, non_initial_response_times, repetition_tables = compute_view(
+                csv_path, departments, bot_filter, COMPUTE_BACKEND, sorted_output=f'{sorted_name}.csv',
+                memory_limit=BACKEND_MEMORY_LIMIT
+            )
+            stage['rows_out'] = len(matrix)
+        print(f"Computed metrics:\n{matrix.to_string()}")
+        for department, metrics in matrix.to_dict('index').items():
+            results[department] = (FRT_df_Raw, non_initial_response_times, metrics,
+                                   metrics, repetition_tables[department], metrics)
+    else:
+        if use_cache:
+            # The sorted CSV is copied from the cache with the times as exported; Parquet is written typed
+            with report.stage("load_view") as stage:
+                df = load_view(view_name, csv_path, None if fetched else fetch, CACHE_DIR, CACHE_MAX_AGE,
+                               sorted_output=f'{sorted_name}.csv' if OUTPUT_FORMAT != "parquet" else None)
+                stage['rows_out'] = len(df)
+            if OUTPUT_FORMAT == "parquet":
+                with report.stage("write sorted data", rows_in=len(df)):
+                    write_output(df, sorted_name)
+        else:
+            with report.stage("read_csv") as stage:
+                df = pd.read_csv(csv_path)
+                stage['rows_out'] = len(df)
+            with report.stage("preprocess_data", rows_in=len(df)) as stage:
+                df = preprocess_data(df, output_filename=f'{sorted_name}.csv')
+                stage['rows_out'] = len(df)
+        cache = ResultCache(None, None)
+        if RESULT_CACHE_DIR:
+            with report.stage("frame_fingerprint", rows_in=len(df)):
+                cache = ResultCache(RESULT_CACHE_DIR, frame_fingerprint(df), RESULT_CACHE_MAX_BYTES)
+        frames = []
+
+        def conversation_frame():
+            # Only built when a result isn't cached
+            if not frames:
+                with report.stage("ConversationFrame", rows_in=len(df)) as stage:
+                    frames.append(ConversationFrame(df))
+                    stage['rows_out'] = len(frames[0].conversation_ids)
+            return frames[0]
+
+        def response_times():
+            if RESPONSE_WORKERS == 1:
+                return calculate_response_times(conversation_frame())
+            return calculate_response_times_parallel(conversation_frame(), RESPONSE_WORKERS)
+
+        with report.stage("calculate_response_times", rows_in=len(df)) as stage:
+            FRT_df_Raw, non_initial_response_times = cache.get('response_times', {}, response_times)
+            stage.update(rows_out=len(FRT_df_Raw) + len(non_initial_response_times), cached=cache.last_hit)
+        with report.stage("compute_skill_matrix", rows_in=len(df)) as stage:
+            matrix, repetition_tables = cache.get(
+                'skill_matrix', {'skills': departments, 'bot_filter': bot_filter, 'similarity': REPETITION_SIMILARITY},
+                lambda: compute_skill_matrix(
+                    conversation_frame(), departments, bot_filter, (FRT_df_Raw, non_initial_response_times),
+                    repetition_tables=True, similarity=REPETITION_SIMILARITY
+                )
+            )
+            stage.update(rows_out=len(matrix), cached=cache.last_hit)
+        print(f"Computed metrics:\n{matrix.to_string()}")
+        for department, metrics in matrix.to_dict('index').items():
+            results[department] = (FRT_df_Raw, non_initial_response_times, metrics,
+                                   metrics, repetition_tables[department], metrics)
+
+    for department, (FRT_df_Raw, non_initial_response_times, metrics,
+                     repetition_metrics, repetitions_df, bot_handle_metrics) in results.items():
+        outputs = DepartmentOutputs(department, departments[department], bot_filter, report, day_month_year, current_datetime)
+        outputs.add(FRT_df_Raw, non_initial_response_times, repetitions_df)
+        outputs.close()
+        figures[department] = (metrics, repetition_metrics, bot_handle_metrics)
+
+    rows = []
+    for department, (metrics, repetition_metrics, bot_handle_metrics) in figures.items():
+        rows += [
+            master_row(metrics, department, COLUMNS_TO_EDIT),
+            master_row(repetition_metrics, department, REPETITION_COLUMNS_TO_EDIT),
+            master_row(bot_handle_metrics, department, BOT_HANDLE_COLUMNS_TO_EDIT),
+        ]
+    return rows
+
+
+def run_batch(departments, master_csv_path, max_workers=None):
+    """
+    Run every department's pipeline in parallel worker processes and write all of
+    their rows to the master CSV in one go
     
-    # Specify which columns to edit (optional - if None, all metrics will be added)
-    columns_to_edit = ['AVG initial', 'AVG non_initial', 'Count of >=4 mins initial', 'Count of >=4 mins non_initial']
+    All views are downloaded concurrently, and each view is handed to a worker as soon as
+    it has arrived, so computing overlaps with the remaining downloads. Departments reading
+    the same view are computed together in one pass (see run_view). A department that
+    fails is reported and skipped; the others are still written.
     
-    metrics = compute_and_push_metrics(
-        frt_df=FRT_df_Raw,
-        non_initial_df=non_initial_response_times,
-        master_csv_path=master_csv_path,
-        columns_to_edit=columns_to_edit,
-        skill_filter=SKILL_FILTER,
-        bot_filter=BOT_FILTER,
-        department=DEPARTMENT
-    )
+    Returns:
+        list: The master sheet rows that were written
+    """
+    rows = []
+    report = RunReport("batch")
+    report.details.update(departments=[config["department"] for config in departments], max_workers=max_workers)
+    start = time.perf_counter()
+    view_departments = _view_departments(departments)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        views = {view_name: f"{view_name}.csv" for view_name in view_departments}
+        for view_name, csv_path, status in iter_fetched_views(views):
+            report.record(f"fetch {view_name}", time.perf_counter() - start, status=status)
+            names = ", ".join(view_departments[view_name])
+            if status == "failed":
+                print(f"Department {names} failed: could not fetch view {view_name}")
+                continue
+            future = executor.submit(run_view, view_name, view_departments[view_name], fetched=True, profile=PROFILE)
+            futures[future] = names
+        for future in as_completed(futures):
+            try:
+                rows.extend(future.result())
+                print(f"Finished department: {futures[future]}")
+            except Exception as e:
+                print(f"Department {futures[future]} failed: {e}")
+                report.fail(e)
+
+    if rows:
+        with report.stage("write master rows", rows_in=len(rows)):
+            write_master_rows(rows, master_csv_path)
+    if REPORT_DIR:
+        report.write(REPORT_DIR)
+    return rows
+
+
+def _view_departments(departments):
+    """Group department configs by view: view name -> {department: skill filter}"""
+    view_departments = {}
+    for config in departments:
+        view_departments.setdefault(config["view_name"], {})[config["department"]] = config["skill_filter"]
+    return view_departments
+
+
+def _load_messages(view_name):
+    """Fetch a view and return its preprocessed messages (through the typed cache when CACHE_DIR is set)"""
+    csv_path = f"{view_name}.csv"
+    if CACHE_DIR:
+        return load_view(view_name, csv_path, fetch_data, CACHE_DIR, CACHE_MAX_AGE)
+    print(f"Fetching data for view: {view_name}")
+    if not fetch_data(view_name, csv_path):
+        raise RuntimeError(f"Failed to fetch data from Tableau for view: {view_name}")
+    return preprocess_data(pd.read_csv(csv_path), output_filename=None)
+
+
+def _backfill_day(day, messages, departments, bot_filter):
+    """
+    Compute every department's metrics for the conversations started on one day (run in a worker process)
     
-    # Compute repetition metrics and push to master CSV
-    repetition_columns_to_edit = ['% of Repetition', 'Chats with repetitions', 'Total chats with bot interactions']
+    Returns:
+        tuple: (master sheet rows dated day, dict of department -> response sketches)
+    """
+    frame = ConversationFrame(messages)
+    response_times = calculate_response_times(frame)
+    matrix = compute_skill_matrix(frame, departments, bot_filter, response_times)
+    rows, sketches = [], {}
+    for department, metrics in matrix.to_dict('index').items():
+        rows += [
+            master_row(metrics, department, COLUMNS_TO_EDIT, date=day),
+            master_row(metrics, department, REPETITION_COLUMNS_TO_EDIT, date=day),
+            master_row(metrics, department, BOT_HANDLE_COLUMNS_TO_EDIT, date=day),
+        ]
+        if RESPONSE_SKETCHES:
+            sketches[department] = build_sketches(*response_times, departments[department], bot_filter)
+    return rows, sketches
+
+
+def run_backfill(departments, master_csv_path, start=None, end=None, max_workers=None):
+    """
+    Rebuild the master sheet rows of past days from the current exports
     
-    repetition_metrics = compute_and_push_metrics_Repetitions(
-        df=df,
-        master_csv_path=master_csv_path,
-        columns_to_edit=repetition_columns_to_edit,
-        skill_filter=SKILL_FILTER,
-        department=DEPARTMENT
-    )
+    Every view is fetched and preprocessed once and split by the day each conversation
+    started (see split_by_day). Each day is then computed in a worker process, with all
+    of its departments in one compute_skill_matrix pass. All rows are upserted in one
+    write, replacing the rows those days already had.
     
-    # Compute bot handle metrics and push to master CSV
-    bot_handle_columns_to_edit = ['Total chats', 'Conversations Fully Handeled by Bot', 'Bot Handle Ratio']
+    Args:
+        departments: Department configs, like DEPARTMENTS
+        master_csv_path: Path to the master CSV file
+        start: First day to rebuild (date or "YYYY-MM-DD"; default: the export's first day)
+        end: Last day to rebuild (default: yesterday, so today's regular row is left alone)
+        max_workers: Worker processes (None: one per CPU)
     
-    bot_handle_metrics = compute_and_push_metrics_BotHandle(
-        df=df,
-        master_csv_path=master_csv_path,
-        columns_to_edit=bot_handle_columns_to_edit,
-        skill_filter=SKILL_FILTER,
-        department=DEPARTMENT
-    )
+    Returns:
+        list: The master sheet rows that were written
+    """
+    end = end or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    report = RunReport("backfill")
+    report.details.update(departments=[config["department"] for config in departments], start=start, end=end)
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for view_name, view_departments in _view_departments(departments).items():
+            try:
+                with report.stage("load view") as stage:
+                    stage['view_name'] = view_name
+                    df = _load_messages(view_name)
+                    stage['rows_out'] = len(df)
+            except RuntimeError as e:
+                print(e)
+                report.fail(e)
+                continue
+            with report.stage("split_by_day", rows_in=len(df)) as stage:
+                days = split_by_day(df, start, end)
+                stage['rows_out'] = len(days)
+            print(f"Backfilling {len(days)} days of {view_name} for {', '.join(view_departments)}")
+            for day, messages in days.items():
+                future = executor.submit(_backfill_day, day, messages, view_departments, BOT_FILTER)
+                futures[future] = (day, view_name)
+
+        with report.stage("compute days") as stage:
+            for future in as_completed(futures):
+                day, view_name = futures[future]
+                try:
+                    results.append((day, view_name, *future.result()))
+                except Exception as e:
+                    print(f"Backfill of {view_name} on {day} failed: {e}")
+                    report.fail(e)
+            stage['rows_out'] = len(results)
+
+    rows = []
+    for day, view_name, day_rows, sketches in sorted(results, key=lambda result: result[:2]):
+        rows.extend(day_rows)
+        for department, department_sketches in sketches.items():
+            save_sketches(department_sketches, department, master_csv_path, date=day)
+    if rows:
+        with report.stage("write master rows", rows_in=len(rows)):
+            write_master_rows(rows, master_csv_path)
+    if REPORT_DIR:
+        report.write(REPORT_DIR)
+    return rows
+
+
+def write_master_rows(rows, master_csv_path):
+    """Upsert all rows of a run into the master metrics, saving them to a separate CSV if that fails"""
+    try:
+        if MASTER_BACKEND == "sqlite":
+            with closing(master_store.connect(MASTER_DB_PATH, seed_csv_path=master_csv_path)) as connection:
+                master_store.upsert_rows(connection, rows)
+            print(f"Successfully appended metrics to {MASTER_DB_PATH}")
+            return
+        upsert_master_rows(rows, master_csv_path)
+        print(f"Successfully appended metrics to {master_csv_path}")
+    except Exception as e:
+        print(f"Error appending to master CSV: {e}")
+        # Save metrics to separate CSV as fallback
+        pd.DataFrame(rows).to_csv(f"metrics_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv", index=False)
+        print("Saved metrics to separate CSV as fallback")
+
+
+# Main execution
+if __name__ == "__main__":
+    PROFILE = next((arg.partition("=")[2] or "cprofile" for arg in sys.argv if arg.startswith("--profile")), PROFILE)
+    if "--backfill" in sys.argv:
+        start = next((arg.partition("=")[2] for arg in sys.argv if arg.startswith("--from=")), None)
+        end = next((arg.partition("=")[2] for arg in sys.argv if arg.startswith("--to=")), None)
+        departments = DEPARTMENTS if "--batch" in sys.argv else [
+            {"view_name": VIEW_NAME, "skill_filter": SKILL_FILTER, "department": DEPARTMENT}
+        ]
+        run_backfill(departments, MASTER_CSV_PATH, start, end, max_workers=MAX_WORKERS)
+        sys.exit(0)
+    if "--batch" in sys.argv:
+        run_batch(DEPARTMENTS, MASTER_CSV_PATH, max_workers=MAX_WORKERS)
+        sys.exit(0)
+    if "--export-master" in sys.argv:
+        with closing(master_store.connect(MASTER_DB_PATH)) as connection:
+            master_store.export_master_csv(connection, MASTER_CSV_PATH)
+        sys.exit(0)
+
+    # Fetch, preprocess and compute every metric family, then write them all to the
+    # master CSV in one update (COLUMNS_TO_EDIT etc. select the columns written)
+    report = RunReport(DEPARTMENT, profile=PROFILE)
+    try:
+        rows = run_department(VIEW_NAME, SKILL_FILTER, DEPARTMENT, bot_filter=BOT_FILTER, report=report)
+        print("Data fetched and processed successfully")
+        with report.stage("write master rows", rows_in=len(rows)):
+            write_master_rows(rows, MASTER_CSV_PATH)
+    except RuntimeError as e:
+        print(e)
+        report.fail(e)
+        exit(1)
+    finally:
+        if REPORT_DIR:
+            report.write(REPORT_DIR)
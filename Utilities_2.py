@@ -1,15 +1,233 @@
+import os
+import tempfile
+import numpy as np
 import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime
 
+from near_duplicates import near_duplicate_clusters
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the kernel also runs as plain Python
+    njit = None
+
+NAT = np.iinfo(np.int64).min
+
+# Integer codes used by the response-time kernel (anything else is -1)
+SENDER_ROLES = ['consumer', 'bot', 'agent', 'system']
+MESSAGE_TYPES = ['normal message', 'transfer', 'private message']
+CONSUMER, BOT, AGENT, SYSTEM = range(len(SENDER_ROLES))
+# Sender roles of response-time records (SENDER_ROLES minus consumer)
+RESPONDER_ROLES = SENDER_ROLES[1:]
+# Categorical columns of the response-time records
+RESPONSE_CATEGORIES = ['Sender Role', 'Skill', 'Agent Name']
+NORMAL_MESSAGE, TRANSFER, PRIVATE_MESSAGE = range(len(MESSAGE_TYPES))
+
 def preprocess_data(df, output_filename='MV_2_July_sorted.csv'):
     #sort by conversation id and message sent time
     df=df.sort_values(by=['Conversation ID', 'Message Sent Time'])
     #drop duplicates
     df=df.drop_duplicates(subset=['Conversation ID', 'Message Sent Time'],keep='first')
-    df.to_csv(output_filename,index=False)
+    if output_filename:
+        df.to_csv(output_filename,index=False)
     return df
 
-def calculate_first_response_times(df):
+def split_by_day(df, start=None, end=None):
+    """
+    Split messages by the day their conversation started
+    
+    A conversation belongs to the date of its first 'Message Sent Time', so conversations
+    running past midnight stay whole and their response times come out as in a full run.
+    Conversations without any sent time are left out.
+    
+    Args:
+        df: DataFrame with conversation data (e.g. from preprocess_data)
+        start, end: First and last day to keep (inclusive, dates or "YYYY-MM-DD"; default: all)
+    
+    Returns:
+        dict: datetime.date -> DataFrame of the messages of the conversations started that day
+    """
+    started = pd.to_datetime(df['Message Sent Time']).groupby(df['Conversation ID']).transform('min').dt.normalize()
+    keep = started.notna()
+    if start is not None:
+        keep &= started >= pd.Timestamp(start)
+    if end is not None:
+        keep &= started <= pd.Timestamp(end)
+    return {day.date(): messages for day, messages in df[keep].groupby(started[keep], sort=True)}
+
+def _category_lookup(values, normalize):
+    """
+    Apply normalize to the categories of values once and expand the result to every row
+    
+    normalize receives the categories as an object Series with a trailing NaN, so missing
+    values (code -1) pick up the same result the original per-row string code gave them.
+    """
+    categories = pd.Series(list(values.categories) + [np.nan], dtype=object)
+    return np.asarray(normalize(categories))[values.codes]
+
+def _categorical(values):
+    """Categorical with categories in order of appearance (no sorting of large text columns)"""
+    codes, uniques = pd.factorize(values)
+    if isinstance(uniques.dtype, pd.CategoricalDtype):
+        # Categorical input (typed view cache): use the plain values as categories
+        uniques = uniques.categories.take(uniques.codes)
+    return pd.Categorical.from_codes(codes, uniques)
+
+class ConversationFrame:
+    """
+    Normalized, memory-compact copy of the preprocessed messages
+    
+    Built once after preprocess_data and accepted in place of the DataFrame by the
+    response-time, repetition and bot-handle functions. Messages are grouped by
+    conversation (original order kept within each one), string columns are stored as
+    categoricals so lowercasing and matching run once per distinct value instead of
+    once per message, and 'Message Sent Time' is parsed once into int64 nanoseconds.
+    
+    Attributes:
+        conversation_ids: Index of conversation IDs (sorted, like groupby)
+        conversation_codes: Position in conversation_ids of every message
+        starts: Offset of the first message of every conversation
+        first_seen: Rank of every conversation by first appearance in the source DataFrame
+        timestamps: int64 'Message Sent Time' in nanoseconds (NAT when missing)
+        role: Sender role codes (SENDER_ROLES, -1 for anything else)
+        kind: Message type codes (MESSAGE_TYPES, -1 for anything else)
+        sent_by, message_type, agent_name, text: Categorical columns
+        skill_columns: Categorical for every column with 'skill' in its name
+        message_ids: 'MESSAGE_ID' values, or None when the column is missing
+    """
+
+    def __init__(self, df):
+        df = df[df['Conversation ID'].notna()]
+        first_seen = pd.unique(df['Conversation ID'])
+        df = df.sort_values(by='Conversation ID', kind='stable')
+
+        codes, self.conversation_ids = pd.factorize(df['Conversation ID'])
+        self.conversation_codes = codes.astype(np.int32)
+        conversation_start = np.ones(len(df), dtype=bool)
+        conversation_start[1:] = codes[1:] != codes[:-1]
+        self.starts = np.flatnonzero(conversation_start)
+        self.first_seen = pd.Index(first_seen).get_indexer(self.conversation_ids)
+        self.timestamps = pd.to_datetime(df['Message Sent Time']).to_numpy(dtype='datetime64[ns]').view('int64')
+
+        self.sent_by = _categorical(df['Sent By'])
+        self.message_type = _categorical(df['Message Type'])
+        self.agent_name = _categorical(df['Agent Name '])
+        self.text = _categorical(df['TEXT'])
+        self.skill_columns = {col: _categorical(df[col]) for col in df.columns if 'skill' in col.lower()}
+        self.message_ids = df['MESSAGE_ID'].to_numpy() if 'MESSAGE_ID' in df.columns else None
+
+        normalized = lambda values: values.map(lambda value: str(value).strip().lower())
+        self.role = _category_lookup(
+            self.sent_by, lambda values: pd.Categorical(normalized(values), categories=SENDER_ROLES).codes
+        ).astype(np.int8)
+        self.kind = _category_lookup(
+            self.message_type, lambda values: pd.Categorical(normalized(values), categories=MESSAGE_TYPES).codes
+        ).astype(np.int8)
+
+    def __len__(self):
+        return len(self.conversation_codes)
+
+    def rows(self, positions):
+        """Materialize the messages at the given positions as a DataFrame"""
+        rows = {
+            'Conversation ID': self.conversation_ids[self.conversation_codes[positions]],
+            'Sent By': self.sent_by.take(positions),
+            'Message Type': self.message_type.take(positions),
+            'Skill': self.skill_columns['Skill'].take(positions),
+            'Agent Name ': self.agent_name.take(positions),
+            'TEXT': self.text.take(positions),
+        }
+        rows = {col: np.asarray(values) for col, values in rows.items()}
+        if self.message_ids is not None:
+            rows['MESSAGE_ID'] = self.message_ids[positions]
+        return pd.DataFrame(rows)
+
+    def any_per_conversation(self, flags):
+        """Reduce per-message flags to one flag per conversation"""
+        if not len(self):
+            return np.zeros(0, dtype=bool)
+        return np.logical_or.reduceat(flags, self.starts)
+
+def _filter_response_messages(df):
+    """
+    Keep the messages the response-time rules look at, ordered the way
+    groupby("Conversation ID") visits them (conversations sorted, rows in original order)
+    """
+    message_type = df['Message Type'].str.lower()
+    mask = (
+        (message_type.isin(['normal message', 'transfer'])) |
+        ((message_type == 'private message') & (df['Sent By'].str.lower() == 'system'))
+    ) & df['Conversation ID'].notna()
+    return df[mask].sort_values(by='Conversation ID', kind='stable')
+
+def calculate_first_response_times(df, legacy=False):
+    """
+    Calculate the first response time of every conversation
+    
+    The consumer, transfer and system private message reset rules are applied with
+    grouped cumulative/forward-fill operations over the whole frame instead of a
+    per-row walk of each conversation.
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        legacy: Use the original per-row loop on a DataFrame (kept to check results against)
+    
+    Returns:
+        DataFrame with Conversation Id, Sender Role, Skill, Agent Name, Response Time (mins),
+        Message Id and Message Time (ns) (see response_senders for the Sender names);
+        with legacy, Conversation Id, Sender, Response Time (mins), Message Id
+    """
+    if legacy:
+        return _calculate_first_response_times_loop(df)
+    if isinstance(df, ConversationFrame):
+        # Already encoded, so the response-time kernel is cheaper than regrouping
+        take, role, message_type, conversation_start, named, timestamps = response_inputs(df)
+        response_rows, waiting_rows, first_response, _, _ = run_response_kernel(role, message_type, conversation_start, named)
+        return response_table(take, role, timestamps, response_rows[first_response], waiting_rows[first_response], first_response=True)
+
+    df['Message Sent Time'] = pd.to_datetime(df['Message Sent Time'])
+    group = _filter_response_messages(df)
+    conv_ids = group['Conversation ID']
+    sender = group['Sent By'].str.strip().str.lower()
+    message_type = group['Message Type'].str.strip().str.lower()
+
+    # A conversation starts waiting at its first consumer message
+    is_consumer = sender == 'consumer'
+    consumers_so_far = is_consumer.groupby(conv_ids).cumsum()
+    waiting = consumers_so_far > 0
+
+    # Transfers and system private messages reset the consumer time while waiting
+    is_reset = (message_type == 'transfer') | ((sender == 'system') & (message_type == 'private message'))
+    is_anchor = (is_consumer & (consumers_so_far == 1)) | (is_reset & waiting)
+    anchor_time = group['Message Sent Time'].where(is_anchor).groupby(conv_ids).ffill()
+
+    # The first bot/agent/system message after that is the first response
+    is_response = sender.isin(['bot', 'agent', 'system']) & ~is_reset & waiting
+    first_response = group[is_response].drop_duplicates(subset='Conversation ID', keep='first')
+    anchor_time = anchor_time[first_response.index]
+
+    time_diff = (first_response['Message Sent Time'] - anchor_time).dt.total_seconds() / 60
+    role = pd.Categorical(sender[first_response.index], categories=SENDER_ROLES).codes
+    times = first_response['Message Sent Time'].to_numpy(dtype='datetime64[ns]').view('int64')
+
+    return response_records(
+        first_response['Conversation ID'].to_numpy(),
+        role,
+        first_response['Skill'],
+        first_response['Agent Name '].to_numpy(dtype=object),
+        times,
+        [round(value, 2) for value in time_diff],
+        first_response['MESSAGE_ID'].to_numpy()
+    )
+
+def _calculate_first_response_times_loop(df):
     df['Message Sent Time'] = pd.to_datetime(df['Message Sent Time'])
     response_times = []
 
@@ -62,7 +280,322 @@ def calculate_first_response_times(df):
 
 #Here we calculate response times except the first response time
 
-def calculate_subsequent_response_times(df):
+def _encode_response_messages(group):
+    """
+    Encode filtered messages as the integer arrays the response-time kernel walks
+    
+    Returns:
+        tuple: (role codes, message type codes, conversation start flags, named flags, int64 timestamps)
+    """
+    sender = group['Sent By'].str.strip().str.lower()
+    role = pd.Categorical(sender, categories=SENDER_ROLES).codes.astype('int8')
+    message_type = pd.Categorical(group['Message Type'].str.strip().str.lower(), categories=MESSAGE_TYPES).codes.astype('int8')
+    conv_codes = pd.factorize(group['Conversation ID'])[0]
+    conversation_start = np.ones(len(group), dtype=bool)
+    conversation_start[1:] = conv_codes[1:] != conv_codes[:-1]
+    # An agent reply with an empty name is not recorded and leaves the consumer waiting
+    named = ~((role == AGENT) & (group['Agent Name '] == '').to_numpy(dtype=bool, na_value=False))
+    timestamps = group['Message Sent Time'].to_numpy(dtype='datetime64[ns]').view('int64')
+    return role, message_type, conversation_start, named, timestamps
+
+def _response_kernel(role, message_type, conversation_start, named, initial_waiting, initial_recorded):
+    """
+    Walk the encoded messages once and return the (response row, consumer row) positions
+    of every recorded response, flagging the first response of each conversation
+    
+    Each conversation resumes from initial_waiting (consumer row, -1 when nobody waits)
+    and initial_recorded (first response already seen), and the state it ends in is
+    returned too, so a conversation can be continued over several runs.
+    """
+    n = len(role)
+    response_rows = np.empty(n, dtype=np.int64)
+    waiting_rows = np.empty(n, dtype=np.int64)
+    first_response = np.empty(n, dtype=np.bool_)
+    final_waiting = np.empty(len(initial_waiting), dtype=np.int64)
+    final_recorded = np.empty(len(initial_waiting), dtype=np.bool_)
+    count = 0
+    conversation = -1
+    waiting_since = -1
+    first_response_recorded = False
+    for i in range(n):
+        if conversation_start[i]:
+            if conversation >= 0:
+                final_waiting[conversation] = waiting_since
+                final_recorded[conversation] = first_response_recorded
+            conversation += 1
+            waiting_since = initial_waiting[conversation]
+            first_response_recorded = initial_recorded[conversation]
+        sender = role[i]
+        kind = message_type[i]
+        if sender == CONSUMER and waiting_since < 0:
+            waiting_since = i
+        elif waiting_since < 0:
+            continue
+        # Transfers and system private messages reset the consumer time
+        elif kind == TRANSFER or (sender == SYSTEM and kind == PRIVATE_MESSAGE):
+            waiting_since = i
+        elif sender == BOT or sender == AGENT or sender == SYSTEM:
+            if first_response_recorded and not named[i]:
+                continue
+            response_rows[count] = i
+            waiting_rows[count] = waiting_since
+            first_response[count] = not first_response_recorded
+            count += 1
+            first_response_recorded = True
+            waiting_since = -1
+    if conversation >= 0:
+        final_waiting[conversation] = waiting_since
+        final_recorded[conversation] = first_response_recorded
+    return response_rows[:count], waiting_rows[:count], first_response[:count], final_waiting, final_recorded
+
+_jit_kernel = njit(cache=True)(_response_kernel) if njit is not None else None
+
+def response_inputs(df):
+    """
+    Filter and encode the messages the response-time kernel walks
+    
+    A DataFrame is parsed, filtered and encoded here; a ConversationFrame is already
+    encoded and only needs the message filter applied through its categories. The codes
+    and flags are what run_response_kernel takes, and take and the timestamps what
+    response_table builds the records from.
+    
+    Returns:
+        tuple: (take, role codes, message type codes, conversation start flags, named flags, int64 timestamps)
+        where take(rows) returns the messages at the given kernel positions as a DataFrame
+    """
+    if not isinstance(df, ConversationFrame):
+        df['Message Sent Time'] = pd.to_datetime(df['Message Sent Time'])
+        group = _filter_response_messages(df)
+        return (lambda rows: group.iloc[rows], *_encode_response_messages(group))
+
+    frame = df
+    message_type = lambda test: _category_lookup(frame.message_type, lambda values: test(values.str.lower()))
+    is_system = _category_lookup(frame.sent_by, lambda values: values.str.lower() == 'system')
+    positions = np.flatnonzero(
+        message_type(lambda values: values.isin(['normal message', 'transfer'])) |
+        (message_type(lambda values: values == 'private message') & is_system)
+    )
+    codes = frame.conversation_codes[positions]
+    conversation_start = np.ones(len(positions), dtype=bool)
+    conversation_start[1:] = codes[1:] != codes[:-1]
+    role = frame.role[positions]
+    # An agent reply with an empty name is not recorded and leaves the consumer waiting
+    named = ~((role == AGENT) & _category_lookup(frame.agent_name, lambda values: values == '')[positions])
+
+    def take(rows):
+        # Only the columns of the records, kept categorical
+        rows = positions[rows]
+        return pd.DataFrame({
+            'Conversation ID': frame.conversation_ids[frame.conversation_codes[rows]],
+            'Skill': frame.skill_columns['Skill'].take(rows),
+            'Agent Name ': frame.agent_name.take(rows),
+            'MESSAGE_ID': frame.message_ids[rows],
+        })
+
+    return take, role, frame.kind[positions], conversation_start, named, frame.timestamps[positions]
+
+def run_response_kernel(role, message_type, conversation_start, named, initial_waiting=None, initial_recorded=None):
+    """
+    Run the response-time kernel, compiled with numba when it is installed
+    
+    Args:
+        role, message_type, conversation_start, named: Encoded messages (see response_inputs)
+        initial_waiting: Row of the timestamps each conversation starts waiting from (-1: none);
+            rows past the messages can point at times appended after their timestamps
+        initial_recorded: Whether each conversation's first response was already recorded
+            (conversations start fresh when neither is given)
+    
+    Returns:
+        tuple: (response rows, consumer rows, first response flags, final consumer rows, final recorded flags)
+    """
+    if initial_waiting is None:
+        n_conversations = int(conversation_start.sum())
+        initial_waiting = np.full(n_conversations, -1, dtype=np.int64)
+        initial_recorded = np.zeros(n_conversations, dtype=bool)
+    if _jit_kernel is not None:
+        return _jit_kernel(role, message_type, conversation_start, named, initial_waiting, initial_recorded)
+    return _response_kernel(
+        role.tolist(), message_type.tolist(), conversation_start.tolist(), named.tolist(),
+        initial_waiting.tolist(), initial_recorded.tolist()
+    )
+
+def _response_minutes(timestamps, response_rows, waiting_rows):
+    """Response time in minutes rounded to 2 decimals (NaN when either time is missing)"""
+    return minutes_between(timestamps[response_rows], timestamps[waiting_rows])
+
+def minutes_between(response_time, waiting_time):
+    """
+    Minutes from int64 waiting to response times (ns), rounded to 2 decimals (NaN when either is NAT)
+    
+    Every engine rounds response times here, so they match the records to the last digit.
+    """
+    missing = (response_time == NAT) | (waiting_time == NAT)
+    minutes = np.where(missing, np.nan, (response_time - waiting_time) / 1e9 / 60)
+    return [round(value, 2) for value in minutes.tolist()]
+
+def _normalized_categorical(values):
+    """Categorical of str(value).strip().lower() (missing values become 'nan'), normalizing each distinct value once"""
+    values = _categorical(values)
+    normalized = pd.Series(list(values.categories) + [np.nan], dtype=object).map(lambda value: str(value).strip().lower())
+    codes, uniques = pd.factorize(normalized)
+    return pd.Categorical.from_codes(codes[values.codes], uniques)
+
+def response_records(conversation_ids, roles, skills, agent_names, times, minutes, message_ids):
+    """
+    Response-time records with typed columns, whichever engine found the responses
+    
+    Args:
+        conversation_ids: 'Conversation ID' of every response
+        roles: Responder role codes (BOT, AGENT or SYSTEM)
+        skills: 'Skill' of every response (normalized here)
+        agent_names: 'Agent Name ' of every response (kept for agents only)
+        times: int64 'Message Sent Time' of every response in nanoseconds
+        minutes: Response times (see minutes_between)
+        message_ids: 'MESSAGE_ID' of every response
+    """
+    is_agent = roles == AGENT
+    return pd.DataFrame({
+        "Conversation Id": conversation_ids,
+        "Sender Role": pd.Categorical.from_codes(np.asarray(roles, dtype=np.int64) - 1, RESPONDER_ROLES),
+        "Skill": _normalized_categorical(skills),
+        "Agent Name": _categorical(pd.Series(np.where(is_agent, np.asarray(agent_names, dtype=object), np.nan), dtype=object)),
+        "Response Time (mins)": minutes,
+        "Message Id": message_ids,
+        "Message Time (ns)": np.asarray(times, dtype=np.int64),
+    })
+
+def response_table(take, role, timestamps, response_rows, waiting_rows, first_response, minutes=None):
+    """
+    Build the response-time records for the given kernel positions
+    
+    take and timestamps come from response_inputs, the positions from run_response_kernel.
+    first_response is kept for the callers; the records are the same for first and
+    later responses, only their Sender names (see response_senders) differ. minutes,
+    when already computed, are the response times of the positions.
+    """
+    responses = take(response_rows)
+    if minutes is None:
+        minutes = _response_minutes(timestamps, response_rows, waiting_rows)
+    return response_records(
+        responses['Conversation ID'].to_numpy(),
+        role[response_rows],
+        responses['Skill'],
+        responses['Agent Name '].to_numpy(dtype=object),
+        timestamps[response_rows],
+        minutes,
+        responses['MESSAGE_ID'].to_numpy()
+    )
+
+def _sender_name(role, skill, agent_name, first_response):
+    if role == 'bot':
+        return 'BOT' + '_' + skill
+    if role == 'agent':
+        if pd.isna(agent_name):
+            return np.nan
+        return agent_name + '_' + skill if first_response else agent_name
+    return 'System'
+
+def response_senders(responses, first_response):
+    """
+    'Sender' of every response-time record, as the original outputs named them
+    
+    Bots are "BOT_<skill>", agents "<Agent Name>_<skill>" for first responses and
+    "<Agent Name>" afterwards, and system messages "System". Each name is built once per
+    distinct (role, skill, agent) and returned as a categorical Series, so str methods on
+    it run once per distinct sender. Tables that already have a Sender column (legacy
+    outputs, CSVs read back) return it as is.
+    
+    Args:
+        responses: Output of calculate_first_response_times, calculate_subsequent_response_times or calculate_response_times
+        first_response: Whether the responses are first responses
+    """
+    if 'Sender' in responses.columns:
+        return responses['Sender']
+    columns = [_categorical(responses[col]) for col in RESPONSE_CATEGORIES]
+    key = np.zeros(len(responses), dtype=np.int64)
+    for values in columns:
+        key = key * (len(values.categories) + 1) + values.codes + 1
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    names = [
+        _sender_name(role, skill, agent_name, first_response)
+        for role, skill, agent_name in zip(*[np.asarray(values.take(first), dtype=object) for values in columns])
+    ]
+    codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+    return pd.Series(pd.Categorical.from_codes(codes[inverse.ravel()], uniques), index=responses.index, name='Sender')
+
+def has_senders(responses):
+    """Whether a response-time table has senders (records or a Sender column)"""
+    return 'Sender' in responses.columns or 'Sender Role' in responses.columns
+
+def export_response_table(responses, first_response):
+    """
+    A response-time table in the exported layout: Conversation Id, Sender, Response Time (mins), Message Id
+    """
+    if 'Sender Role' not in responses.columns:
+        return responses
+    return pd.DataFrame({
+        "Conversation Id": responses['Conversation Id'].to_numpy(),
+        "Sender": response_senders(responses, first_response).to_numpy(dtype=object),
+        "Response Time (mins)": responses['Response Time (mins)'].to_numpy(),
+        "Message Id": responses['Message Id'].to_numpy()
+    })
+
+def concat_response_tables(tables):
+    """Concatenate response-time tables, keeping the record columns categorical"""
+    tables = [table for table in tables if table is not None]
+    if not tables:
+        return pd.DataFrame()
+    result = pd.concat(tables, ignore_index=True)
+    for col in RESPONSE_CATEGORIES:
+        if col in result.columns and not isinstance(result[col].dtype, pd.CategoricalDtype):
+            result[col] = _categorical(result[col])
+    return result
+
+def calculate_subsequent_response_times(df, legacy=False):
+    """
+    Calculate every response time after the first one in each conversation
+    
+    The per-conversation state (pending consumer time, first response skipped) is
+    tracked by a single linear pass over integer-coded NumPy arrays.
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        legacy: Use the original per-row loop on a DataFrame (kept to check results against)
+    
+    Returns:
+        DataFrame of response-time records like calculate_first_response_times;
+        with legacy, Conversation Id, Sender, Response Time (mins), Message Id
+    """
+    if legacy:
+        return _calculate_subsequent_response_times_loop(df)
+
+    take, role, message_type, conversation_start, named, timestamps = response_inputs(df)
+    response_rows, waiting_rows, first_response, _, _ = run_response_kernel(role, message_type, conversation_start, named)
+    later = ~first_response
+    return response_table(take, role, timestamps, response_rows[later], waiting_rows[later], first_response=False)
+
+def calculate_response_times(df):
+    """
+    Calculate first and non-initial response times in one pass over each conversation
+    
+    Parses 'Message Sent Time', filters the messages and walks every conversation once,
+    instead of once per output as calculate_first_response_times followed by
+    calculate_subsequent_response_times would.
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+    
+    Returns:
+        tuple: (frt_df, non_initial_df)
+    """
+    take, role, message_type, conversation_start, named, timestamps = response_inputs(df)
+    response_rows, waiting_rows, first_response, _, _ = run_response_kernel(role, message_type, conversation_start, named)
+    later = ~first_response
+    frt_df = response_table(take, role, timestamps, response_rows[first_response], waiting_rows[first_response], first_response=True)
+    non_initial_df = response_table(take, role, timestamps, response_rows[later], waiting_rows[later], first_response=False)
+    return frt_df, non_initial_df
+
+def _calculate_subsequent_response_times_loop(df):
     df['Message Sent Time'] = pd.to_datetime(df['Message Sent Time'])
     response_times = []
 
@@ -119,40 +652,44 @@ def calculate_subsequent_response_times(df):
 
     return pd.DataFrame(response_times)
 
-def compute_and_push_metrics(frt_df, non_initial_df, master_csv_path, columns_to_edit=None, skill_filter="filipina_outside", bot_filter="bot", department="Sales"):
+def compute_metrics(frt_df, non_initial_df, skill_filter="filipina_outside", bot_filter="bot"):
     """
-    Compute metrics from FRT and non-initial response times and append to master CSV
+    Compute metrics from FRT and non-initial response times
     
     Args:
-        frt_df: DataFrame with first response times
-        non_initial_df: DataFrame with non-initial response times  
-        master_csv_path: Path to the master CSV file
-        columns_to_edit: List of column names to edit (e.g., ['AVG initial', 'AVG non_initial', 'Count of >=4 mins'])
+        frt_df: DataFrame with first response times (records or the exported layout)
+        non_initial_df: DataFrame with non-initial response times (records or the exported layout)
         skill_filter: Skill to filter by (default: "filipina_outside")
         bot_filter: Bot filter (default: "bot")
-        department: Department name (default: "Sales")
+    
+    Returns:
+        dict: AVG initial, AVG non_initial, Count of >=4 mins initial, Count of >=4 mins non_initial
     """
     
+    # Sender names are categorical for response-time records, so each match runs once per distinct sender
+    frt_sender = response_senders(frt_df, first_response=True) if has_senders(frt_df) else None
+    non_initial_sender = response_senders(non_initial_df, first_response=False) if has_senders(non_initial_df) else None
+
     # Compute metrics
     metrics = {}
     
     # Average initial response time (only for responses < 4 mins and sender contains the specified skill AND bot)
-    if not frt_df.empty and 'Response Time (mins)' in frt_df.columns and 'Sender' in frt_df.columns:
+    if not frt_df.empty and 'Response Time (mins)' in frt_df.columns and frt_sender is not None:
         filtered_frt = frt_df[
             (frt_df['Response Time (mins)'] < 4) & 
-            (frt_df['Sender'].str.contains(skill_filter, case=False, na=False)) &
-            (frt_df['Sender'].str.contains(bot_filter, case=False, na=False))
+            (frt_sender.str.contains(skill_filter, case=False, na=False)) &
+            (frt_sender.str.contains(bot_filter, case=False, na=False))
         ]
         metrics['AVG initial'] = round(filtered_frt['Response Time (mins)'].mean(), 2) if not filtered_frt.empty else 0
     else:
         metrics['AVG initial'] = 0
     
     # Average non-initial response time (only for responses < 4 mins and sender contains the specified skill AND bot)
-    if not non_initial_df.empty and 'Response Time (mins)' in non_initial_df.columns and 'Sender' in non_initial_df.columns:
+    if not non_initial_df.empty and 'Response Time (mins)' in non_initial_df.columns and non_initial_sender is not None:
         filtered_non_initial = non_initial_df[
             (non_initial_df['Response Time (mins)'] < 4) & 
-            (non_initial_df['Sender'].str.contains(skill_filter, case=False, na=False)) &
-            (non_initial_df['Sender'].str.contains(bot_filter, case=False, na=False))
+            (non_initial_sender.str.contains(skill_filter, case=False, na=False)) &
+            (non_initial_sender.str.contains(bot_filter, case=False, na=False))
         ]
         metrics['AVG non_initial'] = round(filtered_non_initial['Response Time (mins)'].mean(), 2) if not filtered_non_initial.empty else 0
     else:
@@ -160,21 +697,21 @@ def compute_and_push_metrics(frt_df, non_initial_df, master_csv_path, columns_to
     
     # Count of initial responses >= 4 minutes (with skill filtering)
     count_4plus_initial = 0
-    if not frt_df.empty and 'Response Time (mins)' in frt_df.columns and 'Sender' in frt_df.columns:
+    if not frt_df.empty and 'Response Time (mins)' in frt_df.columns and frt_sender is not None:
         filtered_frt_4plus = frt_df[
             (frt_df['Response Time (mins)'] >= 4) & 
-            (frt_df['Sender'].str.contains(skill_filter, case=False, na=False)) &
-            (frt_df['Sender'].str.contains(bot_filter, case=False, na=False))
+            (frt_sender.str.contains(skill_filter, case=False, na=False)) &
+            (frt_sender.str.contains(bot_filter, case=False, na=False))
         ]
         count_4plus_initial = len(filtered_frt_4plus)
     
     # Count of non-initial responses >= 4 minutes (with skill filtering)
     count_4plus_non_initial = 0
-    if not non_initial_df.empty and 'Response Time (mins)' in non_initial_df.columns and 'Sender' in non_initial_df.columns:
+    if not non_initial_df.empty and 'Response Time (mins)' in non_initial_df.columns and non_initial_sender is not None:
         filtered_non_initial_4plus = non_initial_df[
             (non_initial_df['Response Time (mins)'] >= 4) & 
-            (non_initial_df['Sender'].str.contains(skill_filter, case=False, na=False)) &
-            (non_initial_df['Sender'].str.contains(bot_filter, case=False, na=False))
+            (non_initial_sender.str.contains(skill_filter, case=False, na=False)) &
+            (non_initial_sender.str.contains(bot_filter, case=False, na=False))
         ]
         count_4plus_non_initial = len(filtered_non_initial_4plus)
     
@@ -187,79 +724,166 @@ def compute_and_push_metrics(frt_df, non_initial_df, master_csv_path, columns_to
     print(f"  Count of >=4 mins initial: {metrics['Count of >=4 mins initial']}")
     print(f"  Count of >=4 mins non_initial: {metrics['Count of >=4 mins non_initial']}")
     
-    # Append to master CSV
-    try:
-        # Try to load existing master CSV
-        try:
-            master_df = pd.read_csv(master_csv_path)
-        except FileNotFoundError:
-            # Create new master CSV if it doesn't exist
-            master_df = pd.DataFrame()
-        
-        # Add date in the specified format (e.g., "July 01, 2024")
-        current_date = datetime.now()
-        month_name = current_date.strftime("%B")  # Full month name
-        day = current_date.strftime("%d")  # Day with leading zero
-        year = current_date.strftime("%Y")  # Full year
-        metrics['Date'] = f"{month_name} {day}, {year}"
-        metrics['Department'] = department
-        
-        # If columns_to_edit is specified, only update those columns
-        if columns_to_edit:
-            # Create a new row with only the specified columns
-            new_row = {}
-            for col in columns_to_edit:
-                if col in metrics:
-                    new_row[col] = metrics[col]
-                else:
-                    new_row[col] = 0  # Default value if column doesn't exist in metrics
-            
-            # Add date and department
-            new_row['Date'] = metrics['Date']
-            new_row['Department'] = metrics['Department']
-            
-            # Check if row with same department and date already exists
-            existing_row_mask = (master_df['Department'] == new_row['Department']) & (master_df['Date'] == new_row['Date'])
-            
-            if existing_row_mask.any():
-                # Always overwrite existing row (regardless of null values)
-                existing_row_idx = existing_row_mask.idxmax()
-                for col in columns_to_edit:
-                    if col in new_row:
-                        master_df.at[existing_row_idx, col] = new_row[col]
-                print(f"Overwrote existing row for {new_row['Department']} on {new_row['Date']}")
-            else:
-                # Append new row since it doesn't exist
-                master_df = pd.concat([master_df, pd.DataFrame([new_row])], ignore_index=True)
-                print(f"Added new row for {new_row['Department']} on {new_row['Date']}")
+    return metrics
+
+def master_sheet_date(date=None):
+    """Date in the master sheet format (e.g., "July 01, 2024"), today by default"""
+    current_date = date or datetime.now()
+    month_name = current_date.strftime("%B")  # Full month name
+    day = current_date.strftime("%d")  # Day with leading zero
+    year = current_date.strftime("%Y")  # Full year
+    return f"{month_name} {day}, {year}"
+
+def master_row(metrics, department, columns_to_edit=None, date=None):
+    """
+    Build a master sheet row from computed metrics
+    
+    Args:
+        metrics: Dictionary of computed metrics
+        department: Department name
+        columns_to_edit: Columns to write (missing metrics default to 0); all metrics if None
+        date: Date of the row (default: today)
+    
+    Returns:
+        dict: The selected metric columns plus Date and Department
+    """
+    if columns_to_edit:
+        row = {col: metrics.get(col, 0) for col in columns_to_edit}
+    else:
+        row = {col: value for col, value in metrics.items() if col not in ['Date', 'Department']}
+    row['Date'] = master_sheet_date(date)
+    row['Department'] = department
+    return row
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on "<path>.lock" so concurrent runs update the file one at a time
+    
+    Used as `with file_lock(path):` around a read-modify-write of path; the lock file is
+    left in place for the next run.
+    """
+    with open(f"{path}.lock", 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
         else:
-            # Check if row with same department and date already exists
-            existing_row_mask = (master_df['Department'] == metrics['Department']) & (master_df['Date'] == metrics['Date'])
-            
-            if existing_row_mask.any():
-                # Always overwrite existing row (regardless of null values)
-                existing_row_idx = existing_row_mask.idxmax()
-                for col in metrics.keys():
-                    if col not in ['Date', 'Department']:  # Don't overwrite these
-                        master_df.at[existing_row_idx, col] = metrics[col]
-                print(f"Overwrote existing row for {metrics['Department']} on {metrics['Date']}")
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK gives up after 10 seconds, keep waiting
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
             else:
-                # Append new row since it doesn't exist
-                master_df = pd.concat([master_df, pd.DataFrame([metrics])], ignore_index=True)
-                print(f"Added new row for {metrics['Department']} on {metrics['Date']}")
-        
-        master_df.to_csv(master_csv_path, index=False)
-        print(f"Successfully appended metrics to {master_csv_path}")
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def replace_file(path, write):
+    """
+    Call write(tmp_path) on a temp file next to path and rename it into place, so readers
+    never see a partial file (the temp file is removed if write fails)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def replace_csv(df, path):
+    """Write df to a temp file next to path and rename it into place, so readers never see a partial file"""
+    replace_file(path, lambda tmp_path: df.to_csv(tmp_path, index=False))
+
+def upsert_master_rows(rows, master_csv_path):
+    """
+    Write master sheet rows keyed on (Department, Date) in one atomic update of the CSV
+    
+    The read-modify-write runs under a file lock and the new sheet is renamed into place,
+    so concurrent runs can't lose each other's updates. Existing rows are always overwritten
+    (regardless of null values) for the columns each row carries; rows that don't exist yet
+    are appended.
+    
+    Args:
+        rows: List of row dictionaries from master_row
+        master_csv_path: Path to the master CSV file
+    """
+    with file_lock(master_csv_path):
+        _upsert_master_rows(rows, master_csv_path)
+
+def _upsert_master_rows(rows, master_csv_path):
+    # Try to load existing master CSV
+    try:
+        master_df = pd.read_csv(master_csv_path)
+    except FileNotFoundError:
+        # Create new master CSV if it doesn't exist
+        master_df = pd.DataFrame(columns=['Department', 'Date'])
+    
+    # Merge rows for the same (Department, Date) so each one is looked up once
+    merged_rows = {}
+    for row in rows:
+        merged_rows.setdefault((row['Department'], row['Date']), {}).update(row)
+    
+    new_rows = []
+    for row in merged_rows.values():
+        # Check if row with same department and date already exists
+        existing_row_mask = (master_df['Department'] == row['Department']) & (master_df['Date'] == row['Date'])
         
+        if existing_row_mask.any():
+            existing_row_idx = existing_row_mask.idxmax()
+            for col, value in row.items():
+                if col not in ['Date', 'Department']:  # Don't overwrite these
+                    master_df.at[existing_row_idx, col] = value
+            print(f"Overwrote existing row for {row['Department']} on {row['Date']}")
+        else:
+            new_rows.append(row)
+            print(f"Added new row for {row['Department']} on {row['Date']}")
+    
+    if new_rows:
+        # Append new rows since they don't exist
+        master_df = pd.concat([master_df, pd.DataFrame(new_rows)], ignore_index=True)
+    
+    replace_csv(master_df, master_csv_path)
+
+def _push_metrics(metrics, master_csv_path, columns_to_edit, department, fallback_prefix):
+    """Upsert one department's metrics into the master CSV, saving them to a separate CSV on failure"""
+    row = master_row(metrics, department, columns_to_edit)
+    metrics['Date'] = row['Date']
+    metrics['Department'] = department
+    try:
+        upsert_master_rows([row], master_csv_path)
+        print(f"Successfully appended {fallback_prefix.replace('_', ' ')}metrics to {master_csv_path}")
     except Exception as e:
         print(f"Error appending to master CSV: {e}")
         # Save metrics to separate CSV as fallback
         metrics_df = pd.DataFrame([metrics])
-        metrics_df.to_csv(f"metrics_{department.lower()}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv", index=False)
-        print("Saved metrics to separate CSV as fallback")
-    
+        metrics_df.to_csv(f"{fallback_prefix}metrics_{department.lower()}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv", index=False)
+        print(f"Saved {fallback_prefix.replace('_', ' ')}metrics to separate CSV as fallback")
     return metrics
 
+def compute_and_push_metrics(frt_df, non_initial_df, master_csv_path, columns_to_edit=None, skill_filter="filipina_outside", bot_filter="bot", department="Sales"):
+    """
+    Compute metrics from FRT and non-initial response times and append to master CSV
+    
+    Args:
+        frt_df: DataFrame with first response times
+        non_initial_df: DataFrame with non-initial response times  
+        master_csv_path: Path to the master CSV file
+        columns_to_edit: List of column names to edit (e.g., ['AVG initial', 'AVG non_initial', 'Count of >=4 mins'])
+        skill_filter: Skill to filter by (default: "filipina_outside")
+        bot_filter: Bot filter (default: "bot")
+        department: Department name (default: "Sales")
+    """
+    metrics = compute_metrics(frt_df, non_initial_df, skill_filter, bot_filter)
+    return _push_metrics(metrics, master_csv_path, columns_to_edit, department, fallback_prefix="")
+
 def count_conversations_with_skills(df):
     # Convert skill columns to lowercase for case-insensitive matching
     skill_columns = [col for col in df.columns if 'skill' in col.lower()]
@@ -291,7 +915,162 @@ def count_conversations_with_skills(df):
     
     return len(conversations_with_skills)
 
-def get_bot_repetitions(df, skill_filter="filipina_outside"):
+def repetition_messages(frame, skill_filter):
+    """
+    Per-message flags the repetition metrics of a ConversationFrame are built from
+    
+    Returns:
+        tuple: (Skill contains skill_filter, bot 'normal message' with that skill and a TEXT)
+    """
+    has_skill = _category_lookup(
+        frame.skill_columns['Skill'], lambda values: values.str.contains(skill_filter, na=False, case=False)
+    ).astype(bool)
+    return has_skill, _bot_normal_messages(frame) & has_skill
+
+def _bot_normal_messages(frame):
+    """Per-message flag: bot 'normal message' with a TEXT, whatever its skill"""
+    return (
+        _category_lookup(frame.sent_by, lambda values: values.str.lower() == 'bot') &
+        _category_lookup(frame.message_type, lambda values: values.str.lower() == 'normal message') &
+        (frame.text.codes >= 0)
+    ).astype(bool)
+
+def _near_duplicate_counts(counts, texts, similarity):
+    """
+    Merge the counts of near-duplicate bot TEXTs of every conversation into clusters
+    
+    Args:
+        counts: DataFrame with 'conversation', 'count' and 'first' per distinct bot TEXT of a conversation
+        texts: The TEXT of every row of counts
+        similarity: Estimated Jaccard similarity from which two TEXTs are near-duplicates
+    
+    Returns:
+        DataFrame: 'conversation', 'count' (messages), 'first' and 'variants' (distinct TEXTs)
+        of every cluster of two or more distinct TEXTs
+    """
+    # Only conversations with two or more distinct bot TEXTs can have near-duplicates
+    candidates = counts['conversation'].duplicated(keep=False).to_numpy()
+    counts = counts[candidates]
+    clusters = near_duplicate_clusters(counts['conversation'].to_numpy(), np.asarray(texts, dtype=object)[candidates], similarity)
+    clusters = counts.groupby(clusters, sort=False).agg(
+        conversation=('conversation', 'first'), count=('count', 'sum'), first=('first', 'min'), variants=('count', 'size')
+    )
+    return clusters[clusters['variants'] > 1].reset_index(drop=True)
+
+def _repetition_table(counts, take, near_duplicates=None):
+    """
+    repetitions_df from the repeated (conversation, TEXT) counts, most repeated first within each conversation
+    
+    Args:
+        counts: DataFrame with 'conversation', 'count' and 'first' of every repeated TEXT
+        take: take(positions) -> DataFrame of the bot messages at those positions
+        near_duplicates: Output of _near_duplicate_counts, listed with 'Match' "near" next
+            to the exact repetitions (None: no 'Match' and 'Variants' columns)
+    """
+    if near_duplicates is not None:
+        counts = pd.concat([
+            counts[['conversation', 'count', 'first']].assign(match='exact', variants=1),
+            near_duplicates.assign(match='near'),
+        ], ignore_index=True)
+    if not len(counts):
+        return None
+    counts = counts.assign(order=-counts['count']).sort_values(by=['conversation', 'order', 'first'])
+    first_occurrences = take(counts['first'].to_numpy())
+    repetitions_df = pd.DataFrame({
+        'Conversation ID': first_occurrences['Conversation ID'].to_numpy(),
+        'Message Id': first_occurrences['MESSAGE_ID'].to_numpy() if 'MESSAGE_ID' in first_occurrences.columns else '',
+        'Message': first_occurrences['TEXT'].to_numpy(),
+        'Repetition Count': counts['count'].to_numpy()
+    })
+    if near_duplicates is not None:
+        repetitions_df['Match'] = counts['match'].to_numpy()
+        repetitions_df['Variants'] = counts['variants'].to_numpy()
+    return repetitions_df
+
+def get_bot_repetitions(df, skill_filter="filipina_outside", legacy=False, verbose=True, similarity=None):
+    """
+    Get bot repetition metrics from conversation data
+    
+    Bot messages are counted per (Conversation ID, hashed TEXT) in one grouped pass,
+    keeping the position of each message's first occurrence.
+    
+    With a similarity threshold, the distinct bot TEXTs of every conversation are also
+    clustered with MinHash/LSH (see near_duplicates.py), so messages that only differ by
+    a name, number or spacing are found too. Every cluster of two or more distinct TEXTs
+    is listed in repetitions_df next to the exact repetitions, with 'Match' "near", the
+    messages of the whole cluster as 'Repetition Count' and its distinct TEXTs as
+    'Variants'. The returned figures still count exact repetitions only.
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        skill_filter: Skill to filter by (default: "filipina_outside")
+        legacy: Use the original per-conversation loop (kept to check results against)
+        verbose: Print the results (default: True)
+        similarity: Similarity threshold (0-1) of near-duplicates, e.g. 0.8 (default: None, exact repeats only)
+    
+    Returns:
+        tuple: (repetitions_df, percentage, chats_with_reps, total_chats)
+    """
+    if legacy:
+        return _get_bot_repetitions_loop(df, skill_filter)
+
+    if isinstance(df, ConversationFrame):
+        has_skill, is_bot_message = repetition_messages(df, skill_filter)
+        conversation_order = df.first_seen[df.conversation_codes]
+        # Get the bot messages, grouped on their TEXT category codes
+        positions = np.flatnonzero(is_bot_message)
+        take = lambda rows: df.rows(positions[rows])
+        text_keys = df.text.codes[positions]
+        text_values = lambda counts: df.text.categories.take(counts['text'].to_numpy())
+    else:
+        has_skill = df['Skill'].str.contains(skill_filter, na=False, case=False).to_numpy(dtype=bool)
+        # Conversations are reported in order of first appearance, like df['Conversation ID'].unique()
+        conversation_order = pd.factorize(df['Conversation ID'])[0]
+        # Get the bot messages, grouped on a hash of their TEXT
+        is_bot_message = (
+            (df['Sent By'].str.lower() == 'bot').to_numpy(dtype=bool, na_value=False) &
+            (df['Message Type'].str.lower() == 'normal message').to_numpy(dtype=bool, na_value=False) &
+            has_skill & (conversation_order >= 0) & df['TEXT'].notna().to_numpy()
+        )
+        bot_messages = df[is_bot_message]
+        take = lambda rows: bot_messages.iloc[rows]
+        text_keys = pd.util.hash_pandas_object(bot_messages['TEXT'], index=False).to_numpy()
+        text_values = lambda counts: bot_messages['TEXT'].to_numpy(dtype=object)[counts['first'].to_numpy()]
+
+    counts = pd.DataFrame({
+        'conversation': conversation_order[is_bot_message],
+        'text': text_keys,
+        'position': np.arange(len(text_keys))
+    })
+    # Count occurrences of each message and keep its first occurrence
+    counts = counts.groupby(['conversation', 'text'], sort=False).agg(
+        count=('position', 'size'), first=('position', 'min')
+    ).reset_index()
+    near_duplicates = None
+    if similarity is not None:
+        near_duplicates = _near_duplicate_counts(counts, text_values(counts), similarity)
+    # Get messages that appear more than once
+    counts = counts[counts['count'] > 1]
+
+    # Create DataFrame from repetition data
+    repetitions_df = _repetition_table(counts, take, near_duplicates)
+    if repetitions_df is None and verbose:
+        print("No repetitions found")
+
+    # Calculate total chats with bot interactions
+    total_chats = len(np.unique(conversation_order[has_skill & (conversation_order >= 0)]))
+
+    chats_with_reps = counts['conversation'].nunique()
+    percentage = (chats_with_reps / total_chats) * 100 if total_chats > 0 else 0
+    
+    if verbose:
+        print(f"% of chats with at least one repetition: {chats_with_reps} / {total_chats} = {percentage:.2f}%")
+        if near_duplicates is not None:
+            print(f"Chats with near-duplicate repetitions: {near_duplicates['conversation'].nunique()} / {total_chats}")
+    
+    return repetitions_df, percentage, chats_with_reps, total_chats
+
+def _get_bot_repetitions_loop(df, skill_filter="filipina_outside"):
     """
     Get bot repetition metrics from conversation data
     
@@ -351,107 +1130,146 @@ def get_bot_repetitions(df, skill_filter="filipina_outside"):
     
     return repetitions_df, percentage, chats_with_reps, total_chats
 
-def compute_and_push_metrics_Repetitions(df, master_csv_path, columns_to_edit=None, skill_filter="filipina_outside", department="Sales"):
+def _near_duplicate_metrics(repetitions_df, total_chats):
+    """Near-duplicate figures next to the repetition metrics, from the 'Match' column of repetitions_df"""
+    near_chats = 0
+    if repetitions_df is not None:
+        near_chats = repetitions_df.loc[repetitions_df['Match'] == 'near', 'Conversation ID'].nunique()
+    percentage = (near_chats / total_chats) * 100 if total_chats > 0 else 0
+    return dict(zip(NEAR_DUPLICATE_COLUMNS, [round(percentage, 2), near_chats]))
+
+def compute_metrics_Repetitions(df, skill_filter="filipina_outside", similarity=None):
     """
-    Compute repetition metrics and push to master CSV
+    Compute repetition metrics
     
     Args:
-        df: DataFrame with conversation data
-        master_csv_path: Path to the master CSV file
-        columns_to_edit: List of column names to edit (e.g., ['% of Repetition', 'Chats with repetitions', 'Total chats with bot interactions'])
+        df: DataFrame or ConversationFrame with conversation data
         skill_filter: Skill to filter by (default: "filipina_outside")
-        department: Department name (default: "Sales")
+        similarity: Similarity threshold of near-duplicate repetitions (see get_bot_repetitions);
+            when set, '% of Near-duplicate Repetition' and 'Chats with near-duplicate repetitions' are added
+    
+    Returns:
+        tuple: (metrics, repetitions_df)
     """
     
     # Get repetition metrics
-    repetitions_df, percentage, chats_with_reps, total_chats = get_bot_repetitions(df, skill_filter)
+    repetitions_df, percentage, chats_with_reps, total_chats = get_bot_repetitions(df, skill_filter, similarity=similarity)
     
     # Compute metrics
     metrics = {}
     metrics['% of Repetition'] = round(percentage, 2)
     metrics['Chats with repetitions'] = chats_with_reps
     metrics['Total chats with bot interactions'] = total_chats
+    if similarity is not None:
+        metrics.update(_near_duplicate_metrics(repetitions_df, total_chats))
     
     print(f"Computed repetition metrics:")
     print(f"  % of Repetition: {metrics['% of Repetition']}%")
     print(f"  Chats with repetitions: {metrics['Chats with repetitions']}")
     print(f"  Total chats with bot interactions: {metrics['Total chats with bot interactions']}")
+    if similarity is not None:
+        print(f"  % of Near-duplicate Repetition: {metrics['% of Near-duplicate Repetition']}%")
     
-    # Append to master CSV
-    try:
-        # Try to load existing master CSV
-        try:
-            master_df = pd.read_csv(master_csv_path)
-        except FileNotFoundError:
-            # Create new master CSV if it doesn't exist
-            master_df = pd.DataFrame()
-        
-        # Add date in the specified format (e.g., "July 01, 2024")
-        current_date = datetime.now()
-        month_name = current_date.strftime("%B")  # Full month name
-        day = current_date.strftime("%d")  # Day with leading zero
-        year = current_date.strftime("%Y")  # Full year
-        metrics['Date'] = f"{month_name} {day}, {year}"
-        metrics['Department'] = department
-        repetitions_df.to_csv(f"repetitions_df_{department.lower()}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv", index=False)  
-        
-        # If columns_to_edit is specified, only update those columns
-        if columns_to_edit:
-            # Create a new row with only the specified columns
-            new_row = {}
-            for col in columns_to_edit:
-                if col in metrics:
-                    new_row[col] = metrics[col]
-                else:
-                    new_row[col] = 0  # Default value if column doesn't exist in metrics
-            
-            # Add date and department
-            new_row['Date'] = metrics['Date']
-            new_row['Department'] = metrics['Department']
-            
-            # Check if row with same department and date already exists
-            existing_row_mask = (master_df['Department'] == new_row['Department']) & (master_df['Date'] == new_row['Date'])
-            
-            if existing_row_mask.any():
-                # Always overwrite existing row (regardless of null values)
-                existing_row_idx = existing_row_mask.idxmax()
-                for col in columns_to_edit:
-                    if col in new_row:
-                        master_df.at[existing_row_idx, col] = new_row[col]
-                print(f"Overwrote existing row for {new_row['Department']} on {new_row['Date']}")
-            else:
-                # Append new row since it doesn't exist
-                master_df = pd.concat([master_df, pd.DataFrame([new_row])], ignore_index=True)
-                print(f"Added new row for {new_row['Department']} on {new_row['Date']}")
-        else:
-            # Check if row with same department and date already exists
-            existing_row_mask = (master_df['Department'] == metrics['Department']) & (master_df['Date'] == metrics['Date'])
-            
-            if existing_row_mask.any():
-                # Always overwrite existing row (regardless of null values)
-                existing_row_idx = existing_row_mask.idxmax()
-                for col in metrics.keys():
-                    if col not in ['Date', 'Department']:  # Don't overwrite these
-                        master_df.at[existing_row_idx, col] = metrics[col]
-                print(f"Overwrote existing row for {metrics['Department']} on {metrics['Date']}")
-            else:
-                # Append new row since it doesn't exist
-                master_df = pd.concat([master_df, pd.DataFrame([metrics])], ignore_index=True)
-                print(f"Added new row for {metrics['Department']} on {metrics['Date']}")
-        
-        master_df.to_csv(master_csv_path, index=False)
-        print(f"Successfully appended repetition metrics to {master_csv_path}")
-        
-    except Exception as e:
-        print(f"Error appending to master CSV: {e}")
-        # Save metrics to separate CSV as fallback
-        metrics_df = pd.DataFrame([metrics])
-        metrics_df.to_csv(f"repetition_metrics_{department.lower()}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv", index=False)
-        print("Saved repetition metrics to separate CSV as fallback")
+    return metrics, repetitions_df
+
+def compute_and_push_metrics_Repetitions(df, master_csv_path, columns_to_edit=None, skill_filter="filipina_outside", department="Sales", similarity=None, output_dir=None):
+    """
+    Compute repetition metrics and push to master CSV
     
-    return metrics
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        master_csv_path: Path to the master CSV file
+        columns_to_edit: List of column names to edit (e.g., ['% of Repetition', 'Chats with repetitions', 'Total chats with bot interactions'])
+        skill_filter: Skill to filter by (default: "filipina_outside")
+        department: Department name (default: "Sales")
+        similarity: Similarity threshold of near-duplicate repetitions (default: None, exact repeats only)
+        output_dir: Directory the repetitions CSV is written to (default: the working directory)
+    """
+    metrics, repetitions_df = compute_metrics_Repetitions(df, skill_filter, similarity)
+    if repetitions_df is not None:
+        repetitions_path = f"repetitions_df_{department.lower()}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
+        repetitions_df.to_csv(os.path.join(output_dir or '', repetitions_path), index=False)
+    return _push_metrics(metrics, master_csv_path, columns_to_edit, department, fallback_prefix="repetition_")
+
+def bot_handle_skill(frame, skill_filter):
+    """Per-message flag: any skill column of a ConversationFrame contains skill_filter"""
+    skill_match = lambda values: values.astype(str).str.lower().str.contains(skill_filter, na=False)
+    has_skill = np.zeros(len(frame), dtype=bool)
+    for values in frame.skill_columns.values():
+        has_skill |= _category_lookup(values, skill_match).astype(bool)
+    return has_skill
 
-def get_bot_handle_metrics(df, skill_filter="gpt_cc_prospect"):
+def get_bot_handle_metrics(df, skill_filter="gpt_cc_prospect", legacy=False, verbose=True):
+    """
+    Get bot handle metrics from conversation data
+    
+    The has-skill and has-agent flags are computed once per message and reduced to
+    one row per conversation with a single grouped aggregation.
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        skill_filter: Skill to filter by (default: "gpt_cc_prospect")
+        legacy: Use the original per-conversation loop (kept to check results against)
+        verbose: Print the results (default: True)
+    
+    Returns:
+        tuple: (total_chats, fully_bot_conversations, bot_handle_ratio)
+    """
+    if legacy:
+        return _get_bot_handle_metrics_loop(df, skill_filter)
+
+    # Convert skill columns to lowercase for case-insensitive matching
+    if isinstance(df, ConversationFrame):
+        skill_columns = list(df.skill_columns)
+    else:
+        skill_columns = [col for col in df.columns if 'skill' in col.lower()]
+    
+    if not skill_columns:
+        print("No skill columns found in the dataset")
+        return 0, 0, 0
+    
+    if verbose:
+        print(f"Found skill columns: {skill_columns}")
+    
+    if isinstance(df, ConversationFrame):
+        has_skill = bot_handle_skill(df, skill_filter)
+    else:
+        skill_match = lambda values: values.astype(str).str.lower().str.contains(skill_filter, na=False)
+        has_skill = np.zeros(len(df), dtype=bool)
+        for col in skill_columns:
+            has_skill |= skill_match(df[col]).to_numpy(dtype=bool)
+    
+    # Agent interactions are identified by a non-empty "Agent Name " column
+    if isinstance(df, ConversationFrame):
+        conversations = pd.DataFrame({
+            'has_skill': df.any_per_conversation(has_skill),
+            'has_agent': df.any_per_conversation(df.agent_name.codes >= 0)
+        })
+        total_chats = len(df.conversation_ids)
+    else:
+        conversations = pd.DataFrame({
+            'has_skill': has_skill,
+            'has_agent': df['Agent Name '].notna().to_numpy()
+        }).groupby(df['Conversation ID'].to_numpy()).any()
+        total_chats = df['Conversation ID'].nunique()
+    
+    total_chats_with_skill = int(conversations['has_skill'].sum())
+    # Fully bot-handled conversations have the skill and no Agent interaction
+    fully_bot_conversations = int((conversations['has_skill'] & ~conversations['has_agent']).sum())
+    
+    # Calculate bot handle ratio
+    if skill_filter == "filipina_outside" or "maidsat" in skill_filter:
+        total_chats = total_chats_with_skill
+    bot_handle_ratio = (fully_bot_conversations / total_chats) * 100 if total_chats > 0 else 0
+    
+    if verbose:
+        print(f"Total chats with {skill_filter} skill: {total_chats_with_skill}")
+        print(f"Conversations handled fully by bot: {fully_bot_conversations}")
+        print(f"Bot Handle Ratio: {bot_handle_ratio:.2f}%")
+    
+    return total_chats, fully_bot_conversations, bot_handle_ratio
+
+def _get_bot_handle_metrics_loop(df, skill_filter="gpt_cc_prospect"):
     """
     Get bot handle metrics from conversation data
     
@@ -519,16 +1337,16 @@ def get_bot_handle_metrics(df, skill_filter="gpt_cc_prospect"):
     
     return total_chats, len(fully_bot_conversations), bot_handle_ratio
 
-def compute_and_push_metrics_BotHandle(df, master_csv_path, columns_to_edit=None, skill_filter="gpt_cc_prospect", department="Sales"):
+def compute_metrics_BotHandle(df, skill_filter="gpt_cc_prospect"):
     """
-    Compute bot handle metrics and push to master CSV
+    Compute bot handle metrics
     
     Args:
-        df: DataFrame with conversation data
-        master_csv_path: Path to the master CSV file
-        columns_to_edit: List of column names to edit (e.g., ['Total chats', 'Conversations Fully Handeled by Bot', 'Bot Handle Ratio'])
-        skill_filter: Skill to filter by (default: "filipina_outside")
-        department: Department name (default: "Sales")
+        df: DataFrame or ConversationFrame with conversation data
+        skill_filter: Skill to filter by (default: "gpt_cc_prospect")
+    
+    Returns:
+        dict: Total chats, Conversations Fully Handeled by Bot, Bot Handle Ratio
     """
     
     # Get bot handle metrics
@@ -545,75 +1363,366 @@ def compute_and_push_metrics_BotHandle(df, master_csv_path, columns_to_edit=None
     print(f"  Conversations Fully Handeled by Bot: {metrics['Conversations Fully Handeled by Bot']}")
     print(f"  Bot Handle Ratio: {metrics['Bot Handle Ratio']}%")
     
-    # Append to master CSV
-    try:
-        # Try to load existing master CSV
-        try:
-            master_df = pd.read_csv(master_csv_path)
-        except FileNotFoundError:
-            # Create new master CSV if it doesn't exist
-            master_df = pd.DataFrame()
-        
-        # Add date in the specified format (e.g., "July 01, 2024")
-        current_date = datetime.now()
-        month_name = current_date.strftime("%B")  # Full month name
-        day = current_date.strftime("%d")  # Day with leading zero
-        year = current_date.strftime("%Y")  # Full year
-        metrics['Date'] = f"{month_name} {day}, {year}"
-        metrics['Department'] = department
-        
-        # If columns_to_edit is specified, only update those columns
-        if columns_to_edit:
-            # Create a new row with only the specified columns
-            new_row = {}
-            for col in columns_to_edit:
-                if col in metrics:
-                    new_row[col] = metrics[col]
-                else:
-                    new_row[col] = 0  # Default value if column doesn't exist in metrics
-            
-            # Add date and department
-            new_row['Date'] = metrics['Date']
-            new_row['Department'] = metrics['Department']
-            
-            # Check if row with same department and date already exists
-            existing_row_mask = (master_df['Department'] == new_row['Department']) & (master_df['Date'] == new_row['Date'])
-            
-            if existing_row_mask.any():
-                # Always overwrite existing row (regardless of null values)
-                existing_row_idx = existing_row_mask.idxmax()
-                for col in columns_to_edit:
-                    if col in new_row:
-                        master_df.at[existing_row_idx, col] = new_row[col]
-                print(f"Overwrote existing row for {new_row['Department']} on {new_row['Date']}")
-            else:
-                # Append new row since it doesn't exist
-                master_df = pd.concat([master_df, pd.DataFrame([new_row])], ignore_index=True)
-                print(f"Added new row for {new_row['Department']} on {new_row['Date']}")
+    return metrics
+
+def compute_and_push_metrics_BotHandle(df, master_csv_path, columns_to_edit=None, skill_filter="gpt_cc_prospect", department="Sales"):
+    """
+    Compute bot handle metrics and push to master CSV
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        master_csv_path: Path to the master CSV file
+        columns_to_edit: List of column names to edit (e.g., ['Total chats', 'Conversations Fully Handeled by Bot', 'Bot Handle Ratio'])
+        skill_filter: Skill to filter by (default: "filipina_outside")
+        department: Department name (default: "Sales")
+    """
+    metrics = compute_metrics_BotHandle(df, skill_filter)
+    return _push_metrics(metrics, master_csv_path, columns_to_edit, department, fallback_prefix="bot_handle_")
+
+# Columns of compute_skill_matrix: the response time, repetition and bot handle metrics
+SKILL_MATRIX_COLUMNS = [
+    'AVG initial', 'AVG non_initial', 'Count of >=4 mins initial', 'Count of >=4 mins non_initial',
+    '% of Repetition', 'Chats with repetitions', 'Total chats with bot interactions',
+    'Total chats', 'Conversations Fully Handeled by Bot', 'Bot Handle Ratio',
+]
+# Added after the repetition metrics when near-duplicate repetitions are detected too
+NEAR_DUPLICATE_COLUMNS = ['% of Near-duplicate Repetition', 'Chats with near-duplicate repetitions']
+
+def _skill_membership(values, skills, match):
+    """
+    Match every distinct value of a categorical against every skill once
+    
+    Returns:
+        ndarray: bool (categories + 1) x skills, where the last row is for missing values
+        (code -1), so membership[values.codes] gives the flags of every row
+    """
+    categories = pd.Series(list(values.categories) + [np.nan], dtype=object)
+    membership = np.zeros((len(categories), len(skills)), dtype=bool)
+    for k, skill in enumerate(skills):
+        membership[:, k] = np.asarray(match(categories, skill), dtype=bool)
+    return membership
+
+def _skill_bot_responses(responses, first_response, skills, bot_filter):
+    """
+    bool responses x skills: whether the Sender contains the skill and the bot filter, i.e. the
+    responses compute_metrics counts (every distinct Sender is matched once)
+    """
+    sender = _categorical(response_senders(responses, first_response))
+    membership = _skill_membership(sender, skills, lambda values, skill: (
+        values.str.contains(skill, case=False, na=False) & values.str.contains(bot_filter, case=False, na=False)
+    ))
+    # Missing senders (code -1) use the last row of membership
+    return membership[np.where(sender.codes < 0, len(membership) - 1, sender.codes)]
+
+def _has_response_times(responses):
+    return not responses.empty and 'Response Time (mins)' in responses.columns and has_senders(responses)
+
+def response_matrix(responses, first_response, skills, bot_filter):
+    """
+    AVG (< 4 mins) and count of >= 4 mins per skill, as compute_metrics filters the responses
+    
+    Args:
+        responses: Response-time records (first responses when first_response)
+        skills: Skill filters, one list entry per skill
+    
+    Returns:
+        tuple: (list of averages, list of counts), in the order of skills
+    """
+    averages = [0] * len(skills)
+    slow_counts = [0] * len(skills)
+    if not _has_response_times(responses):
+        return averages, slow_counts
+    skill_bot = _skill_bot_responses(responses, first_response, skills, bot_filter)
+    minutes = responses['Response Time (mins)'].to_numpy(dtype=np.float64)
+    fast, slow = minutes < 4, minutes >= 4
+    for k in range(len(skills)):
+        selected = minutes[fast & skill_bot[:, k]]
+        if len(selected):
+            averages[k] = round(selected.sum() / len(selected), 2)
+        slow_counts[k] = int((slow & skill_bot[:, k]).sum())
+    return averages, slow_counts
+
+def _repetition_counts(frame, skills, similarity=None):
+    """
+    Repeated bot TEXTs of every skill from one grouping of the bot messages
+    
+    Returns:
+        tuple: (list of (counts, near_duplicates) per skill, as _repetition_table takes them,
+        with conversations numbered in order of first appearance; take)
+    """
+    skill = frame.skill_columns['Skill']
+    membership = _skill_membership(skill, skills, lambda values, skill: values.str.contains(skill, na=False, case=False))
+    conversation_order = frame.first_seen[frame.conversation_codes]
+    positions = np.flatnonzero(_bot_normal_messages(frame))
+    # Count every (conversation, TEXT, Skill value) once; a skill's counts are the sums over its Skill values
+    groups = pd.DataFrame({
+        'conversation': conversation_order[positions],
+        'text': frame.text.codes[positions],
+        'skill': skill.codes[positions],
+        'position': np.arange(len(positions))
+    }).groupby(['conversation', 'text', 'skill'], sort=False).agg(
+        count=('position', 'size'), first=('position', 'min')
+    ).reset_index()
+
+    repetitions = []
+    for k in range(len(skills)):
+        counts = groups[membership[groups['skill'].to_numpy(), k]].groupby(['conversation', 'text'], sort=False).agg(
+            count=('count', 'sum'), first=('first', 'min')
+        ).reset_index()
+        near_duplicates = None
+        if similarity is not None:
+            near_duplicates = _near_duplicate_counts(
+                counts, frame.text.categories.take(counts['text'].to_numpy()), similarity
+            )
+        repetitions.append((counts[counts['count'] > 1], near_duplicates))
+    return repetitions, lambda rows: frame.rows(positions[rows])
+
+def _conversation_skill_flags(frame, skills):
+    """
+    Skill flags of every conversation, from its distinct skill values
+    
+    Returns:
+        tuple: bool conversations x skills arrays: any skill column contains the skill (matched
+        like the bot handle metrics), and 'Skill' contains it (like the repetition metrics)
+    """
+    n_conversations = len(frame.conversation_ids)
+    has_skill = np.zeros((n_conversations, len(skills)), dtype=bool)
+    bot_interactions = np.zeros((n_conversations, len(skills)), dtype=bool)
+    if not frame.skill_columns:
+        return has_skill, bot_interactions
+    columns = list(frame.skill_columns.values())
+    pairs = pd.DataFrame({i: values.codes for i, values in enumerate(columns)})
+    pairs['conversation'] = frame.conversation_codes
+    pairs = pairs.drop_duplicates()
+    conversations = pairs['conversation'].to_numpy()
+
+    skill_match = lambda values, skill: values.astype(str).str.lower().str.contains(skill, na=False)
+    memberships = [_skill_membership(values, skills, skill_match) for values in columns]
+    skill_column = list(frame.skill_columns).index('Skill') if 'Skill' in frame.skill_columns else None
+    if skill_column is not None:
+        repetition_membership = _skill_membership(
+            columns[skill_column], skills, lambda values, skill: values.str.contains(skill, na=False, case=False)
+        )
+    for k in range(len(skills)):
+        matched = np.zeros(len(pairs), dtype=bool)
+        for i, membership in enumerate(memberships):
+            matched |= membership[pairs[i].to_numpy(), k]
+        has_skill[conversations[matched], k] = True
+        if skill_column is not None:
+            bot_interactions[conversations[repetition_membership[pairs[skill_column].to_numpy(), k]], k] = True
+    return has_skill, bot_interactions
+
+# Columns of conversation_summary, then SUMMARY_SKILL_COLUMNS for every skill, named "<column> [<skill>]"
+SUMMARY_COLUMNS = [
+    'Messages', 'Consumer Messages', 'Bot Messages', 'Agent Messages', 'System Messages',
+    'First Consumer Time', 'First Response Time', 'First Response Role', 'First Response (mins)',
+    'Responses', 'Has Agent',
+]
+# 'Skill Bot' responses are those compute_metrics counts (Sender contains the skill and the bot filter);
+# 'Slow Skill Bot non_initial' counts the non-initial ones of >= 4 mins
+SUMMARY_SKILL_COLUMNS = [
+    'Has Skill', 'Bot Interactions', 'Repeated Texts', 'Skill Bot First Response', 'Slow Skill Bot non_initial',
+]
+# Added after 'Repeated Texts' when near-duplicate repetitions are detected too
+NEAR_DUPLICATE_SUMMARY_COLUMN = 'Near-duplicate Groups'
+
+def _summary_column(column, label):
+    return f"{column} [{label}]"
+
+def _conversation_summary(frame, labels, skills, bot_filter, response_times, repetitions):
+    n_conversations = len(frame.conversation_ids)
+    codes = frame.conversation_codes.astype(np.int64)
+    summary = {'Messages': np.bincount(codes, minlength=n_conversations)}
+    known = frame.role >= 0
+    role_counts = np.bincount(
+        codes[known] * len(SENDER_ROLES) + frame.role[known], minlength=n_conversations * len(SENDER_ROLES)
+    ).reshape(n_conversations, len(SENDER_ROLES))
+    for i, role in enumerate(SENDER_ROLES):
+        summary[f"{role.capitalize()} Messages"] = role_counts[:, i]
+    # Messages are in conversation order, so the first consumer message of each conversation comes first
+    consumers = np.flatnonzero(frame.role == CONSUMER)
+    first_consumer = np.full(n_conversations, NAT, dtype=np.int64)
+    conversations, first = np.unique(codes[consumers], return_index=True)
+    first_consumer[conversations] = frame.timestamps[consumers[first]]
+    summary['First Consumer Time'] = first_consumer.view('datetime64[ns]')
+
+    first_time = np.full(n_conversations, NAT, dtype=np.int64)
+    first_role = np.full(n_conversations, -1, dtype=np.int64)
+    first_minutes = np.full(n_conversations, np.nan)
+    responses = np.zeros(n_conversations, dtype=np.int64)
+    skill_bot_first = np.zeros((n_conversations, len(skills)), dtype=bool)
+    slow_non_initial = np.zeros((n_conversations, len(skills)), dtype=np.int64)
+    for table, first_response in zip(response_times, [True, False]):
+        if not _has_response_times(table):
+            continue
+        rows = frame.conversation_ids.get_indexer(table['Conversation Id'])
+        responses += np.bincount(rows, minlength=n_conversations)
+        minutes = table['Response Time (mins)'].to_numpy(dtype=np.float64)
+        skill_bot = _skill_bot_responses(table, first_response, skills, bot_filter)
+        if first_response:
+            first_minutes[rows] = minutes
+            skill_bot_first[rows] = skill_bot
+            if 'Message Time (ns)' in table.columns:
+                first_time[rows] = table['Message Time (ns)'].to_numpy(dtype=np.int64)
+            if 'Sender Role' in table.columns:
+                first_role[rows] = pd.Categorical(table['Sender Role'], categories=RESPONDER_ROLES).codes
         else:
-            # Check if row with same department and date already exists
-            existing_row_mask = (master_df['Department'] == metrics['Department']) & (master_df['Date'] == metrics['Date'])
-            
-            if existing_row_mask.any():
-                # Always overwrite existing row (regardless of null values)
-                existing_row_idx = existing_row_mask.idxmax()
-                for col in metrics.keys():
-                    if col not in ['Date', 'Department']:  # Don't overwrite these
-                        master_df.at[existing_row_idx, col] = metrics[col]
-                print(f"Overwrote existing row for {metrics['Department']} on {metrics['Date']}")
-            else:
-                # Append new row since it doesn't exist
-                master_df = pd.concat([master_df, pd.DataFrame([metrics])], ignore_index=True)
-                print(f"Added new row for {metrics['Department']} on {metrics['Date']}")
-        
-        master_df.to_csv(master_csv_path, index=False)
-        print(f"Successfully appended bot handle metrics to {master_csv_path}")
-        
-    except Exception as e:
-        print(f"Error appending to master CSV: {e}")
-        # Save metrics to separate CSV as fallback
-        metrics_df = pd.DataFrame([metrics])
-        metrics_df.to_csv(f"bot_handle_metrics_{department.lower()}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv", index=False)
-        print("Saved bot handle metrics to separate CSV as fallback")
+            for k in range(len(skills)):
+                slow_non_initial[:, k] = np.bincount(rows[skill_bot[:, k] & (minutes >= 4)], minlength=n_conversations)
+    summary['First Response Time'] = first_time.view('datetime64[ns]')
+    summary['First Response Role'] = pd.Categorical.from_codes(first_role, RESPONDER_ROLES)
+    summary['First Response (mins)'] = first_minutes
+    summary['Responses'] = responses
+    # Agent interactions are identified by a non-empty "Agent Name " column
+    summary['Has Agent'] = frame.any_per_conversation(frame.agent_name.codes >= 0)
+
+    has_skill, bot_interactions = _conversation_skill_flags(frame, skills)
+    # Conversation of every rank of first appearance (the numbering of the repetition counts)
+    by_first_seen = np.empty(n_conversations, dtype=np.int64)
+    by_first_seen[frame.first_seen] = np.arange(n_conversations)
+    for k, label in enumerate(labels):
+        counts, near_duplicates = repetitions[k]
+        conversation_counts = lambda table: np.bincount(
+            by_first_seen[table['conversation'].to_numpy(dtype=np.int64)], minlength=n_conversations
+        )
+        summary[_summary_column('Has Skill', label)] = has_skill[:, k]
+        summary[_summary_column('Bot Interactions', label)] = bot_interactions[:, k]
+        summary[_summary_column('Repeated Texts', label)] = conversation_counts(counts)
+        if near_duplicates is not None:
+            summary[_summary_column(NEAR_DUPLICATE_SUMMARY_COLUMN, label)] = conversation_counts(near_duplicates)
+        summary[_summary_column('Skill Bot First Response', label)] = skill_bot_first[:, k]
+        summary[_summary_column('Slow Skill Bot non_initial', label)] = slow_non_initial[:, k]
+    return pd.DataFrame(summary, index=pd.Index(frame.conversation_ids, name='Conversation ID'))
+
+def _skill_labels(skills):
+    """(labels, skill filters) of a list of skill filters or a dict of department -> skill filter"""
+    if isinstance(skills, dict):
+        return list(skills), list(skills.values())
+    return list(skills), list(skills)
+
+def conversation_summary(df, skills, bot_filter="bot", response_times=None, similarity=None):
+    """
+    One row per conversation with the facts every metric family is derived from
     
-    return metrics
+    The messages are grouped once: message counts per sender role, first consumer time,
+    first response (time, role, minutes), response count and whether an agent took part,
+    then for every skill whether the conversation has it (as the bot handle and the
+    repetition metrics match it), how many bot TEXTs it repeats and which of its
+    responses compute_metrics counts. summary_skill_matrix derives the master sheet
+    metrics from it, so a new conversation-level metric only reads this table.
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        skills: List of skill filters, or dict of department -> skill filter (the column labels)
+        bot_filter: Bot filter for the response times (default: "bot")
+        response_times: (frt_df, non_initial_df) already calculated for df (calculated here if None)
+        similarity: Similarity threshold of near-duplicate repetitions (see get_bot_repetitions),
+            which adds a 'Near-duplicate Groups' column per skill (default: None)
+    
+    Returns:
+        DataFrame: Indexed by Conversation ID (sorted), with SUMMARY_COLUMNS and the
+        SUMMARY_SKILL_COLUMNS of every skill, named "<column> [<skill>]"
+    """
+    labels, skills = _skill_labels(skills)
+    frame = df if isinstance(df, ConversationFrame) else ConversationFrame(df)
+    response_times = response_times if response_times is not None else calculate_response_times(frame)
+    repetitions, _ = _repetition_counts(frame, skills, similarity)
+    return _conversation_summary(frame, labels, skills, bot_filter, response_times, repetitions)
+
+def _summary_matrix(summary, labels, skills, non_initial_averages):
+    columns = SKILL_MATRIX_COLUMNS
+    near_duplicates = any(_summary_column(NEAR_DUPLICATE_SUMMARY_COLUMN, label) in summary.columns for label in labels)
+    if near_duplicates:
+        after_repetitions = SKILL_MATRIX_COLUMNS.index('Total chats with bot interactions') + 1
+        columns = columns[:after_repetitions] + NEAR_DUPLICATE_COLUMNS + columns[after_repetitions:]
+    first_minutes = summary['First Response (mins)'].to_numpy(dtype=np.float64)
+    has_agent = summary['Has Agent'].to_numpy(dtype=bool)
+
+    rows = []
+    for label, skill_filter, non_initial_average in zip(labels, skills, non_initial_averages):
+        column = lambda name: summary[_summary_column(name, label)].to_numpy()
+        skill_bot_first = column('Skill Bot First Response')
+        selected = first_minutes[skill_bot_first & (first_minutes < 4)]
+        initial_average = round(selected.sum() / len(selected), 2) if len(selected) else 0
+        initial_slow = int((skill_bot_first & (first_minutes >= 4)).sum())
+        non_initial_slow = int(column('Slow Skill Bot non_initial').sum())
+
+        total_bot_chats = int(column('Bot Interactions').sum())
+        chats_with_reps = int((column('Repeated Texts') > 0).sum())
+        percentage = (chats_with_reps / total_bot_chats) * 100 if total_bot_chats > 0 else 0
+        repetitions = [round(percentage, 2), chats_with_reps, total_bot_chats]
+        if near_duplicates:
+            near_chats = int((column(NEAR_DUPLICATE_SUMMARY_COLUMN) > 0).sum())
+            near_percentage = (near_chats / total_bot_chats) * 100 if total_bot_chats > 0 else 0
+            repetitions += [round(near_percentage, 2), near_chats]
+
+        has_skill = column('Has Skill')
+        total_chats_with_skill = int(has_skill.sum())
+        # Fully bot-handled conversations have the skill and no Agent interaction
+        fully_bot_conversations = int((has_skill & ~has_agent).sum())
+        total_chats = len(summary)
+        if skill_filter == "filipina_outside" or "maidsat" in skill_filter:
+            total_chats = total_chats_with_skill
+        bot_handle_ratio = (fully_bot_conversations / total_chats) * 100 if total_chats > 0 else 0
+
+        rows.append(dict(zip(columns, [
+            initial_average, non_initial_average, initial_slow, non_initial_slow, *repetitions,
+            total_chats, fully_bot_conversations, round(bot_handle_ratio, 2),
+        ])))
+    return pd.DataFrame(rows, index=pd.Index(labels, name='Skill'), columns=columns)
+
+def summary_skill_matrix(summary, skills, non_initial_df, bot_filter="bot"):
+    """
+    The compute_skill_matrix figures of every skill, from a conversation_summary
+    
+    Every figure counts or selects conversations of the summary, except AVG non_initial:
+    it averages every non-initial response, so it is taken from non_initial_df.
+    
+    Args:
+        summary: Output of conversation_summary for these skills
+        skills: The skills the summary was built for
+        non_initial_df: The non-initial response times the summary was built from
+        bot_filter: Bot filter for the response times (default: "bot")
+    
+    Returns:
+        DataFrame: One row per skill (or department) with SKILL_MATRIX_COLUMNS, plus the
+        NEAR_DUPLICATE_COLUMNS when the summary has near-duplicate groups
+    """
+    labels, skills = _skill_labels(skills)
+    non_initial_averages, _ = response_matrix(non_initial_df, False, skills, bot_filter)
+    return _summary_matrix(summary, labels, skills, non_initial_averages)
+
+def compute_skill_matrix(df, skills, bot_filter="bot", response_times=None, repetition_tables=False, similarity=None):
+    """
+    Compute every metric for several skills (or departments) in one pass over the data
+    
+    Gives the same figures as compute_metrics, compute_metrics_Repetitions and
+    compute_metrics_BotHandle run once per skill, but every distinct Sender and skill value
+    is matched against the skills once, and the messages are grouped once for all of them
+    into a conversation_summary the figures are derived from.
+    
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        skills: List of skill filters, or dict of department -> skill filter
+        bot_filter: Bot filter for the response times (default: "bot")
+        response_times: (frt_df, non_initial_df) already calculated for df (calculated here if None)
+        repetition_tables: Also return the repetitions_df of every skill
+        similarity: Similarity threshold of near-duplicate repetitions (see get_bot_repetitions),
+            which adds the NEAR_DUPLICATE_COLUMNS (default: None, exact repeats only)
+    
+    Returns:
+        DataFrame: One row per skill (or department) with SKILL_MATRIX_COLUMNS; with
+        repetition_tables, a tuple of it and a dict of skill (or department) -> repetitions_df
+    """
+    labels, skills = _skill_labels(skills)
+    frame = df if isinstance(df, ConversationFrame) else ConversationFrame(df)
+    frt_df, non_initial_df = response_times if response_times is not None else calculate_response_times(frame)
+
+    repetitions, take = _repetition_counts(frame, skills, similarity)
+    summary = _conversation_summary(frame, labels, skills, bot_filter, (frt_df, non_initial_df), repetitions)
+    non_initial_averages, _ = response_matrix(non_initial_df, False, skills, bot_filter)
+    matrix = _summary_matrix(summary, labels, skills, non_initial_averages)
+    if repetition_tables:
+        tables = [_repetition_table(counts, take, near_duplicates) for counts, near_duplicates in repetitions]
+        return matrix, dict(zip(labels, tables))
+    return matrix
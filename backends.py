@@ -0,0 +1,299 @@
+import numpy as np
+import pandas as pd
+
+from Utilities_2 import (
+    AGENT,
+    NAT,
+    SKILL_MATRIX_COLUMNS,
+    ConversationFrame,
+    calculate_response_times,
+    compute_skill_matrix,
+    preprocess_data,
+    minutes_between,
+    response_matrix,
+    response_records,
+)
+
+try:
+    import duckdb
+except ImportError:  # duckdb is optional, only the pandas backend is available without it
+    duckdb = None
+
+# Compute backends of the metric pipeline: the response-time, repetition and bot handle
+# figures of a view's departments, from its exported CSV.
+#
+#     matrix, frt_df, non_initial_df, repetition_tables = compute_view("Sales MV.csv", {"Sales MV": "gpt_mv_prospect"}, backend="duckdb")
+#
+# "pandas" is the reference: preprocess_data, ConversationFrame, calculate_response_times
+# and compute_skill_matrix in memory. "duckdb" runs the same rules as SQL on DuckDB, which
+# reads the CSV in parallel, uses every core and spills to disk when the data doesn't fit
+# in memory_limit. Only the response-time records and the repeated bot messages come back
+# as DataFrames. Both give the same figures and tables; test_backends.py and benchmark.py
+# check that on synthetic exports.
+#
+# The response-time walk of the kernel in Utilities_2 becomes window functions: a response
+# ends a wait when it comes from a bot, agent or system (and isn't a reset), and is either
+# the conversation's first response or not from an agent without a name. Those responses
+# split each conversation into segments; a segment's response is recorded when a consumer
+# wrote before it in the segment, timed from that consumer or the last reset after it.
+#
+# Like preprocess_data, the messages are sorted and deduplicated on 'Message Sent Time' as
+# exported (text), which orders non-ISO times (e.g. "7/8/2025 9:05:03 AM") differently from
+# the instants they stand for; the times are parsed, in the format DuckDB's CSV sniffer
+# detects, only to compute the response minutes.
+
+BACKENDS = ('pandas', 'duckdb')
+
+def compute_view(csv_path, departments, bot_filter="bot", backend="pandas", sorted_output=None,
+                 threads=None, memory_limit=None):
+    """
+    Compute every metric of a view's departments from its exported CSV
+
+    Args:
+        csv_path: Exported CSV of the view
+        departments: Dict of department -> skill filter
+        bot_filter: Bot filter for the response times (default: "bot")
+        backend: One of BACKENDS
+        sorted_output: Also write the sorted, deduplicated messages to this CSV
+        threads: Threads DuckDB may use (default: one per core)
+        memory_limit: Memory DuckDB may use before spilling to disk, e.g. "4GB" (default: DuckDB's)
+
+    Returns:
+        tuple: (matrix, frt_df, non_initial_df, repetition_tables) as compute_skill_matrix
+        with repetition_tables=True and calculate_response_times return them
+    """
+    if backend == 'pandas':
+        df = preprocess_data(pd.read_csv(csv_path), output_filename=sorted_output)
+        frame = ConversationFrame(df)
+        frt_df, non_initial_df = calculate_response_times(frame)
+        matrix, repetition_tables = compute_skill_matrix(
+            frame, departments, bot_filter, (frt_df, non_initial_df), repetition_tables=True
+        )
+        return matrix, frt_df, non_initial_df, repetition_tables
+    if backend == 'duckdb':
+        if duckdb is None:
+            raise ImportError("The duckdb backend needs duckdb (pip install duckdb)")
+        return _compute_view_duckdb(csv_path, departments, bot_filter, sorted_output, threads, memory_limit)
+    raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+# str.strip() characters the SQL trims
+_WHITESPACE = "' ' || chr(9) || chr(10) || chr(11) || chr(12) || chr(13)"
+
+_MESSAGES_SQL = """
+CREATE TEMP TABLE messages AS
+SELECT * EXCLUDE (previous_time, duplicate), {sent_time} AS sent_time
+FROM (
+    SELECT *,
+        row_number() OVER conversation_order AS seq,
+        lag("Message Sent Time") OVER conversation_order AS previous_time,
+        row_number() OVER conversation_order > 1 AND "Message Sent Time" IS NOT DISTINCT FROM previous_time AS duplicate
+    FROM (
+        SELECT *, row_number() OVER () AS file_row
+        FROM read_csv($path, header = true, names = $names, types = {{'Message Sent Time': 'VARCHAR'}})
+    )
+    WHERE "Conversation ID" IS NOT NULL
+    WINDOW conversation_order AS (PARTITION BY "Conversation ID" ORDER BY "Message Sent Time" NULLS LAST, file_row)
+)
+-- preprocess_data: one message per (Conversation ID, Message Sent Time), the first in the export
+WHERE NOT duplicate
+"""
+
+_RESPONSES_SQL = f"""
+WITH senders AS (
+    -- Roles and message types are decoded once per distinct value
+    SELECT sent_by, CASE trim(lower(sent_by), {_WHITESPACE})
+        WHEN 'consumer' THEN 0 WHEN 'bot' THEN 1 WHEN 'agent' THEN 2 WHEN 'system' THEN 3 ELSE -1 END AS role
+    FROM (SELECT DISTINCT "Sent By" AS sent_by FROM messages)
+), message_types AS (
+    SELECT message_type, CASE trim(lower(message_type), {_WHITESPACE})
+        WHEN 'normal message' THEN 0 WHEN 'transfer' THEN 1 WHEN 'private message' THEN 2 ELSE -1 END AS kind,
+        lower(message_type) AS lowered
+    FROM (SELECT DISTINCT "Message Type" AS message_type FROM messages)
+), filtered AS (
+    SELECT
+        "Conversation ID" AS conversation, seq, "Skill" AS skill, "Agent Name " AS agent_name, "MESSAGE_ID" AS message_id,
+        coalesce(epoch_ns(sent_time), {NAT}) AS time, role, kind,
+        role = 0 AS is_consumer,
+        -- Transfers and system private messages reset the consumer time
+        kind = 1 OR (role = 3 AND kind = 2) AS is_reset,
+        role IN (1, 2, 3) AND NOT (kind = 1 OR (role = 3 AND kind = 2)) AS is_responder,
+        -- An agent reply with an empty name leaves the consumer waiting, unless it is the first response
+        NOT coalesce(role = {AGENT} AND "Agent Name " = '', false) AS named
+    FROM messages
+    JOIN senders ON "Sent By" IS NOT DISTINCT FROM sent_by
+    JOIN message_types ON "Message Type" IS NOT DISTINCT FROM message_type
+    WHERE lowered IN ('normal message', 'transfer') OR (lowered = 'private message' AND lower("Sent By") = 'system')
+), first_consumers AS (
+    SELECT conversation, min(seq) AS first_consumer_seq FROM filtered WHERE is_consumer GROUP BY conversation
+), first_responses AS (
+    SELECT conversation, min(seq) AS first_response_seq
+    FROM filtered JOIN first_consumers USING (conversation)
+    WHERE is_responder AND seq > first_consumer_seq
+    GROUP BY conversation
+), segments AS (
+    SELECT *, coalesce(sum(ends_wait::INTEGER) OVER (
+        PARTITION BY conversation ORDER BY seq ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+    ), 0) AS segment
+    FROM (
+        SELECT *, is_responder AND (named OR seq IS NOT DISTINCT FROM first_response_seq) AS ends_wait
+        FROM filtered LEFT JOIN first_responses USING (conversation)
+    )
+), waits AS (
+    -- The consumer is waiting from the segment's first consumer message, or the last reset after it
+    SELECT conversation, segment,
+        min(seq) FILTER (WHERE is_consumer) AS waiting_seq,
+        arg_min(time, seq) FILTER (WHERE is_consumer) AS consumer_time,
+        max(seq) FILTER (WHERE is_reset) AS reset_seq,
+        arg_max(time, seq) FILTER (WHERE is_reset) AS reset_time
+    FROM segments
+    GROUP BY conversation, segment
+)
+SELECT conversation, role, skill, agent_name, time,
+    CASE WHEN reset_seq > waiting_seq THEN reset_time ELSE consumer_time END AS waiting_time,
+    message_id, seq IS NOT DISTINCT FROM first_response_seq AS first_response
+FROM segments JOIN waits USING (conversation, segment)
+WHERE ends_wait AND waiting_seq < seq
+ORDER BY conversation, seq
+"""
+
+def _duckdb_response_times(con):
+    """(frt_df, non_initial_df) response-time records, as calculate_response_times gives them"""
+    responses = con.execute(_RESPONSES_SQL).df()
+    first_response = responses['first_response'].to_numpy(dtype=bool)
+    tables = []
+    for rows in [first_response, ~first_response]:
+        part = responses[rows]
+        tables.append(response_records(
+            part['conversation'].to_numpy(),
+            part['role'].to_numpy(dtype=np.int64),
+            part['skill'].astype(object),
+            part['agent_name'].to_numpy(dtype=object),
+            part['time'].to_numpy(dtype=np.int64),
+            minutes_between(part['time'].to_numpy(dtype=np.int64), part['waiting_time'].to_numpy(dtype=np.int64)),
+            part['message_id'].to_numpy()
+        ))
+    return tuple(tables)
+
+def _duckdb_repetitions(con, skills):
+    """Repetition figures and repetitions_df of every skill, as compute_skill_matrix gives them"""
+    # Every distinct Skill value is matched against the skills once, then joined on equality
+    con.execute("""
+        CREATE TEMP TABLE repetition_skills AS
+        SELECT value, k
+        FROM (SELECT DISTINCT "Skill" AS value FROM messages) JOIN skills ON regexp_matches(value, pattern, 'i')
+    """)
+    repeated = con.execute("""
+        WITH bot_messages AS (
+            SELECT "Conversation ID" AS conversation, seq, "TEXT" AS text, "MESSAGE_ID" AS message_id, "Skill" AS value
+            FROM messages
+            WHERE lower("Sent By") = 'bot' AND lower("Message Type") = 'normal message' AND "TEXT" IS NOT NULL
+        )
+        SELECT k, conversation, arg_min(message_id, seq) AS message_id, text, count(*) AS count, min(seq) AS first
+        FROM bot_messages JOIN repetition_skills USING (value)
+        GROUP BY k, conversation, text
+        HAVING count(*) > 1
+        ORDER BY k, conversation, count DESC, first
+    """).df()
+    total_chats = dict(con.execute("""
+        SELECT k, count(DISTINCT "Conversation ID")
+        FROM messages JOIN repetition_skills ON "Skill" = value
+        GROUP BY k
+    """).fetchall())
+
+    figures, tables = [], []
+    for k in range(len(skills)):
+        counts = repeated[repeated['k'] == k]
+        total = total_chats.get(k, 0)
+        chats_with_reps = counts['conversation'].nunique()
+        percentage = (chats_with_reps / total) * 100 if total > 0 else 0
+        figures.append((round(percentage, 2), chats_with_reps, total))
+        tables.append(pd.DataFrame({
+            'Conversation ID': counts['conversation'].to_numpy(),
+            'Message Id': counts['message_id'].to_numpy(),
+            'Message': counts['text'].to_numpy(dtype=object),
+            'Repetition Count': counts['count'].to_numpy(dtype=np.int64)
+        }) if len(counts) else None)
+    return figures, tables
+
+def _duckdb_bot_handle(con, skills, columns):
+    """Bot handle figures of every skill, as compute_skill_matrix gives them"""
+    skill_columns = [col for col in columns if 'skill' in col.lower()]
+    if not skill_columns:
+        return [(0, 0, 0)] * len(skills)
+    # Skill values are matched as str(value).lower(), so missing values are 'nan'; every
+    # distinct value is matched once, then joined on equality
+    selects = []
+    for i, col in enumerate(skill_columns):
+        con.execute(f"""
+            CREATE TEMP TABLE bot_handle_skills_{i} AS
+            SELECT value, k
+            FROM (SELECT DISTINCT {_quote(col)} AS value FROM messages)
+            JOIN skills ON regexp_matches(coalesce(lower(CAST(value AS VARCHAR)), 'nan'), pattern)
+        """)
+        selects.append(f"""SELECT DISTINCT k, "Conversation ID" AS conversation FROM messages
+            JOIN bot_handle_skills_{i} ON {_quote(col)} IS NOT DISTINCT FROM value""")
+    with_skill = " UNION ".join(selects)
+    counts = dict((k, (with_skill_count, fully_bot)) for k, with_skill_count, fully_bot in con.execute(f"""
+        WITH conversations AS (
+            SELECT "Conversation ID" AS conversation, bool_or("Agent Name " IS NOT NULL) AS has_agent
+            FROM messages GROUP BY 1
+        )
+        SELECT k, count(*), count(*) FILTER (WHERE NOT has_agent)
+        FROM ({with_skill}) JOIN conversations USING (conversation)
+        GROUP BY k
+    """).fetchall())
+    n_conversations = con.execute('SELECT count(DISTINCT "Conversation ID") FROM messages').fetchone()[0]
+
+    figures = []
+    for k, skill_filter in enumerate(skills):
+        total_chats_with_skill, fully_bot_conversations = counts.get(k, (0, 0))
+        total_chats = n_conversations
+        if skill_filter == "filipina_outside" or "maidsat" in skill_filter:
+            total_chats = total_chats_with_skill
+        bot_handle_ratio = (fully_bot_conversations / total_chats) * 100 if total_chats > 0 else 0
+        figures.append((total_chats, fully_bot_conversations, round(bot_handle_ratio, 2)))
+    return figures
+
+def _compute_view_duckdb(csv_path, departments, bot_filter, sorted_output, threads, memory_limit):
+    labels, skills = list(departments), list(departments.values())
+    con = duckdb.connect()
+    try:
+        con.execute("SET enable_progress_bar = false")
+        if threads:
+            con.execute(f"SET threads = {int(threads)}")
+        if memory_limit:
+            con.execute("SET memory_limit = $limit", {'limit': memory_limit})
+        # DuckDB strips the header names, but the export has 'Agent Name ' with a trailing space
+        names = list(pd.read_csv(csv_path, nrows=0).columns)
+        time_format = con.execute("SELECT TimestampFormat FROM sniff_csv($path)", {'path': csv_path}).fetchone()[0]
+        sent_time = ('CAST("Message Sent Time" AS TIMESTAMP)' if time_format is None
+                     else f"""strptime("Message Sent Time", '{time_format.replace("'", "''")}')""")
+        con.execute(_MESSAGES_SQL.format(sent_time=sent_time), {'path': csv_path, 'names': names})
+        columns = [row[0] for row in con.execute("DESCRIBE messages").fetchall()]
+        if sorted_output:
+            con.execute(
+                """COPY (SELECT * EXCLUDE (file_row, seq, sent_time) FROM messages ORDER BY "Conversation ID", seq)
+                TO $path (HEADER)""",
+                {'path': sorted_output}
+            )
+        con.register('skill_filters', pd.DataFrame({'k': np.arange(len(skills)), 'pattern': skills}))
+        con.execute("CREATE TEMP TABLE skills AS SELECT * FROM skill_filters")
+
+        frt_df, non_initial_df = _duckdb_response_times(con)
+        repetitions, tables = _duckdb_repetitions(con, skills)
+        bot_handle = _duckdb_bot_handle(con, skills, columns)
+    finally:
+        con.close()
+
+    initial_averages, initial_slow = response_matrix(frt_df, True, skills, bot_filter)
+    non_initial_averages, non_initial_slow = response_matrix(non_initial_df, False, skills, bot_filter)
+    rows = [
+        dict(zip(SKILL_MATRIX_COLUMNS, figures))
+        for figures in zip(initial_averages, non_initial_averages, initial_slow, non_initial_slow,
+                           *zip(*repetitions), *zip(*bot_handle))
+    ] if skills else []
+    matrix = pd.DataFrame(rows, index=pd.Index(labels, name='Skill'), columns=SKILL_MATRIX_COLUMNS)
+    return matrix, frt_df, non_initial_df, dict(zip(labels, tables))
@@ -0,0 +1,306 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import pandas as pd
+
+from Utilities_2 import (
+    ConversationFrame,
+    preprocess_data,
+    calculate_first_response_times,
+    calculate_subsequent_response_times,
+    calculate_response_times,
+    get_bot_repetitions,
+    get_bot_handle_metrics,
+    compute_and_push_metrics,
+    compute_and_push_metrics_Repetitions,
+    compute_and_push_metrics_BotHandle,
+    compute_metrics,
+    compute_metrics_Repetitions,
+    compute_metrics_BotHandle,
+    compute_skill_matrix,
+    conversation_summary,
+    export_response_table
+)
+from backends import compute_view, duckdb
+from view_cache import load_view
+from incremental import compute_incremental_metrics
+from parallel_responses import calculate_response_times_parallel
+from instrumentation import measure
+from synthetic import generate_conversations
+
+# Benchmarks of the Utilities_2 stages on synthetic exports, with differential checks.
+#
+#     python benchmark.py 10000 100000 1000000 10000000 --json bench.json
+#
+# Every stage reports wall time, rows/second and its peak memory: the growth of the
+# resident set size, sampled every few milliseconds from /proc (tracemalloc, which is
+# much slower, where /proc isn't available). Up to --check-rows rows, the optimized
+# paths are also compared with the original per-conversation loops (legacy=True) and
+# must give identical outputs. The view loaded through the typed cache must give the same
+# metrics as its CSV, and when duckdb is installed, the view is also computed from its
+# CSV with both backends of backends.py, whose outputs must match too. Both are checked
+# again on a copy of the view with non-ISO times, which don't sort as text. Incremental runs over
+# overlapping exports of the view, one of them missing earlier messages, must give the
+# metrics of full recomputes, on both copies.
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+NON_ISO_TIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+def _quiet(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+def _same_frames(expected, actual):
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    pd.testing.assert_frame_equal(
+        expected.reset_index(drop=True), actual.reset_index(drop=True), check_dtype=False
+    )
+    return True
+
+def differential_checks(df, frame, skill_filter):
+    """
+    Compare the optimized stages with the original loops on the same data
+
+    Returns:
+        dict: Check name -> "ok" or the mismatch
+    """
+    # The records are compared in the exported layout the legacy loops produce
+    first = lambda target: export_response_table(calculate_first_response_times(target), first_response=True)
+    later = lambda target: export_response_table(calculate_subsequent_response_times(target), first_response=False)
+    checks = {
+        'first response times': lambda: _same_frames(
+            calculate_first_response_times(df.copy(), legacy=True), first(frame)
+        ),
+        'first response times (DataFrame)': lambda: _same_frames(
+            calculate_first_response_times(df.copy(), legacy=True), first(df.copy())
+        ),
+        'subsequent response times': lambda: _same_frames(
+            calculate_subsequent_response_times(df.copy(), legacy=True), later(frame)
+        ),
+        'subsequent response times (DataFrame)': lambda: _same_frames(
+            calculate_subsequent_response_times(df.copy(), legacy=True), later(df.copy())
+        ),
+    }
+    for workers in [2, 3]:
+        def parallel(workers=workers):
+            expected = calculate_response_times(frame)
+            actual = calculate_response_times_parallel(frame, workers, min_rows=0)
+            return all(_same_frames(*tables) for tables in zip(expected, actual))
+
+        checks[f'parallel response times ({workers} workers)'] = parallel
+    for target, name in [(frame, ''), (df, ' (DataFrame)')]:
+        def repetitions(target=target):
+            expected = _quiet(get_bot_repetitions, df, skill_filter, legacy=True)
+            actual = _quiet(get_bot_repetitions, target, skill_filter)
+            assert expected[1:] == actual[1:], f"{expected[1:]} != {actual[1:]}"
+            return _same_frames(expected[0], actual[0])
+
+        def bot_handle(target=target):
+            expected = _quiet(get_bot_handle_metrics, df, skill_filter, legacy=True)
+            actual = _quiet(get_bot_handle_metrics, target, skill_filter)
+            assert expected == actual, f"{expected} != {actual}"
+            return True
+
+        checks[f'bot repetitions{name}'] = repetitions
+        checks[f'bot handle{name}'] = bot_handle
+
+    def skill_matrix():
+        # The summary-derived matrix against the metric families computed one by one
+        frt_df, non_initial_df = calculate_response_times(frame)
+        expected = {
+            **compute_metrics(frt_df, non_initial_df, skill_filter),
+            **compute_metrics_Repetitions(frame, skill_filter)[0],
+            **compute_metrics_BotHandle(frame, skill_filter),
+        }
+        actual = compute_skill_matrix(frame, [skill_filter], response_times=(frt_df, non_initial_df)).iloc[0].to_dict()
+        assert expected == actual, f"{expected} != {actual}"
+        return True
+
+    checks['skill matrix'] = skill_matrix
+    return _run_checks(checks)
+
+def view_cache_checks(view, departments, name='view cache'):
+    """
+    Compare the metrics and sorted CSV of a view loaded through the typed cache with those of its CSV
+
+    Returns:
+        dict: Check name -> "ok" or the mismatch
+    """
+    def cache():
+        sorted_outputs = [f"{view}.sorted.{source}.csv" for source in ('csv', 'cache')]
+        expected = preprocess_data(pd.read_csv(view), output_filename=sorted_outputs[0])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Written, then read back from the cache
+            load_view("view", view, None, cache_dir)
+            actual = load_view("view", view, None, cache_dir, sorted_output=sorted_outputs[1])
+        assert (expected['MESSAGE_ID'].to_numpy() == actual['MESSAGE_ID'].to_numpy()).all(), "messages ordered differently"
+        with open(sorted_outputs[0], 'rb') as f, open(sorted_outputs[1], 'rb') as g:
+            assert f.read() == g.read(), "sorted outputs differ"
+        results = []
+        for target in (expected, actual):
+            frame = ConversationFrame(target)
+            frt_df, non_initial_df = calculate_response_times(frame)
+            results.append((
+                export_response_table(frt_df, first_response=True),
+                export_response_table(non_initial_df, first_response=False),
+                *compute_skill_matrix(frame, departments, response_times=(frt_df, non_initial_df), repetition_tables=True),
+            ))
+        expected, actual = results
+        pd.testing.assert_frame_equal(expected[2], actual[2])
+        assert expected[3].keys() == actual[3].keys(), f"{list(expected[3])} != {list(actual[3])}"
+        return (all(_same_frames(*tables) for tables in zip(expected[:2], actual[:2]))
+                and all(_same_frames(expected[3][department], actual[3][department]) for department in departments))
+
+    return _run_checks({name: cache})
+
+def backend_checks(view, departments, name='duckdb backend'):
+    """
+    Compare the duckdb backend with the pandas one on the same view
+
+    Returns:
+        dict: Check name -> "ok" or the mismatch
+    """
+    def backends():
+        sorted_outputs = [f"{view}.sorted.{backend}.csv" for backend in ('pandas', 'duckdb')]
+        expected = compute_view(view, departments, backend='pandas', sorted_output=sorted_outputs[0])
+        actual = compute_view(view, departments, backend='duckdb', sorted_output=sorted_outputs[1])
+        with open(sorted_outputs[0], 'rb') as f, open(sorted_outputs[1], 'rb') as g:
+            assert f.read() == g.read(), "sorted outputs differ"
+        pd.testing.assert_frame_equal(expected[0], actual[0], check_dtype=False)
+        _same_frames(expected[1], actual[1])
+        _same_frames(expected[2], actual[2])
+        assert expected[3].keys() == actual[3].keys(), f"{list(expected[3])} != {list(actual[3])}"
+        return all(_same_frames(expected[3][department], actual[3][department]) for department in departments)
+
+    return _run_checks({name: backends})
+
+def incremental_checks(view, departments, name='incremental'):
+    """
+    Compare incremental runs over overlapping exports of a view with full recomputes: the
+    earlier 60% of its messages, then all of them with some of those earlier ones dropped
+    (their conversations are recomputed), then all of them
+
+    Returns:
+        dict: Check name -> "ok" or the mismatch
+    """
+    def incremental():
+        raw = pd.read_csv(view)
+        sent_time = pd.to_datetime(raw['Message Sent Time'])
+        earlier = sent_time <= sent_time.quantile(0.6)
+        exports = [raw[earlier], raw.drop(raw.index[earlier][::50]), raw]
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            for i, export in enumerate(exports):
+                export_path = os.path.join(checkpoint_dir, "export.csv")
+                export.to_csv(export_path, index=False)
+                frame = ConversationFrame(preprocess_data(pd.read_csv(export_path), output_filename=None))
+                frt_df, non_initial_df = calculate_response_times(frame)
+                for department, skill_filter in departments.items():
+                    _, _, *actual = compute_incremental_metrics(
+                        export_path, os.path.join(checkpoint_dir, f"{department}.pkl"), skill_filter
+                    )
+                    expected = (compute_metrics(frt_df, non_initial_df, skill_filter),
+                                compute_metrics_Repetitions(frame, skill_filter)[0],
+                                compute_metrics_BotHandle(frame, skill_filter))
+                    actual = (actual[0], actual[1], actual[3])
+                    assert actual == expected, f"export {i}: {actual} != {expected}"
+        return True
+
+    return _run_checks({name: incremental})
+
+def _run_checks(checks):
+    results = {}
+    for name, check in checks.items():
+        try:
+            results[name] = "ok" if _quiet(check) else "mismatch"
+        except AssertionError as e:
+            results[name] = f"mismatch: {str(e).splitlines()[0] if str(e) else 'outputs differ'}"
+    return results
+
+def benchmark_size(n_rows, skill_filter="gpt_mv_prospect", check_rows=100_000, trace_memory=True, seed=0):
+    """
+    Benchmark every stage on a synthetic export of n_rows messages
+
+    Returns:
+        dict: rows, stage timings and, up to check_rows rows, differential check results
+    """
+    raw = generate_conversations(n_rows, seed=seed)
+    report = {'rows': len(raw), 'stages': [], 'checks': {}}
+
+    def stage(name, fn, rows):
+        result, seconds, peak = measure(lambda: _quiet(fn), trace_memory)
+        report['stages'].append({
+            'stage': name,
+            'seconds': round(seconds, 4),
+            'rows_per_second': round(rows / seconds) if seconds > 0 else None,
+            'peak_mb': round(peak / 1e6, 1) if peak is not None else None,
+        })
+        print(f"{len(raw):>12,} {name:<40} {seconds:>9.3f}s {rows / max(seconds, 1e-9):>14,.0f} rows/s"
+              + (f" {peak / 1e6:>9.1f} MB" if peak is not None else ""))
+        return result
+
+    df = stage('preprocess_data', lambda: preprocess_data(raw, output_filename=None), len(raw))
+    frame = stage('ConversationFrame', lambda: ConversationFrame(df), len(df))
+    stage('calculate_first_response_times', lambda: calculate_first_response_times(df.copy()), len(df))
+    stage('calculate_subsequent_response_times', lambda: calculate_subsequent_response_times(df.copy()), len(df))
+    frt_df, non_initial_df = stage('calculate_response_times (frame)', lambda: calculate_response_times(frame), len(df))
+    stage('calculate_response_times_parallel', lambda: calculate_response_times_parallel(frame), len(df))
+    stage('get_bot_repetitions (frame)', lambda: get_bot_repetitions(frame, skill_filter), len(df))
+    stage('get_bot_handle_metrics (frame)', lambda: get_bot_handle_metrics(frame, skill_filter), len(df))
+    stage('conversation_summary', lambda: conversation_summary(frame, [skill_filter], response_times=(frt_df, non_initial_df)), len(df))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        master_csv_path = os.path.join(tmp_dir, "Master Sheet.csv")
+        stage('compute_and_push_metrics', lambda: compute_and_push_metrics(
+            frt_df, non_initial_df, master_csv_path, skill_filter=skill_filter, department="Benchmark"
+        ), len(frt_df) + len(non_initial_df))
+        stage('compute_and_push_metrics_Repetitions', lambda: compute_and_push_metrics_Repetitions(
+            frame, master_csv_path, skill_filter=skill_filter, department="Benchmark", output_dir=tmp_dir
+        ), len(df))
+        stage('compute_and_push_metrics_BotHandle', lambda: compute_and_push_metrics_BotHandle(
+            frame, master_csv_path, skill_filter=skill_filter, department="Benchmark"
+        ), len(df))
+
+        view = os.path.join(tmp_dir, "view.csv")
+        raw.to_csv(view, index=False)
+        departments = {"Benchmark": skill_filter}
+        if duckdb is not None:
+            for backend in ('pandas', 'duckdb'):
+                stage(f'compute_view ({backend})', lambda: compute_view(view, departments, backend=backend), len(raw))
+        if n_rows <= check_rows:
+            non_iso_view = os.path.join(tmp_dir, "view_non_iso.csv")
+            generate_conversations(n_rows, seed=seed, time_format=NON_ISO_TIME_FORMAT).to_csv(non_iso_view, index=False)
+            for checked_view, suffix in [(view, ''), (non_iso_view, ' (non-ISO times)')]:
+                report['checks'].update(view_cache_checks(checked_view, departments, f'view cache{suffix}'))
+                if duckdb is not None:
+                    report['checks'].update(backend_checks(checked_view, departments, f'duckdb backend{suffix}'))
+                report['checks'].update(incremental_checks(checked_view, departments, f'incremental{suffix}'))
+
+    if n_rows <= check_rows:
+        report['checks'] = {**differential_checks(df, frame, skill_filter), **report['checks']}
+        for name, result in report['checks'].items():
+            print(f"{len(raw):>12,} check {name:<34} {result}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Utilities_2 stages on synthetic exports")
+    parser.add_argument('sizes', nargs='*', type=int, default=DEFAULT_SIZES, help="Rows per benchmark run")
+    parser.add_argument('--skill', default="gpt_mv_prospect", help="Skill filter")
+    parser.add_argument('--check-rows', type=int, default=100_000, help="Run differential checks up to this many rows")
+    parser.add_argument('--no-memory', action='store_true', help="Don't measure memory")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    reports = [
+        benchmark_size(n_rows, args.skill, args.check_rows, not args.no_memory, args.seed)
+        for n_rows in args.sizes
+    ]
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if any(result != "ok" for report in reports for result in report['checks'].values()):
+        raise SystemExit("Differential checks failed")
@@ -0,0 +1,237 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+from urllib.parse import quote
+
+from Utilities_2 import replace_file, response_senders
+from response_sketches import KINDS, to_day
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, runs then skip storing events
+    pa = None
+
+# Raw response and repetition events of every run, kept in one local Parquet dataset, so
+# questions across days and departments read a few partitions instead of globbing CSVs.
+#
+#     <root>/responses/department=<department>/date=<YYYY-MM-DD>/part-0.parquet
+#     <root>/repetitions/department=<department>/date=<YYYY-MM-DD>/part-0.parquet
+#
+# A run appends the partitions of its (department, day), with one part per batch when it
+# is streamed; rerunning a department on the same day replaces them, like the master sheet
+# rows and the response sketches. IDs are stored as strings, since exports don't always
+# have numeric ones. Every file has the table's declared schema, so the partitions of all
+# runs read as one dataset, and queries push their department and date filters down to
+# the directory names (skipping other partitions unopened) and their other filters down
+# to the Parquet row groups, reading only the columns they return.
+#
+#     query_responses("events", "2025-07-01", "2025-07-07", ["Doctors"], sender_roles=["agent"], min_minutes=4)
+#
+#     python event_store.py events 2025-07-01 2025-07-07 Doctors --role agent --min-minutes 4
+
+TABLES = ('responses', 'repetitions')
+
+if pa is not None:
+    SCHEMAS = {
+        'responses': pa.schema([
+            ('Kind', pa.string()),  # "initial" or "non_initial", as in response_sketches
+            ('Conversation Id', pa.string()),
+            ('Sender', pa.string()),
+            ('Sender Role', pa.string()),
+            ('Skill', pa.string()),
+            ('Agent Name', pa.string()),
+            ('Response Time (mins)', pa.float64()),
+            ('Message Id', pa.string()),
+            ('Message Time', pa.timestamp('ns')),
+        ]),
+        'repetitions': pa.schema([
+            ('Conversation ID', pa.string()),
+            ('Message Id', pa.string()),
+            ('Message', pa.string()),
+            ('Repetition Count', pa.int64()),
+            ('Match', pa.string()),  # null unless near-duplicates were listed
+            ('Variants', pa.int64()),
+        ]),
+    }
+    PARTITIONING = ds.partitioning(pa.schema([('department', pa.string()), ('date', pa.date32())]), flavor='hive')
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("The event store needs pyarrow (pip install pyarrow)")
+
+def _ids(values):
+    """
+    IDs as strings, numeric or not ('' and missing values become null)
+
+    Numeric IDs read with missing values are floats; they keep their integer spelling.
+    """
+    values = pd.Series(values)
+    if values.dtype.kind == 'f' and (values.dropna() % 1 == 0).all():
+        values = values.astype('Int64')
+    return values.astype('string').replace('', pd.NA)
+
+def _text(values):
+    """Plain strings (missing values stay missing) from categorical or object columns"""
+    return pd.Series(np.asarray(values, dtype=object), dtype=object)
+
+def _response_events(responses, kind):
+    return pd.DataFrame({
+        'Kind': kind,
+        'Conversation Id': _ids(responses['Conversation Id']),
+        'Sender': _text(response_senders(responses, kind == 'initial')),
+        'Sender Role': _text(responses['Sender Role']),
+        'Skill': _text(responses['Skill']),
+        'Agent Name': _text(responses['Agent Name']),
+        'Response Time (mins)': responses['Response Time (mins)'].to_numpy(dtype=np.float64),
+        'Message Id': _ids(responses['Message Id']),
+        'Message Time': pd.to_datetime(responses['Message Time (ns)'].to_numpy(dtype=np.int64)),
+    })
+
+def _repetition_events(repetitions_df):
+    return pd.DataFrame({
+        'Conversation ID': _ids(repetitions_df['Conversation ID']),
+        'Message Id': _ids(repetitions_df['Message Id']),
+        'Message': _text(repetitions_df['Message']),
+        'Repetition Count': repetitions_df['Repetition Count'].to_numpy(dtype=np.int64),
+        'Match': _text(repetitions_df['Match']) if 'Match' in repetitions_df.columns else None,
+        'Variants': repetitions_df['Variants'].astype('Int64') if 'Variants' in repetitions_df.columns else pd.NA,
+    })
+
+def partition_path(root, table, department, date=None, part=0):
+    """Path of a Parquet file of a (department, day) partition"""
+    return os.path.join(root, table, f"department={quote(department, safe='')}", f"date={to_day(date).isoformat()}", f"part-{part}.parquet")
+
+def _write_partition(events, root, table, department, date, part):
+    path = partition_path(root, table, department, date, part)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    table_data = pa.Table.from_pandas(events, schema=SCHEMAS[table], preserve_index=False)
+    replace_file(path, lambda tmp_path: pq.write_table(table_data, tmp_path))
+    if part == 0:
+        # The first part of a run replaces every part of the earlier run
+        for name in os.listdir(directory):
+            if name.startswith('part-') and name.endswith('.parquet') and name != os.path.basename(path):
+                os.remove(os.path.join(directory, name))
+    return path
+
+def append_events(root, department, frt_df, non_initial_df, repetitions_df=None, date=None, part=0):
+    """
+    Store a run's response and repetition events in the (department, day) partitions, replacing that day's earlier run
+
+    Args:
+        root: Directory of the dataset
+        department: Department name
+        frt_df, non_initial_df: Response-time records (calculate_response_times)
+        repetitions_df: Repetitions table (get_bot_repetitions; None when nothing repeated)
+        date: Day of the run (default: today)
+        part: Number of the batch, for runs that store their events batch by batch
+            (streaming); part 0 replaces the earlier run's parts
+
+    Returns:
+        list: Paths of the written partitions (none without pyarrow)
+    """
+    if pa is None:
+        print("pyarrow is not installed, the events are not stored")
+        return []
+    responses = [
+        _response_events(table, kind) for kind, table in zip(KINDS, [frt_df, non_initial_df])
+        if table is not None and 'Sender Role' in table.columns
+    ]
+    responses = pd.concat(responses, ignore_index=True) if responses else pd.DataFrame(columns=SCHEMAS['responses'].names)
+    paths = [_write_partition(responses, root, 'responses', department, date, part)]
+    repetitions = (_repetition_events(repetitions_df) if repetitions_df is not None
+                   else pd.DataFrame(columns=SCHEMAS['repetitions'].names))
+    paths.append(_write_partition(repetitions, root, 'repetitions', department, date, part))
+    return paths
+
+def read_events(root, table, start=None, end=None, departments=None, columns=None, filter=None):
+    """
+    Read the events of a range of days, opening only the matching partitions
+
+    Args:
+        root: Directory of the dataset
+        table: One of TABLES
+        start, end: First and last day (inclusive, dates or YYYY-MM-DD); default today
+        departments: Departments to include (default: all)
+        columns: Columns to read (default: all, plus 'department' and 'date')
+        filter: pyarrow.dataset expression on the table's columns, pushed down to the row groups
+
+    Returns:
+        DataFrame: The matching events
+    """
+    _require_pyarrow()
+    first, last = to_day(start), to_day(end if end is not None else start)
+    schema = SCHEMAS[table]
+    directory = os.path.join(root, table)
+    if columns is None:
+        columns = schema.names + ['department', 'date']
+    if not os.path.isdir(directory):
+        return pd.DataFrame(columns=columns)
+
+    dataset = ds.dataset(directory, schema=pa.unify_schemas([schema, PARTITIONING.schema]),
+                         format='parquet', partitioning=PARTITIONING)
+    expression = (ds.field('date') >= first) & (ds.field('date') <= last)
+    if departments is not None:
+        expression &= ds.field('department').isin(list(departments))
+    if filter is not None:
+        expression &= filter
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+def query_responses(root, start=None, end=None, departments=None, kinds=KINDS, sender_roles=None,
+                    min_minutes=None, max_minutes=None, columns=None):
+    """
+    Response events of a range of days, e.g. every agent response of 4 minutes or more
+
+    Args:
+        kinds: "initial" and/or "non_initial"
+        sender_roles: "bot", "agent" and/or "system" (default: all)
+        min_minutes, max_minutes: Inclusive bounds of 'Response Time (mins)'
+        (other arguments as read_events)
+
+    Returns:
+        DataFrame: The matching responses
+    """
+    _require_pyarrow()
+    expression = ds.field('Kind').isin(list(kinds))
+    if sender_roles is not None:
+        expression &= ds.field('Sender Role').isin(list(sender_roles))
+    if min_minutes is not None:
+        expression &= ds.field('Response Time (mins)') >= min_minutes
+    if max_minutes is not None:
+        expression &= ds.field('Response Time (mins)') <= max_minutes
+    return read_events(root, 'responses', start, end, departments, columns, expression)
+
+def query_repetitions(root, start=None, end=None, departments=None, min_count=None, columns=None):
+    """
+    Repeated bot messages of a range of days
+
+    Args:
+        min_count: Smallest 'Repetition Count' to return
+        (other arguments as read_events)
+
+    Returns:
+        DataFrame: The matching repetitions
+    """
+    _require_pyarrow()
+    expression = ds.field('Repetition Count') >= min_count if min_count is not None else None
+    return read_events(root, 'repetitions', start, end, departments, columns, expression)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the stored response events")
+    parser.add_argument('root', help="Directory of the dataset")
+    parser.add_argument('start', nargs='?', help="First day (YYYY-MM-DD, default today)")
+    parser.add_argument('end', nargs='?', help="Last day (default: start)")
+    parser.add_argument('departments', nargs='*', help="Departments (default: all)")
+    parser.add_argument('--kind', action='append', choices=KINDS, help="Response kind (default: both)")
+    parser.add_argument('--role', action='append', choices=['bot', 'agent', 'system'], help="Sender role (default: all)")
+    parser.add_argument('--min-minutes', type=float)
+    parser.add_argument('--max-minutes', type=float)
+    args = parser.parse_args()
+
+    responses = query_responses(args.root, args.start, args.end, args.departments or None, args.kind or KINDS,
+                                args.role, args.min_minutes, args.max_minutes)
+    responses.to_csv(sys.stdout, index=False)
@@ -0,0 +1,329 @@
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+import queue
+import shutil
+import threading
+import urllib.parse
+import urllib.request
+
+from Utilities_2 import replace_file
+
+# Tableau view downloads.
+#
+# Views are fetched concurrently by an asyncio loop over a small pool of keep-alive
+# HTTP(S) connections (the blocking http.client calls run in worker threads). Each
+# response is streamed to "<csv>.part" in chunks and renamed into place once complete;
+# a dropped download is retried with backoff and resumed with a Range request when the
+# server sent an ETag for it. "<csv>.fetch.json" remembers the ETag, Last-Modified and
+# SHA-256 of the last download, so a view the server reports as not modified (304), or
+# whose content hashes the same, is reported as unchanged and its CSV is left untouched.
+#
+# TABLEAU_SERVER may also be "file:///some/dir" to copy <dir>/<view name>.csv, or the
+# URL of fetch_server.py, a local stand-in for the Tableau endpoints, to run offline.
+
+TABLEAU_SERVER = os.environ.get("TABLEAU_SERVER", "")  # e.g. https://tableau.example.com
+TABLEAU_SITE = os.environ.get("TABLEAU_SITE", "")  # Site contentUrl ("" for the default site)
+TABLEAU_TOKEN_NAME = os.environ.get("TABLEAU_TOKEN_NAME", "")
+TABLEAU_TOKEN_SECRET = os.environ.get("TABLEAU_TOKEN_SECRET", "")
+TABLEAU_API_VERSION = os.environ.get("TABLEAU_API_VERSION", "3.19")
+
+MAX_CONNECTIONS = 4
+MAX_RETRIES = 5
+RETRY_DELAY = 2  # Seconds before the first retry, doubled after each failure
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 300
+
+DOWNLOADED, UNCHANGED, FAILED = 'downloaded', 'unchanged', 'failed'
+
+class FetchError(Exception):
+    """A view can't be fetched and retrying won't help (unknown view, rejected credentials, ...)"""
+
+class _Retry(Exception):
+    """The server is temporarily unavailable (429 or 5xx)"""
+
+class _Unauthorized(Exception):
+    """The session token expired"""
+
+class _ConnectionPool:
+    """Keep-alive connections to one server, at most size of them in use at a time"""
+
+    def __init__(self, url, size=MAX_CONNECTIONS, timeout=TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.netloc
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def request(self, method, path, headers, body=None, handle=None):
+        """
+        Send a request on a pooled connection
+
+        handle(response) runs in the worker thread and can stream the body; whatever it
+        leaves unread is drained so the connection can be reused.
+        """
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else self.connection_class(self.host, timeout=self.timeout)
+
+            def call():
+                connection.request(method, self.base_path + path, body=body, headers=headers)
+                response = connection.getresponse()
+                try:
+                    return handle(response) if handle else (response.status, response.read())
+                finally:
+                    response.read()
+
+            try:
+                result = await asyncio.to_thread(call)
+            except BaseException:
+                connection.close()
+                raise
+            self._idle.append(connection)
+            return result
+
+    def close(self):
+        for connection in self._idle:
+            connection.close()
+        self._idle = []
+
+def _read_manifest(csv_path):
+    try:
+        with open(f"{csv_path}.fetch.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(csv_path, manifest):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+    replace_file(f"{csv_path}.fetch.json", write)
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _finish_download(csv_path, part_path, manifest, etag=None, last_modified=None):
+    """Move a complete download into place, unless it has the same content as the current CSV"""
+    sha256 = _file_sha256(part_path)
+    manifest.pop('partial_etag', None)
+    if sha256 == manifest.get('sha256') and os.path.exists(csv_path):
+        os.remove(part_path)
+        status = UNCHANGED
+    else:
+        os.replace(part_path, csv_path)
+        status = DOWNLOADED
+    manifest.update(etag=etag, last_modified=last_modified, sha256=sha256, size=os.path.getsize(csv_path))
+    _write_manifest(csv_path, manifest)
+    return status
+
+def _save_response(response, csv_path, part_path, offset, manifest):
+    """Stream a view data response to the .part file (runs in a worker thread)"""
+    if response.status == 304:
+        return UNCHANGED
+    if response.status == 401:
+        raise _Unauthorized()
+    if response.status == 429 or response.status >= 500:
+        raise _Retry(f"HTTP {response.status}")
+    if response.status not in (200, 206):
+        raise FetchError(f"HTTP {response.status}: {response.read(500).decode(errors='replace')}")
+
+    etag = response.getheader('ETag')
+    if response.status == 200:
+        offset = 0  # The server sent the whole view (no range support, or it changed)
+    # Remember which version the .part file holds, so an interrupted download can resume
+    manifest['partial_etag'] = etag
+    _write_manifest(csv_path, manifest)
+    expected = response.getheader('Content-Length')
+    received = 0
+    with open(part_path, 'r+b' if offset else 'wb') as f:
+        f.seek(offset)
+        f.truncate()
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            f.write(chunk)
+            received += len(chunk)
+    # http.client returns a short body without complaint when the connection drops
+    if expected is not None and received < int(expected):
+        raise http.client.IncompleteRead(b'', int(expected) - received)
+    return _finish_download(csv_path, part_path, manifest, etag, response.getheader('Last-Modified'))
+
+async def _sign_in(pool, auth):
+    """Sign in with the personal access token and store the session token and site id in auth"""
+    body = json.dumps({'credentials': {
+        'personalAccessTokenName': TABLEAU_TOKEN_NAME,
+        'personalAccessTokenSecret': TABLEAU_TOKEN_SECRET,
+        'site': {'contentUrl': TABLEAU_SITE}
+    }})
+    status, data = await pool.request(
+        'POST', f"/api/{TABLEAU_API_VERSION}/auth/signin",
+        {'Content-Type': 'application/json', 'Accept': 'application/json'}, body
+    )
+    if status != 200:
+        raise FetchError(f"Tableau sign-in failed with HTTP {status}")
+    credentials = json.loads(data)['credentials']
+    auth.update(token=credentials['token'], site_id=credentials['site']['id'])
+
+async def _authorized(pool, auth, send):
+    """Call send(headers), signing in again once if the session expired"""
+    for attempt in range(2):
+        async with auth['lock']:
+            if 'token' not in auth:
+                await _sign_in(pool, auth)
+            token = auth['token']
+        try:
+            return await send({'X-Tableau-Auth': token, 'Accept': 'application/json'})
+        except _Unauthorized:
+            async with auth['lock']:
+                if auth.get('token') == token:
+                    del auth['token']
+    raise FetchError("Tableau rejected the session token")
+
+async def _view_id(pool, auth, view_name):
+    async def send(headers):
+        query = urllib.parse.quote(f"viewName:eq:{view_name}")
+        status, data = await pool.request('GET', f"/api/{TABLEAU_API_VERSION}/sites/{auth['site_id']}/views?filter={query}", headers)
+        if status == 401:
+            raise _Unauthorized()
+        if status != 200:
+            raise FetchError(f"Looking up view {view_name} failed with HTTP {status}")
+        return json.loads(data)['views'].get('view', [])
+
+    views = await _authorized(pool, auth, send)
+    if not views:
+        raise FetchError(f"View not found: {view_name}")
+    return views[0]['id']
+
+async def _fetch_view(pool, auth, view_name, csv_path):
+    """Download one view, retrying and resuming interrupted downloads"""
+    view_id = await _view_id(pool, auth, view_name)
+    part_path = f"{csv_path}.part"
+    delay = RETRY_DELAY
+    for attempt in range(MAX_RETRIES + 1):
+        manifest = _read_manifest(csv_path)
+        offset = os.path.getsize(part_path) if manifest.get('partial_etag') and os.path.exists(part_path) else 0
+
+        async def send(headers):
+            if offset:
+                headers.update({'Range': f"bytes={offset}-", 'If-Range': manifest['partial_etag']})
+            elif os.path.exists(csv_path) and manifest.get('etag'):
+                headers['If-None-Match'] = manifest['etag']
+            elif os.path.exists(csv_path) and manifest.get('last_modified'):
+                headers['If-Modified-Since'] = manifest['last_modified']
+            return await pool.request(
+                'GET', f"/api/{TABLEAU_API_VERSION}/sites/{auth['site_id']}/views/{view_id}/data", headers,
+                handle=lambda response: _save_response(response, csv_path, part_path, offset, manifest)
+            )
+
+        try:
+            return await _authorized(pool, auth, send)
+        except (_Retry, http.client.HTTPException, OSError) as e:
+            if attempt == MAX_RETRIES:
+                raise FetchError(f"Giving up on {view_name} after {MAX_RETRIES + 1} attempts: {e!r}")
+            print(f"Fetching {view_name} failed ({e!r}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+def _copy_local_view(directory, view_name, csv_path):
+    """file:// source: copy <directory>/<view_name>.csv in chunks"""
+    source = os.path.join(directory, f"{view_name}.csv")
+    if not os.path.exists(source):
+        raise FetchError(f"View not found: {source}")
+    manifest = _read_manifest(csv_path)
+    part_path = f"{csv_path}.part"
+    with open(source, 'rb') as src, open(part_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    return _finish_download(csv_path, part_path, manifest)
+
+async def fetch_views_async(views, server=None, max_connections=MAX_CONNECTIONS, on_result=None):
+    """
+    Download several views at once
+
+    Args:
+        views: Dict of view name -> CSV path to write
+        server: Tableau server URL or file:// directory (default: TABLEAU_SERVER)
+        max_connections: Connections used at the same time
+        on_result: Called with (view_name, csv_path, status) as soon as each view is done
+
+    Returns:
+        dict: View name -> 'downloaded', 'unchanged' or 'failed'
+    """
+    server = server or TABLEAU_SERVER
+    if not server:
+        raise FetchError("Set TABLEAU_SERVER to the Tableau server URL")
+    pool = None
+    auth = {'lock': asyncio.Lock()}
+    if not server.startswith('file://'):
+        pool = _ConnectionPool(server, max_connections)
+
+    async def fetch_one(view_name, csv_path):
+        try:
+            if pool is None:
+                directory = urllib.request.url2pathname(urllib.parse.urlsplit(server).path)
+                status = await asyncio.to_thread(_copy_local_view, directory, view_name, csv_path)
+            else:
+                status = await _fetch_view(pool, auth, view_name, csv_path)
+            print(f"Fetched {view_name}: {status}")
+        except Exception as e:
+            print(f"Failed to fetch {view_name}: {e}")
+            status = FAILED
+        if on_result:
+            on_result(view_name, csv_path, status)
+        return view_name, status
+
+    try:
+        return dict(await asyncio.gather(*(fetch_one(view_name, csv_path) for view_name, csv_path in views.items())))
+    finally:
+        if pool is not None:
+            pool.close()
+
+def iter_fetched_views(views, server=None, max_connections=MAX_CONNECTIONS):
+    """
+    Fetch views in a background thread and yield each one as soon as it is done, so
+    processing can start while the rest are still downloading
+
+    Yields:
+        tuple: (view_name, csv_path, status)
+    """
+    done = queue.Queue()
+    errors = []
+
+    def run():
+        try:
+            asyncio.run(fetch_views_async(views, server, max_connections, on_result=lambda *result: done.put(result)))
+        except Exception as e:
+            errors.append(e)
+            for view_name, csv_path in views.items():
+                done.put((view_name, csv_path, None))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    reported = set()
+    while len(reported) < len(views):
+        view_name, csv_path, status = done.get()
+        if view_name in reported:
+            continue
+        reported.add(view_name)
+        yield view_name, csv_path, status or FAILED
+    thread.join()
+    if errors:
+        print(f"Fetching failed: {errors[0]}")
+
+def fetch_data(view_name, csv_path):
+    """
+    Download one view to csv_path
+
+    Returns:
+        bool: True if csv_path holds the current data of the view
+    """
+    try:
+        return asyncio.run(fetch_views_async({view_name: csv_path}))[view_name] != FAILED
+    except FetchError as e:
+        print(f"Failed to fetch {view_name}: {e}")
+        return False
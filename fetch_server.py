@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import urllib.parse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Tableau REST endpoints fetch.py uses, serving
+# <directory>/<view name>.csv as the data of view <view name>, so fetching can be run
+# and tested offline:
+#
+#     python fetch_server.py exports/ 8765
+#     TABLEAU_SERVER=http://127.0.0.1:8765 python Main.py --batch
+#
+# Downloads carry an ETag and Last-Modified, and honour Range/If-Range and
+# If-None-Match. fail_after/failures cut the first downloads short to exercise resuming.
+
+TOKEN = "local-token"
+SITE_ID = "local-site"
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.endswith('/auth/signin'):
+            return self._send_json(404, {'error': 'not found'})
+        self._send_json(200, {'credentials': {'token': TOKEN, 'site': {'id': SITE_ID}}})
+
+    def do_GET(self):
+        if self.headers.get('X-Tableau-Auth') != TOKEN:
+            return self._send_json(401, {'error': 'unauthorized'})
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        # /api/<version>/sites/<site>/views and /api/<version>/sites/<site>/views/<id>/data
+        if parts[2:] == ['sites', SITE_ID, 'views']:
+            query = urllib.parse.parse_qs(url.query).get('filter', [''])[0]
+            name = query.split('viewName:eq:', 1)[-1]
+            found = os.path.exists(self._view_path(name))
+            return self._send_json(200, {'views': {'view': [{'id': urllib.parse.quote(name, safe=''), 'name': name}] if found else []}})
+        if len(parts) == 7 and parts[2:5] == ['sites', SITE_ID, 'views'] and parts[6] == 'data':
+            return self._send_view(urllib.parse.unquote(parts[5]))
+        self._send_json(404, {'error': 'not found'})
+
+    def _view_path(self, name):
+        return os.path.join(self.server.directory, f"{name}.csv")
+
+    def _send_view(self, name):
+        path = self._view_path(name)
+        if not os.path.exists(path):
+            return self._send_json(404, {'error': 'view not found'})
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+
+        start = 0
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes=') and self.headers.get('If-Range', etag) == etag:
+            start = min(int(range_header[len('bytes='):].split('-')[0]), len(data))
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(os.path.getmtime(path), usegmt=True))
+        self.send_header('Content-Length', str(len(data) - start))
+        if start:
+            self.send_header('Content-Range', f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+
+        body = data[start:]
+        with self.server.lock:
+            cut = self.server.failures > 0
+            self.server.failures -= cut
+        if cut:
+            # Simulate a dropped connection partway through the download
+            self.wfile.write(body[:self.server.fail_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+def serve(directory, host='127.0.0.1', port=8765, fail_after=0, failures=0):
+    """
+    Start the stand-in server in a background thread
+
+    Args:
+        directory: Directory holding one <view name>.csv per view
+        host, port: Address to listen on (port 0 picks a free one)
+        fail_after: Bytes sent before a download is cut short
+        failures: Number of downloads to cut short
+
+    Returns:
+        ThreadingHTTPServer: Call shutdown() to stop it; its URL is http://host:server.server_port
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.directory = directory
+    server.fail_after = fail_after
+    server.failures = failures
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else "."
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    server = serve(directory, port=port)
+    print(f"Serving views from {directory} on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
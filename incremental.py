@@ -0,0 +1,289 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+from Utilities_2 import (
+    NAT,
+    ConversationFrame,
+    response_inputs,
+    run_response_kernel,
+    response_table,
+    repetition_messages,
+    bot_handle_skill,
+    replace_file
+)
+from streaming import skill_bot_responses, summarize_response_times, summarize_repetitions, summarize_bot_handle
+
+# Incremental daily processing over overlapping exports.
+#
+# The checkpoint only keeps aggregates of every conversation of the last export: the sent
+# time of its newest processed message, the consumer time still waiting for a response, whether
+# its first response was recorded, its skill and agent-seen flags, the sums and counts
+# compute_metrics reduces its responses to, and the count, first message ID and hash of
+# every bot text (not the text itself). The next run only walks messages after their
+# conversation's checkpoint, resuming each conversation where it left off, so the metrics
+# equal a full recompute of the export while the checkpoint grows with the conversations,
+# not their messages. Conversations missing from the export are dropped from the checkpoint.
+#
+# Every run only reads the key columns of the export (conversation, sent time, message ID);
+# the full rows of the new messages are read on their own. To check that the export still
+# holds the messages the checkpoint processed, the checkpoint keeps the count and the sum of
+# the (message ID, sent time) hashes of every conversation's processed messages: a
+# conversation whose earlier messages were dropped or changed, or that got messages older
+# than its checkpoint (late arrivals), is recomputed from all of its messages. Messages that
+# keep their ID and sent time are assumed to keep their content, and messages without a sent
+# time can't be ordered against a checkpoint and are skipped.
+#
+# Messages are ordered on their sent times as exported, like preprocess_data orders them, so
+# "after the checkpoint" means sorting after the newest processed time string. With times that
+# don't sort as text (e.g. "7/8/2025 9:05:03 AM"), a new message can sort before processed
+# ones; like a late arrival, it then has its conversation recomputed.
+#
+# The response and repetition tables a run returns only hold what it computed: the responses
+# of its new messages (and of all the messages of recomputed conversations), and the repeated
+# texts among them, with their counts over the whole conversation.
+
+CHECKPOINT_VERSION = 4
+# Columns of the export read by every run
+KEY_COLUMNS = ['Conversation ID', 'Message Sent Time', 'MESSAGE_ID']
+# Sums and counts of response_totals, kept per conversation
+TOTAL_COLUMNS = ['initial_minutes', 'initial_fast', 'initial_slow',
+                 'non_initial_minutes', 'non_initial_fast', 'non_initial_slow']
+# State of a conversation the checkpoint hasn't seen ('': no message yet, NAT: nobody waiting)
+NEW_CONVERSATION = {
+    'last_sent': '',
+    'waiting_time': NAT,
+    'first_response_recorded': False,
+    'repetition_skill': False,
+    'handle_skill': False,
+    'has_agent': False,
+    'messages': 0,
+    'digest': np.uint64(0),
+    **{col: 0.0 if col.endswith('minutes') else 0 for col in TOTAL_COLUMNS}
+}
+# Saved bot texts, one row per (conversation, text hash)
+BOT_TEXT_COLUMNS = ['Conversation ID', 'text_hash', 'Message Id', 'first_time', 'Repetition Count']
+
+def _empty_state(skill_filter):
+    return {
+        'version': CHECKPOINT_VERSION,
+        'skill_filter': skill_filter,
+        'conversations': pd.DataFrame({
+            col: pd.Series([default]).iloc[:0] for col, default in NEW_CONVERSATION.items()
+        }),
+        'bot_texts': pd.DataFrame({col: [] for col in BOT_TEXT_COLUMNS})
+    }
+
+def load_checkpoint(checkpoint_path, skill_filter):
+    """
+    Load the incremental state, starting over when there is none or it was built for another skill filter
+    """
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') == CHECKPOINT_VERSION and state.get('skill_filter') == skill_filter:
+            return state
+        print(f"Checkpoint {checkpoint_path} doesn't match this run, starting from scratch")
+    return _empty_state(skill_filter)
+
+def save_checkpoint(state, checkpoint_path):
+    """Write the state to a temp file next to checkpoint_path and rename it into place"""
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as tmp_file:
+            pickle.dump(state, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+    replace_file(checkpoint_path, write)
+
+def _read_keys(csv_path):
+    """
+    Read the key columns of the export
+
+    Returns:
+        tuple: (Conversation ID Series, 'Message Sent Time' strings (None when missing),
+        uint64 hash of every message's ID and sent time)
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    keys = pd.read_csv(csv_path, usecols=[col for col in KEY_COLUMNS if col in header])
+    sent_time = keys['Message Sent Time'].astype('string')
+    hashed = {'sent_time': sent_time}
+    if 'MESSAGE_ID' in keys.columns:
+        message_id = keys['MESSAGE_ID']
+        if message_id.dtype.kind in 'iuf' and (message_id.dropna() % 1 == 0).all():
+            # Numeric IDs (floats when some are missing) are hashed as integers
+            hashed['message_id'] = message_id.astype('Int64').to_numpy(dtype=np.int64, na_value=NAT)
+        else:
+            hashed['message_id'] = message_id.astype('string')
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(hashed), index=False).to_numpy()
+    return keys['Conversation ID'], sent_time.to_numpy(dtype=object, na_value=None), hashes
+
+def _digests(export_ids, conversation_id, hashes, included):
+    """Count and (wrapping) sum of the hashes of every conversation's included messages"""
+    codes = export_ids.get_indexer(conversation_id[included])
+    digest = np.zeros(len(export_ids), dtype=np.uint64)
+    np.add.at(digest, codes, hashes[included])
+    return np.bincount(codes, minlength=len(export_ids)), digest
+
+def _read_new_messages(csv_path, new_rows):
+    """Full rows of the new messages, sorted and deduplicated like preprocess_data"""
+    # Record i of the file (0: header) is row i - 1
+    skip = np.flatnonzero(~new_rows) + 1
+    df = pd.read_csv(csv_path, skiprows=set(skip.tolist()) if len(skip) else None)
+    df = df.sort_values(by=['Conversation ID', 'Message Sent Time'])
+    return df.drop_duplicates(subset=['Conversation ID', 'Message Sent Time'], keep='first')
+
+def _resume_response_times(frame, conversations):
+    """
+    Run the response-time kernel over the new messages, starting every conversation from its checkpoint
+
+    Returns:
+        tuple: (new frt rows, new non-initial rows, Index of the walked conversations, their final waiting time and recorded flag)
+    """
+    take, role, message_type, conversation_start, named, timestamps = response_inputs(frame)
+    starts = np.flatnonzero(conversation_start)
+    walked = pd.Index(take(starts)['Conversation ID'].to_numpy()) if len(starts) else pd.Index([])
+    # A pending consumer time is passed as an extra row after the new messages
+    waiting_time = conversations['waiting_time'].reindex(walked).to_numpy(dtype=np.int64)
+    initial_waiting = np.where(waiting_time != NAT, len(timestamps) + np.arange(len(walked)), -1).astype(np.int64)
+    initial_recorded = conversations['first_response_recorded'].reindex(walked).to_numpy(dtype=bool)
+    timestamps = np.concatenate([timestamps, waiting_time])
+
+    response_rows, waiting_rows, first_response, final_waiting, final_recorded = run_response_kernel(
+        role, message_type, conversation_start, named, initial_waiting, initial_recorded
+    )
+    later = ~first_response
+    frt_df = response_table(take, role, timestamps, response_rows[first_response], waiting_rows[first_response], first_response=True)
+    non_initial_df = response_table(take, role, timestamps, response_rows[later], waiting_rows[later], first_response=False)
+    final_waiting_time = np.where(final_waiting >= 0, timestamps[final_waiting], NAT)
+    return frt_df, non_initial_df, walked, final_waiting_time, np.asarray(final_recorded, dtype=bool)
+
+def _add_response_totals(conversations, frt_df, non_initial_df, skill_filter, bot_filter):
+    """Add the response_totals of new responses to their conversations'"""
+    for kind, responses, first_response in [('initial', frt_df, True), ('non_initial', non_initial_df, False)]:
+        skill_bot = skill_bot_responses(responses, first_response, skill_filter, bot_filter)
+        if skill_bot is None:
+            continue
+        minutes = responses['Response Time (mins)'].to_numpy(dtype=np.float64)
+        fast = skill_bot & (minutes < 4)
+        codes = conversations.index.get_indexer(responses['Conversation Id'])
+        for col, values in [(f'{kind}_minutes', np.where(fast, minutes, 0.0)), (f'{kind}_fast', fast),
+                            (f'{kind}_slow', skill_bot & (minutes >= 4))]:
+            totals = conversations[col].to_numpy().copy()
+            np.add.at(totals, codes, values.astype(totals.dtype))
+            conversations[col] = totals
+
+def _count_bot_texts(frame, skill_filter):
+    """Count the new bot messages per (conversation, TEXT hash), keeping each text's first occurrence"""
+    _, is_bot_message = repetition_messages(frame, skill_filter)
+    positions = np.flatnonzero(is_bot_message)
+    rows = frame.rows(positions)
+    texts = pd.DataFrame({
+        'Conversation ID': rows['Conversation ID'].to_numpy(),
+        'text_hash': pd.util.hash_array(rows['TEXT'].to_numpy(dtype=object)),
+        'Message Id': rows['MESSAGE_ID'].to_numpy() if 'MESSAGE_ID' in rows.columns else '',
+        'Message': rows['TEXT'].to_numpy(),
+        'first_time': frame.timestamps[positions],
+        'Repetition Count': np.ones(len(positions), dtype=np.int64)
+    })
+    texts['Repetition Count'] = texts.groupby(['Conversation ID', 'text_hash'], sort=False)['Repetition Count'].transform('size')
+    return texts.drop_duplicates(subset=['Conversation ID', 'text_hash'], keep='first')
+
+def _merge_bot_texts(old, new):
+    """Add new text counts to the saved ones; the saved first occurrence is always the earlier one"""
+    if old.empty:
+        return new[BOT_TEXT_COLUMNS].reset_index(drop=True)
+    if new.empty:
+        return old
+    combined = pd.concat([old, new[BOT_TEXT_COLUMNS]], ignore_index=True)
+    combined['Repetition Count'] = combined.groupby(['Conversation ID', 'text_hash'], sort=False)['Repetition Count'].transform('sum')
+    return combined.drop_duplicates(subset=['Conversation ID', 'text_hash'], keep='first').reset_index(drop=True)
+
+def compute_incremental_metrics(csv_path, checkpoint_path, skill_filter, bot_filter="bot"):
+    """
+    Compute every metric family for an export, only processing messages the checkpoint hasn't seen
+
+    Args:
+        csv_path: Path to the exported CSV
+        checkpoint_path: Incremental state file (created on the first run, updated after every run)
+        skill_filter: Skill to filter by
+        bot_filter: Bot filter (default: "bot")
+
+    Returns:
+        tuple: (frt_df, non_initial_df, metrics, repetition_metrics, repetitions_df, bot_handle_metrics);
+        the tables only hold this run's responses and the repeated texts among its messages
+    """
+    state = load_checkpoint(checkpoint_path, skill_filter)
+    conversation_id, sent_time, hashes = _read_keys(csv_path)
+    timed = pd.notna(sent_time) & conversation_id.notna().to_numpy()
+    # Missing times compare as '', before any checkpoint (they aren't processed)
+    sent_time = np.where(timed, sent_time, '')
+
+    # Conversations that left the export are dropped, new ones start empty
+    export_ids = pd.Index(conversation_id.dropna().unique()).sort_values()
+    # (column by column, so int64 times don't go through float)
+    conversations = pd.DataFrame({
+        col: state['conversations'][col].reindex(export_ids, fill_value=default)
+        for col, default in NEW_CONVERSATION.items()
+    }, index=export_ids)
+    bot_texts = state['bot_texts'][state['bot_texts']['Conversation ID'].isin(export_ids)]
+
+    # Recompute the conversations whose processed messages aren't the ones the checkpoint saw
+    last_sent = conversations['last_sent'].reindex(conversation_id.to_numpy(), fill_value='').to_numpy(dtype=object)
+    messages, digest = _digests(export_ids, conversation_id, hashes, timed & (sent_time <= last_sent))
+    changed = export_ids[(messages != conversations['messages'].to_numpy()) | (digest != conversations['digest'].to_numpy())]
+    if len(changed):
+        print(f"{len(changed)} conversations changed since the checkpoint (messages dropped, edited or "
+              f"arrived late), recomputing them")
+        for col, default in NEW_CONVERSATION.items():
+            conversations.loc[changed, col] = default
+        bot_texts = bot_texts[~bot_texts['Conversation ID'].isin(changed)]
+        last_sent = conversations['last_sent'].reindex(conversation_id.to_numpy(), fill_value='').to_numpy(dtype=object)
+
+    new = _read_new_messages(csv_path, timed & (sent_time > last_sent))
+    print(f"Processing {len(new)} new messages of {len(sent_time)} in the export ({len(export_ids)} conversations)")
+    frame = ConversationFrame(new)
+
+    frt_df, non_initial_df, walked, final_waiting_time, final_recorded = _resume_response_times(frame, conversations)
+    conversations.loc[walked, 'waiting_time'] = final_waiting_time
+    conversations.loc[walked, 'first_response_recorded'] = final_recorded
+    _add_response_totals(conversations, frt_df, non_initial_df, skill_filter, bot_filter)
+
+    new_texts = _count_bot_texts(frame, skill_filter)
+    bot_texts = _merge_bot_texts(bot_texts, new_texts)
+
+    seen = frame.conversation_ids
+    if len(seen):
+        repetition_skill, _ = repetition_messages(frame, skill_filter)
+        conversations.loc[seen, 'repetition_skill'] |= frame.any_per_conversation(repetition_skill)
+        conversations.loc[seen, 'handle_skill'] |= frame.any_per_conversation(bot_handle_skill(frame, skill_filter))
+        conversations.loc[seen, 'has_agent'] |= frame.any_per_conversation(frame.agent_name.codes >= 0)
+        newest = new.groupby('Conversation ID')['Message Sent Time'].max()
+        conversations.loc[newest.index, 'last_sent'] = newest.to_numpy()
+        last_sent = conversations['last_sent'].reindex(conversation_id.to_numpy(), fill_value='').to_numpy(dtype=object)
+    conversations['messages'], conversations['digest'] = _digests(
+        export_ids, conversation_id, hashes, timed & (sent_time <= last_sent)
+    )
+
+    state.update(conversations=conversations, bot_texts=bot_texts)
+    save_checkpoint(state, checkpoint_path)
+
+    metrics = summarize_response_times(conversations[TOTAL_COLUMNS].sum().to_numpy().reshape(2, 3))
+
+    # Repeated texts among the new messages, most repeated first within each conversation
+    repeated = bot_texts[bot_texts['Repetition Count'] > 1]
+    touched = repeated.merge(new_texts[['Conversation ID', 'text_hash', 'Message']], on=['Conversation ID', 'text_hash'])
+    touched = touched.assign(order=-touched['Repetition Count'])
+    touched = touched.sort_values(by=['Conversation ID', 'order', 'first_time'], kind='stable')
+    repetitions_df = None
+    if len(touched):
+        repetitions_df = touched[['Conversation ID', 'Message Id', 'Message', 'Repetition Count']].reset_index(drop=True)
+    repetition_metrics = summarize_repetitions(
+        repeated['Conversation ID'].nunique(), int(conversations['repetition_skill'].sum())
+    )
+
+    total_chats = len(conversations)
+    if skill_filter == "filipina_outside" or "maidsat" in skill_filter:
+        total_chats = int(conversations['handle_skill'].sum())
+    fully_bot_conversations = int((conversations['handle_skill'] & ~conversations['has_agent']).sum())
+    bot_handle_metrics = summarize_bot_handle(total_chats, fully_bot_conversations)
+
+    return frt_df, non_initial_df, metrics, repetition_metrics, repetitions_df, bot_handle_metrics
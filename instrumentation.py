@@ -0,0 +1,322 @@
+import cProfile
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from Utilities_2 import replace_file
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Per-stage instrumentation of pipeline runs, written as one JSON report per department and day:
+#
+#     report = RunReport("Sales MV")
+#     with report.stage("preprocess_data", rows_in=len(df)) as stage:
+#         df = preprocess_data(df)
+#         stage['rows_out'] = len(df)
+#     report.write("run_reports")      # run_reports/Sales MV_2025-07-08.json
+#
+# Every stage records its wall time, the CPU time of the process, rows in and out, and the
+# peak resident set size while it ran, sampled every few milliseconds from /proc (the
+# process high-water mark from getrusage where /proc isn't available). Stages can be
+# nested; each record names its parent. RunReport(profile="cprofile") also profiles the
+# run with cProfile, and profile="sample" with a sampling profiler that adds almost no
+# overhead; the profile is saved next to the report and its top entries included in it.
+#
+# Reports of one directory can be loaded into a DataFrame with load_reports to follow the
+# stages across days: python instrumentation.py run_reports [department]
+
+PROFILERS = ('cprofile', 'sample')
+TOP_PROFILE_ENTRIES = 25
+
+def rss_bytes():
+    """Resident set size of this process from /proc (None where /proc isn't available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def max_rss_bytes():
+    """High-water mark of the resident set size of this process (None where getrusage isn't available)"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+class _PeakSampler:
+    """Samples the resident set size in a background thread until stop() is called"""
+
+    def __init__(self, interval=0.005):
+        self.start_rss = rss_bytes()
+        self.peak = self.start_rss
+        self._interval = interval
+        self._finished = threading.Event()
+        self._thread = None
+        if self.start_rss is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        while not self._finished.wait(self._interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self):
+        """Stop sampling and return the peak resident set size in bytes (None if it can't be sampled)"""
+        self._finished.set()
+        if self._thread is None:
+            return None
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+        return self.peak
+
+def measure(fn, trace_memory=True, interval=0.005):
+    """
+    Run fn() once
+
+    Returns:
+        tuple: (result, wall seconds, peak memory growth in bytes or None)
+    """
+    sampler = _PeakSampler(interval) if trace_memory else None
+    use_tracemalloc = trace_memory and sampler.start_rss is None
+    if use_tracemalloc:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+    finally:
+        peak = sampler.stop() if sampler else None
+        if peak is not None:
+            peak -= sampler.start_rss
+        if use_tracemalloc:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result, seconds, peak
+
+class _StackSampler:
+    """Counts the call stacks of one thread, sampled every interval seconds from another thread"""
+
+    def __init__(self, thread_id, interval=0.01):
+        self.counts = Counter()
+        self._thread_id = thread_id
+        self._interval = interval
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._finished.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._finished.set()
+        self._thread.join()
+
+def _mb(n_bytes):
+    return round(n_bytes / 1e6, 1) if n_bytes is not None else None
+
+class RunReport:
+    """
+    Stage timings of one pipeline run
+
+    Args:
+        department: Department (or batch) the run is for
+        date: Day of the run as YYYY-MM-DD (default: today)
+        profile: None, "cprofile" or "sample" to profile the run until write() is called
+    """
+
+    def __init__(self, department, date=None, profile=None):
+        if profile not in (None,) + PROFILERS:
+            raise ValueError(f"Unknown profiler {profile!r}, expected one of {PROFILERS}")
+        self.department = department
+        self.date = date or datetime.now().strftime("%Y-%m-%d")
+        self.details = {}
+        self.stages = []
+        self.status = 'ok'
+        self.error = None
+        self._started_at = datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._open_stages = []
+        self._profile = profile
+        self._profiler = None
+        if profile == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif profile == 'sample':
+            self._profiler = _StackSampler(threading.get_ident())
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Time the code in the with block as one stage
+
+        Yields the stage record; set record['rows_out'] (or any other key) inside the block.
+        A stage that raises is recorded with status "failed" and the exception propagates.
+        """
+        record = {
+            'stage': name,
+            'parent': self._open_stages[-1]['stage'] if self._open_stages else None,
+            'rows_in': rows_in,
+            'rows_out': None,
+        }
+        self._open_stages.append(record)
+        sampler = _PeakSampler()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException as e:
+            record['status'] = 'failed'
+            record['error'] = repr(e)
+            raise
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - start_wall, 4)
+            record['cpu_seconds'] = round(time.process_time() - start_cpu, 4)
+            peak = sampler.stop()
+            if peak is None:
+                record['peak_rss_mb'], record['rss_growth_mb'] = _mb(max_rss_bytes()), None
+            else:
+                record['peak_rss_mb'], record['rss_growth_mb'] = _mb(peak), _mb(peak - sampler.start_rss)
+            if record['rows_in'] is not None and record['wall_seconds'] > 0:
+                record['rows_per_second'] = round(record['rows_in'] / record['wall_seconds'])
+            self._open_stages.pop()
+            self.stages.append(record)
+
+    def record(self, name, wall_seconds, **fields):
+        """Add a stage timed elsewhere (e.g. a download running in another thread)"""
+        self.stages.append({'stage': name, 'parent': None, 'wall_seconds': round(wall_seconds, 4), **fields})
+
+    def fail(self, error):
+        """Mark the run as failed"""
+        self.status = 'failed'
+        self.error = repr(error)
+
+    def _stop_profiler(self, base_path):
+        """Stop profiling, save the profile next to the report and return its summary"""
+        if self._profiler is None:
+            return None
+        if self._profile == 'cprofile':
+            self._profiler.disable()
+            path = f"{base_path}.prof"
+            self._profiler.dump_stats(path)
+            stats = pstats.Stats(self._profiler).stats
+            entries = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_PROFILE_ENTRIES]
+            top = [
+                {
+                    'function': f"{os.path.basename(filename)}:{line}({function})",
+                    'calls': calls,
+                    'total_seconds': round(total_time, 4),
+                    'cumulative_seconds': round(cumulative_time, 4),
+                }
+                for (filename, line, function), (_, calls, total_time, cumulative_time, _) in entries
+            ]
+        else:
+            self._profiler.stop()
+            path = f"{base_path}.folded"
+            # Collapsed stacks, readable by flamegraph.pl and speedscope
+            with open(path, 'w') as f:
+                for stack, count in self._profiler.counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            leaves = Counter()
+            for stack, count in self._profiler.counts.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            total = sum(leaves.values()) or 1
+            top = [
+                {'function': function, 'samples': count, 'share': round(count / total, 4)}
+                for function, count in leaves.most_common(TOP_PROFILE_ENTRIES)
+            ]
+        self._profiler = None
+        return {'profiler': self._profile, 'path': path, 'top': top}
+
+    def to_dict(self):
+        peaks = [stage['peak_rss_mb'] for stage in self.stages if stage.get('peak_rss_mb') is not None]
+        return {
+            'department': self.department,
+            'date': self.date,
+            'started_at': self._started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'status': self.status,
+            'error': self.error,
+            'wall_seconds': round(time.perf_counter() - self._start_wall, 4),
+            'cpu_seconds': round(time.process_time() - self._start_cpu, 4),
+            'peak_rss_mb': max(peaks) if peaks else _mb(max_rss_bytes()),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'pid': os.getpid(),
+            'details': self.details,
+            'stages': self.stages,
+        }
+
+    def write(self, report_dir="run_reports"):
+        """
+        Write the report as <report_dir>/<department>_<date>.json, replacing an earlier run of that day
+
+        Returns:
+            str: Path of the report
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        base_path = os.path.join(report_dir, f"{self.department}_{self.date}")
+        report = self.to_dict()
+        report['profile'] = self._stop_profiler(base_path)
+        path = f"{base_path}.json"
+        def dump(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+        replace_file(path, dump)
+        print(f"Wrote run report to {path}")
+        return path
+
+def load_reports(report_dir="run_reports", department=None):
+    """
+    Load the stage records of every report in a directory
+
+    Returns:
+        DataFrame: One row per department, date and stage, with the run's status and totals
+    """
+    import pandas as pd
+
+    rows = []
+    for filename in sorted(os.listdir(report_dir)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(report_dir, filename)) as f:
+            report = json.load(f)
+        if department is not None and report['department'] != department:
+            continue
+        for stage in report['stages']:
+            rows.append({
+                'department': report['department'],
+                'date': report['date'],
+                'run_status': report['status'],
+                'run_wall_seconds': report['wall_seconds'],
+                **stage,
+            })
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+    # python instrumentation.py <report_dir> [department]: wall seconds per stage and day
+    reports = load_reports(sys.argv[1] if len(sys.argv) > 1 else "run_reports", sys.argv[2] if len(sys.argv) > 2 else None)
+    if reports.empty:
+        print("No run reports found")
+    else:
+        print(reports.pivot_table(index=['department', 'date'], columns='stage', values='wall_seconds', aggfunc='sum').to_string())
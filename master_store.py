@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import pandas as pd
+from datetime import date, datetime
+
+from Utilities_2 import replace_csv
+
+# Optional SQLite backend for the master metrics, keyed on (Department, ISO date).
+# Values are stored one per (department, date, column) so any column written by a
+# master_row can be upserted without rewriting anything else, and export_master_csv
+# rebuilds the "Master Sheet.csv" layout for downstream consumers.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS master_rows (
+    department TEXT NOT NULL,
+    date TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (department, date)
+);
+CREATE INDEX IF NOT EXISTS master_rows_date ON master_rows (date);
+CREATE TABLE IF NOT EXISTS master_columns (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS master_values (
+    department TEXT NOT NULL,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value,
+    PRIMARY KEY (department, date, name)
+) WITHOUT ROWID;
+"""
+
+def iso_date(value):
+    """Convert a master sheet date ("July 08, 2025"), date or datetime to "2025-07-08" """
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return datetime.strptime(value, "%B %d, %Y").date().isoformat()
+
+def _sql_value(value):
+    """SQLite only stores Python scalars: unwrap NumPy values and store NaN as NULL"""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def connect(db_path, seed_csv_path=None):
+    """
+    Open the master metrics database, creating the schema if needed
+
+    Args:
+        db_path: Path to the SQLite database
+        seed_csv_path: Master CSV to import when the database is created (optional)
+    """
+    is_new = not os.path.exists(db_path)
+    connection = sqlite3.connect(db_path, timeout=60)
+    connection.executescript(SCHEMA)
+    if is_new and seed_csv_path and os.path.exists(seed_csv_path):
+        import_master_csv(connection, seed_csv_path)
+    return connection
+
+def upsert_rows(connection, rows):
+    """
+    Upsert master sheet rows (as built by master_row) in one transaction
+
+    Each (Department, Date) row and each of its columns is found through the primary
+    key index, so the cost doesn't grow with the size of the sheet.
+    """
+    with connection:
+        for row in rows:
+            department, day = row['Department'], iso_date(row['Date'])
+            connection.execute(
+                "INSERT INTO master_rows (department, date, position) "
+                "SELECT ?, ?, COALESCE(MAX(position), -1) + 1 FROM master_rows WHERE true "
+                "ON CONFLICT (department, date) DO NOTHING",
+                (department, day)
+            )
+            for name, value in row.items():
+                if name in ['Date', 'Department']:
+                    continue
+                connection.execute(
+                    "INSERT INTO master_columns (name, position) "
+                    "SELECT ?, COALESCE(MAX(position), -1) + 1 FROM master_columns WHERE true "
+                    "ON CONFLICT (name) DO NOTHING",
+                    (name,)
+                )
+                connection.execute(
+                    "INSERT INTO master_values (department, date, name, value) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (department, date, name) DO UPDATE SET value = excluded.value",
+                    (department, day, name, _sql_value(value))
+                )
+    print(f"Upserted {len(rows)} rows into the master metrics database")
+
+def _csv_value(text):
+    """A CSV field as the int, float or string it spells, so the export writes it back the same way"""
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return text
+
+def import_master_csv(connection, csv_path):
+    """Load an existing master CSV into the database, keeping its row and column order"""
+    # Read as text: columns with empty cells would read "38" as 38.0
+    master_df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    rows = [
+        {col: value if col in ['Date', 'Department'] else _csv_value(value) for col, value in row.items()
+         if value != '' or col in ['Date', 'Department']}
+        for row in master_df.to_dict('records')
+    ]
+    with connection:
+        for position, name in enumerate(col for col in master_df.columns if col not in ['Date', 'Department']):
+            connection.execute("INSERT OR IGNORE INTO master_columns (name, position) VALUES (?, ?)", (name, position))
+    upsert_rows(connection, rows)
+
+def query_rows(connection, start_date=None, end_date=None, departments=None):
+    """
+    Get master sheet rows in the CSV layout, optionally for a date range and set of departments
+
+    Args:
+        connection: Connection from connect()
+        start_date: First date to include (master sheet string, date or datetime)
+        end_date: Last date to include
+        departments: Departments to include (default: all)
+
+    Returns:
+        DataFrame with Department, Date ("July 08, 2025") and one column per metric
+    """
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append("r.date >= ?")
+        params.append(iso_date(start_date))
+    if end_date is not None:
+        conditions.append("r.date <= ?")
+        params.append(iso_date(end_date))
+    if departments:
+        conditions.append(f"r.department IN ({', '.join('?' * len(departments))})")
+        params.extend(departments)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    master_rows = connection.execute(
+        f"SELECT r.department, r.date FROM master_rows r {where} ORDER BY r.position", params
+    ).fetchall()
+    values = {}
+    for department, day, name, value in connection.execute(
+        f"SELECT v.department, v.date, v.name, v.value FROM master_values v "
+        f"JOIN master_rows r ON r.department = v.department AND r.date = v.date {where}", params
+    ):
+        values.setdefault((department, day), {})[name] = value
+    columns = [name for (name,) in connection.execute("SELECT name FROM master_columns ORDER BY position")]
+
+    master_df = pd.DataFrame(
+        [
+            {'Department': department, 'Date': date.fromisoformat(day).strftime("%B %d, %Y"), **values.get((department, day), {})}
+            for department, day in master_rows
+        ],
+        columns=['Department', 'Date'] + columns
+    )
+    # Keep the stored ints as ints: integer columns with missing values, or mixed with floats,
+    # would be written as floats (38.0)
+    stored = {}
+    for row_values in values.values():
+        for name, value in row_values.items():
+            if value is not None:
+                stored.setdefault(name, set()).add(type(value))
+    for col in columns:
+        if stored.get(col) == {int}:
+            master_df[col] = master_df[col].astype('Int64')
+        elif stored.get(col) == {int, float}:
+            master_df[col] = pd.Series(
+                [values.get(key, {}).get(col) for key in master_rows], index=master_df.index, dtype=object
+            )
+    return master_df
+
+def export_master_csv(connection, csv_path):
+    """Write the whole database to csv_path in the "Master Sheet.csv" layout"""
+    master_df = query_rows(connection)
+    replace_csv(master_df, csv_path)
+    print(f"Exported {len(master_df)} rows to {csv_path}")
+    return master_df
@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+
+# Near-duplicate detection of short texts with MinHash and locality-sensitive hashing, for
+# bot messages that repeat with a different name, number or spacing.
+#
+# Texts are normalized (lowercase, runs of digits replaced by "#", whitespace collapsed)
+# and cut into overlapping character shingles. The MinHash signature of a text keeps, in
+# each of num_perm bins, the smallest hash of the shingles falling in it; two signatures
+# agree on a bin with probability close to the Jaccard similarity of the shingle sets, so
+# the share of equal bins estimates it. Signatures are split into bands, and only items
+# of the same group (conversation) sharing a whole band are compared, which keeps the work
+# linear in the number of items instead of quadratic. Candidates are linked to the first
+# item of their bucket when their estimated similarity reaches the threshold, and linked
+# items form one cluster.
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+DEFAULT_THRESHOLD = 0.8
+# Signature value of texts with no shingles (empty after normalization)
+EMPTY = np.iinfo(np.uint32).max
+# Shingles hashed per block, to bound the memory of long texts
+BLOCK_SHINGLES = 1 << 22
+
+def _splitmix64(values):
+    """Mix uint64 values so that nearby inputs get unrelated hashes"""
+    with np.errstate(over='ignore'):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+def normalize_texts(texts):
+    """
+    Normalize texts before shingling
+
+    Returns:
+        list: Lowercased texts with runs of digits replaced by "#" and whitespace collapsed
+    """
+    texts = pd.Series(texts, dtype=object).fillna('').astype(str)
+    texts = texts.str.lower().str.replace(r'\d+', '#', regex=True).str.replace(r'\s+', ' ', regex=True).str.strip()
+    return texts.tolist()
+
+def _shingle_hashes(texts, shingle_size):
+    """
+    Hash of every character shingle of every text
+
+    A text shorter than shingle_size is one shingle; an empty text has none.
+
+    Returns:
+        tuple: (uint64 hashes, not mixed yet, and the number of shingles of every text)
+    """
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    counts = np.where(lengths > 0, np.maximum(lengths - shingle_size + 1, 1), 0)
+    # Code points of the texts, each followed by shingle_size - 1 zeros of padding
+    padding = '\0' * (shingle_size - 1)
+    code_points = np.frombuffer(''.join(text + padding for text in texts).encode('utf-32-le'), dtype=np.uint32)
+    code_points = code_points.astype(np.uint64)
+    offsets = np.concatenate([[0], np.cumsum(lengths + shingle_size - 1)[:-1]]).astype(np.int64)
+    starts = np.repeat(offsets, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+    # Polynomial hash of the shingle starting at every position, on contiguous slices
+    multipliers = _splitmix64(np.arange(1, shingle_size + 1, dtype=np.uint64)) | np.uint64(1)
+    n_positions = len(code_points) - shingle_size + 1
+    hashes = np.zeros(max(n_positions, 0), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for j in range(shingle_size):
+            hashes += code_points[j:j + n_positions] * multipliers[j]
+    return hashes[starts], counts
+
+def _densify(signatures):
+    """
+    Fill the empty bins of every signature from the next non-empty bin to the right (wrapping
+    around), mixed with the distance borrowed over, so that two texts share a filled bin about
+    as often as they share a real one
+    """
+    n_bins = signatures.shape[1]
+    filled = signatures != EMPTY
+    has_shingles = filled.any(axis=1)
+    columns = np.arange(2 * n_bins, dtype=np.int32)
+    # Column of the next non-empty bin, over the signature repeated twice for the wrap-around
+    positions = np.where(np.tile(filled, 2), columns, 2 * n_bins - 1)
+    next_filled = np.minimum.accumulate(positions[:, ::-1], axis=1)[:, ::-1][:, :n_bins]
+    borrowed = np.take_along_axis(np.tile(signatures, 2), next_filled, axis=1)
+    distance = (next_filled - np.arange(n_bins, dtype=np.int32)).astype(np.uint64)
+    mixed = (_splitmix64(borrowed.astype(np.uint64) ^ (distance << np.uint64(32))) >> np.uint64(32)).astype(np.uint32)
+    return np.where(filled | ~has_shingles[:, None], signatures, mixed)
+
+def minhash_signatures(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=0):
+    """
+    MinHash signatures of texts
+
+    Computed with one permutation hashing: every shingle is hashed once, the hash picks one
+    of num_perm bins and the signature keeps the smallest value that fell in each bin. Bins
+    a short text leaves empty are densified from their neighbours. This estimates the
+    Jaccard similarity like num_perm separate hash functions, at the cost of one.
+
+    Args:
+        texts: Texts (normalized here with normalize_texts)
+        num_perm: Bins per signature
+        shingle_size: Characters per shingle
+        seed: Seed of the hash (signatures are only comparable with the same seed)
+
+    Returns:
+        ndarray: uint32 of shape (len(texts), num_perm); rows of texts with no shingles are EMPTY
+    """
+    texts = normalize_texts(texts)
+    salt = np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+    signatures = np.full((len(texts), num_perm), EMPTY, dtype=np.uint32)
+    flat = signatures.reshape(-1)
+
+    # Blocks of whole texts with about BLOCK_SHINGLES shingles each
+    start = 0
+    while start < len(texts):
+        end, shingles = start, 0
+        while end < len(texts) and (end == start or shingles < BLOCK_SHINGLES):
+            shingles += max(len(texts[end]) - shingle_size + 1, 1)
+            end += 1
+        hashes, counts = _shingle_hashes(texts[start:end], shingle_size)
+        hashes = _splitmix64(hashes ^ salt)
+        text_of_shingle = np.repeat(np.arange(start, end, dtype=np.int64), counts)
+        bins = ((hashes >> np.uint64(32)) % np.uint64(num_perm)).astype(np.int64)
+        # EMPTY itself is never a value, so empty bins stay recognizable
+        values = np.minimum(hashes.astype(np.uint32), EMPTY - 1)
+        np.minimum.at(flat, text_of_shingle * num_perm + bins, values)
+        start = end
+    return _densify(signatures)
+
+def lsh_parameters(threshold, num_perm=NUM_PERM):
+    """
+    Bands and rows per band for a similarity threshold
+
+    Picks the split whose chance of making two items candidates, 1 - (1 - s^rows)^bands,
+    gives the least false positives below the threshold plus false negatives above it.
+
+    Returns:
+        tuple: (bands, rows)
+    """
+    similarities = np.linspace(0, 1, 201)
+    best, best_error = (num_perm, 1), np.inf
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        candidate = 1 - (1 - similarities ** rows) ** bands
+        error = np.where(similarities < threshold, candidate, 1 - candidate).mean()
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+def _components(n, first, second):
+    """Label of every item: the smallest item linked to it, directly or through others"""
+    labels = np.arange(n)
+    while True:
+        linked = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, linked)
+        np.minimum.at(updated, second, linked)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+def cluster_signatures(groups, text_ids, signatures, threshold=DEFAULT_THRESHOLD):
+    """
+    Cluster the near-duplicate items of every group
+
+    Args:
+        groups: Group of every item (only items of the same group are compared)
+        text_ids: Row of signatures of every item
+        signatures: Output of minhash_signatures
+        threshold: Estimated Jaccard similarity from which two items are near-duplicates
+
+    Returns:
+        ndarray: Cluster of every item, the position of the cluster's first item
+    """
+    groups = np.asarray(groups)
+    text_ids = np.asarray(text_ids)
+    n = len(groups)
+    if not n:
+        return np.zeros(0, dtype=np.int64)
+    bands, rows = lsh_parameters(threshold, signatures.shape[1])
+    has_shingles = signatures[:, 0] != EMPTY
+    multipliers = _splitmix64(np.arange(1, rows + 1, dtype=np.uint64)) | np.uint64(1)
+
+    first, second = [], []
+    for band in range(bands):
+        # Bucket of every text: a hash of its rows of the band
+        keys = np.zeros(len(signatures), dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for j in range(rows):
+                keys += signatures[:, band * rows + j].astype(np.uint64) * multipliers[j]
+        keys = keys[text_ids]
+        order = np.lexsort((keys, groups))
+        sorted_keys, sorted_groups = keys[order], groups[order]
+        bucket_start = np.ones(n, dtype=bool)
+        bucket_start[1:] = (sorted_keys[1:] != sorted_keys[:-1]) | (sorted_groups[1:] != sorted_groups[:-1])
+        # Link every item to the first item of its bucket
+        representative = order[np.flatnonzero(bucket_start)[np.cumsum(bucket_start) - 1]]
+        candidates = representative != order
+        first.append(representative[candidates])
+        second.append(order[candidates])
+
+    first, second = np.concatenate(first), np.concatenate(second)
+    pairs = np.unique(np.stack([first, second], axis=1), axis=0) if len(first) else np.zeros((0, 2), dtype=np.int64)
+    first, second = pairs[:, 0], pairs[:, 1]
+    left, right = text_ids[first], text_ids[second]
+    similarity = (signatures[left] == signatures[right]).mean(axis=1)
+    linked = (similarity >= threshold) & has_shingles[left] & has_shingles[right]
+    return _components(n, first[linked], second[linked])
+
+def near_duplicate_clusters(groups, texts, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE):
+    """
+    Cluster near-duplicate texts within every group
+
+    Args:
+        groups: Group of every text (e.g. its conversation)
+        texts: Texts to cluster; identical texts share one signature
+        threshold: Estimated Jaccard similarity from which two texts are near-duplicates
+
+    Returns:
+        ndarray: Cluster of every text, the position of the cluster's first text
+    """
+    text_ids, distinct = pd.factorize(pd.Series(texts, dtype=object).fillna(''))
+    signatures = minhash_signatures(np.asarray(distinct, dtype=object), num_perm, shingle_size)
+    return cluster_signatures(groups, text_ids, signatures, threshold)
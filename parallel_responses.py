@@ -0,0 +1,124 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from Utilities_2 import (
+    minutes_between,
+    response_inputs,
+    response_table,
+    run_response_kernel
+)
+
+# Response times computed by several processes over shared memory.
+#
+#     frt_df, non_initial_df = calculate_response_times_parallel(frame, workers=8)
+#
+# The messages are filtered and encoded once, as for calculate_response_times, and the
+# encoded columns (role, message type, conversation start, named and timestamp) are
+# copied into one shared memory block. Worker processes map that block instead of
+# receiving pickled copies, and each one walks the response-time kernel over shards of
+# whole conversations (the kernel's state never crosses a conversation boundary) and
+# computes their minutes. Only the responses come back; they are concatenated in shard
+# order, which is the order calculate_response_times gives, and turned into the same
+# records.
+
+# Below this many filtered messages, starting processes costs more than it saves
+MIN_PARALLEL_ROWS = 200_000
+# Shards per worker, so that a worker with short conversations takes another shard
+SHARDS_PER_WORKER = 4
+
+# Encoded columns of the shared block, in order
+_COLUMNS = ['role', 'message_type', 'conversation_start', 'named', 'timestamps']
+
+# Columns of the shared block, mapped once per worker process
+_shared = {}
+
+def _shard_bounds(conversation_start, n_shards):
+    """
+    Cut the messages into about n_shards runs of whole conversations of similar size
+
+    Returns:
+        ndarray: Offsets of the shards, from 0 to the number of messages
+    """
+    n = len(conversation_start)
+    starts = np.flatnonzero(conversation_start)
+    targets = np.linspace(0, n, n_shards + 1)[1:-1]
+    cuts = starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)]
+    return np.unique(np.concatenate([[0], cuts, [n]]))
+
+def _share(columns):
+    """
+    Copy arrays into one shared memory block
+
+    Returns:
+        tuple: (SharedMemory, layout of (name, dtype, offset, length) to map them back)
+    """
+    layout, size = [], 0
+    for name in _COLUMNS:
+        values = columns[name]
+        layout.append((name, values.dtype.str, size, len(values)))
+        # 8-byte aligned, for the int64 columns
+        size += -(-values.nbytes // 8) * 8
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, dtype, offset, length in layout:
+        np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=offset)[:] = columns[name]
+    return shm, layout
+
+def _attach(shm_name, layout):
+    """Worker initializer: map the shared block's columns"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _shared['shm'] = shm
+    for name, dtype, offset, length in layout:
+        _shared[name] = np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=offset)
+
+def _shard_responses(columns, start, end):
+    """
+    Walk the response-time kernel over the messages start:end (whole conversations)
+
+    Returns:
+        tuple: (response rows, consumer rows, first response flags, minutes), rows counted from 0
+    """
+    role, message_type, conversation_start, named, timestamps = (columns[name][start:end] for name in _COLUMNS)
+    response_rows, waiting_rows, first_response, _, _ = run_response_kernel(role, message_type, conversation_start, named)
+    minutes = np.array(minutes_between(timestamps[response_rows], timestamps[waiting_rows]), dtype=np.float64)
+    return response_rows + start, waiting_rows + start, first_response, minutes
+
+def _shard_task(start, end):
+    return _shard_responses(_shared, start, end)
+
+def calculate_response_times_parallel(df, workers=None, min_rows=MIN_PARALLEL_ROWS):
+    """
+    Calculate first and non-initial response times like calculate_response_times, in parallel
+
+    Args:
+        df: DataFrame or ConversationFrame with conversation data
+        workers: Worker processes (default: one per CPU)
+        min_rows: Compute in this process when fewer messages than this are walked
+
+    Returns:
+        tuple: (frt_df, non_initial_df), identical to calculate_response_times
+    """
+    take, role, message_type, conversation_start, named, timestamps = response_inputs(df)
+    columns = dict(zip(_COLUMNS, (role, message_type, conversation_start, named, timestamps)))
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(role) < max(min_rows, 1):
+        response_rows, waiting_rows, first_response, minutes = _shard_responses(columns, 0, len(role))
+    else:
+        bounds = _shard_bounds(conversation_start, workers * SHARDS_PER_WORKER)
+        shm, layout = _share(columns)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(shm.name, layout)) as executor:
+                shards = list(executor.map(_shard_task, bounds[:-1], bounds[1:]))
+        finally:
+            shm.close()
+            shm.unlink()
+        response_rows, waiting_rows, first_response, minutes = (np.concatenate(parts) for parts in zip(*shards))
+
+    later = ~first_response
+    frt_df = response_table(take, role, timestamps, response_rows[first_response], waiting_rows[first_response],
+                             first_response=True, minutes=minutes[first_response].tolist())
+    non_initial_df = response_table(take, role, timestamps, response_rows[later], waiting_rows[later],
+                                     first_response=False, minutes=minutes[later].tolist())
+    return frt_df, non_initial_df
@@ -0,0 +1,292 @@
+import json
+import math
+import os
+import sys
+import numpy as np
+from datetime import date as date_type, datetime, timedelta
+
+from Utilities_2 import file_lock, replace_file, response_senders
+
+# Mergeable sketches of response times, so percentiles over any range of days and set of
+# departments come from a few small files instead of the raw FRT/non-initial outputs.
+#
+# A sketch is a histogram over logarithmic buckets: bucket i counts the times in
+# (gamma^(i-1), gamma^i] with gamma = (1 + a) / (1 - a), so every quantile it returns is
+# within a relative error a (1% by default) of a true value, whatever the data. Merging
+# two sketches adds their bucket counts, which is exact, so a week of sketches merged
+# gives the same answer as one sketch built from the week's responses.
+#
+# Each run stores one sketch per kind ("initial", "non_initial") and sender class:
+# "skill_bot" (the responses compute_metrics averages: the sender contains the skill and
+# the bot filter), "other_bot", "agent" and "system". They are kept per day in
+# <master sheet> sketches/<YYYY-MM-DD>.json, keyed on (department, kind, sender class)
+# and replaced when a department is rerun on the same day, like the master sheet rows.
+#
+#     python response_sketches.py "Master Sheet.csv" 2025-07-01 2025-07-07 [department ...]
+
+RELATIVE_ACCURACY = 0.01
+STORE_VERSION = 1
+KINDS = ('initial', 'non_initial')
+SENDER_CLASSES = ('skill_bot', 'other_bot', 'agent', 'system')
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+# Times at or below this (in minutes) are counted in the zero bucket
+MIN_VALUE = 1e-6
+
+class ResponseSketch:
+    """
+    Log-bucketed histogram of response times (minutes) with relative-error quantiles
+
+    Args:
+        relative_accuracy: Relative error of the quantiles
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.offset = 0  # Bucket index of counts[0]
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        """Add response times (minutes); missing values are skipped"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        positive = values[values > MIN_VALUE]
+        self.zero_count += len(values) - len(positive)
+        if len(positive):
+            index = np.ceil(np.log(positive) / self._log_gamma).astype(np.int64)
+            low = int(index.min())
+            self._add_counts(low, np.bincount(index - low))
+        return self
+
+    def _add_counts(self, offset, counts):
+        if not len(counts):
+            return
+        if not len(self.counts):
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        low = min(self.offset, offset)
+        high = max(self.offset + len(self.counts), offset + len(counts))
+        merged = np.zeros(high - low, dtype=np.int64)
+        merged[self.offset - low:self.offset - low + len(self.counts)] += self.counts
+        merged[offset - low:offset - low + len(counts)] += counts
+        self.offset, self.counts = low, merged
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same relative accuracy to this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f"Can't merge sketches with relative accuracy {self.relative_accuracy} and {other.relative_accuracy}")
+        self._add_counts(other.offset, other.counts)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """Time (minutes) at quantile q, within relative_accuracy of the exact value (None if empty)"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0.0)
+        cumulative = np.cumsum(self.counts)
+        bucket = int(np.searchsorted(cumulative, rank - self.zero_count, side='right'))
+        bucket = min(bucket, len(self.counts) - 1)
+        value = 2 * self.gamma ** (self.offset + bucket) / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def quantiles(self, qs=DEFAULT_QUANTILES):
+        return {f"p{round(q * 100, 1):g}": self.quantile(q) for q in qs}
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'offset': self.offset,
+            'counts': self.counts.tolist(),
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'])
+        sketch.offset = data['offset']
+        sketch.counts = np.asarray(data['counts'], dtype=np.int64)
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        if data['count']:
+            sketch.min, sketch.max = data['min'], data['max']
+        return sketch
+
+def classify_senders(responses, first_response, skill_filter, bot_filter="bot"):
+    """
+    Sender class of every response of a response-time table
+
+    Returns:
+        ndarray: "skill_bot", "other_bot", "agent" or "system" per response
+    """
+    senders = response_senders(responses, first_response)
+    skill_bot = (senders.str.contains(skill_filter, case=False, na=False)
+                 & senders.str.contains(bot_filter, case=False, na=False))
+    classes = np.full(len(senders), 'agent', dtype=object)
+    if 'Sender Role' in responses.columns:
+        role = responses['Sender Role'].to_numpy(dtype=object)
+        classes[role == 'system'] = 'system'
+        classes[role == 'bot'] = 'other_bot'
+    else:
+        senders = senders.astype(str)
+        classes[(senders == 'System').to_numpy()] = 'system'
+        classes[senders.str.startswith('BOT_').to_numpy()] = 'other_bot'
+    classes[skill_bot.to_numpy(dtype=bool)] = 'skill_bot'
+    return classes
+
+def build_sketches(frt_df, non_initial_df, skill_filter, bot_filter="bot", relative_accuracy=RELATIVE_ACCURACY):
+    """
+    Sketch the response times of one run
+
+    Args:
+        frt_df: DataFrame with first response times
+        non_initial_df: DataFrame with non-initial response times
+        skill_filter: Skill the "skill_bot" class is filtered by
+        bot_filter: Bot filter (default: "bot")
+
+    Returns:
+        dict: (kind, sender class) -> ResponseSketch, for the classes with responses
+    """
+    sketches = {}
+    for kind, responses in zip(KINDS, [frt_df, non_initial_df]):
+        if responses.empty or 'Response Time (mins)' not in responses.columns:
+            continue
+        classes = classify_senders(responses, kind == 'initial', skill_filter, bot_filter)
+        minutes = responses['Response Time (mins)'].to_numpy(dtype=np.float64)
+        for sender_class in SENDER_CLASSES:
+            selected = minutes[classes == sender_class]
+            if len(selected):
+                sketches[(kind, sender_class)] = ResponseSketch(relative_accuracy).add(selected)
+    return sketches
+
+def sketch_dir(master_csv_path):
+    """Directory the sketches of a master sheet are kept in"""
+    return f"{os.path.splitext(master_csv_path)[0]} sketches"
+
+def to_day(value):
+    """The date of a day given as a date, datetime or ISO string ("2025-07-08"); today when None"""
+    if value is None:
+        return datetime.now().date()
+    if isinstance(value, str):
+        return date_type.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+def _day_path(directory, day):
+    return os.path.join(directory, f"{day.isoformat()}.json")
+
+def _read_day(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+    if data.get('version') != STORE_VERSION:
+        return []
+    return data['sketches']
+
+def _write_day(entries, path):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': STORE_VERSION, 'sketches': entries}, f)
+    replace_file(path, write)
+
+def save_sketches(sketches, department, master_csv_path, date=None):
+    """
+    Store a run's sketches for (department, day), replacing the department's earlier sketches of that day
+
+    Args:
+        sketches: Output of build_sketches
+        department: Department name
+        master_csv_path: Master CSV the sketches are stored next to
+        date: Day of the run (default: today)
+
+    Returns:
+        str: Path of the day's sketch file
+    """
+    directory = sketch_dir(master_csv_path)
+    os.makedirs(directory, exist_ok=True)
+    path = _day_path(directory, to_day(date))
+    with file_lock(path):
+        entries = [entry for entry in _read_day(path) if entry['department'] != department]
+        for (kind, sender_class), sketch in sorted(sketches.items()):
+            entries.append({'department': department, 'kind': kind, 'sender_class': sender_class, **sketch.to_dict()})
+        _write_day(entries, path)
+    return path
+
+def merged_sketch(master_csv_path, start=None, end=None, departments=None, kinds=KINDS,
+                  sender_classes=('skill_bot',), relative_accuracy=RELATIVE_ACCURACY):
+    """
+    Merge the stored sketches of a range of days
+
+    Args:
+        master_csv_path: Master CSV the sketches are stored next to
+        start, end: First and last day (inclusive, dates or YYYY-MM-DD); default today
+        departments: Departments to include (default: all)
+        kinds: "initial" and/or "non_initial"
+        sender_classes: Sender classes to include
+
+    Returns:
+        ResponseSketch: Every matching response time, merged
+    """
+    first, last = to_day(start), to_day(end if end is not None else start)
+    merged = ResponseSketch(relative_accuracy)
+    directory = sketch_dir(master_csv_path)
+    for offset in range((last - first).days + 1):
+        for entry in _read_day(_day_path(directory, first + timedelta(days=offset))):
+            if ((departments is None or entry['department'] in departments)
+                    and entry['kind'] in kinds and entry['sender_class'] in sender_classes):
+                merged.merge(ResponseSketch.from_dict(entry))
+    return merged
+
+def query_percentiles(master_csv_path, start=None, end=None, departments=None, kinds=KINDS,
+                      sender_classes=('skill_bot',), quantiles=DEFAULT_QUANTILES):
+    """
+    Response-time percentiles over a range of days and set of departments
+
+    Returns:
+        dict: count, mean and one "p<q>" entry per quantile (minutes)
+    """
+    sketch = merged_sketch(master_csv_path, start, end, departments, kinds, sender_classes)
+    mean = sketch.mean
+    return {
+        'count': sketch.count,
+        'mean': round(mean, 2) if mean is not None else None,
+        **{name: round(value, 2) if value is not None else None for name, value in sketch.quantiles(quantiles).items()},
+    }
+
+if __name__ == "__main__":
+    master_csv_path = sys.argv[1] if len(sys.argv) > 1 else "Master Sheet.csv"
+    start = sys.argv[2] if len(sys.argv) > 2 else None
+    end = sys.argv[3] if len(sys.argv) > 3 else start
+    departments = sys.argv[4:] or None
+    for kind in KINDS:
+        print(kind, query_percentiles(master_csv_path, start, end, departments, kinds=(kind,)))
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+import backends
+import near_duplicates
+import parallel_responses
+import Utilities_2
+from Utilities_2 import replace_file
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional, string columns are then hashed by pandas
+    pa = None
+
+# Memoized metric results, so reruns on the same data (after a failed master sheet write,
+# or with other columns to edit) skip the computation.
+#
+#     cache = ResultCache("result_cache", frame_fingerprint(df))
+#     frt_df, non_initial_df = cache.get('response_times', {}, lambda: calculate_response_times(frame))
+#
+# A result is stored under cache_dir as <key>.pkl, where the key hashes the fingerprint of
+# the preprocessed messages, the kind of result, the parameters it was computed with and
+# the source of the modules computing it, so editing the metric code invalidates old
+# results. Reading a result refreshes its modification time; once the directory outgrows
+# max_bytes, the least recently used results are deleted.
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Modules whose code computes the cached results
+CODE_MODULES = [Utilities_2, near_duplicates, parallel_responses, backends]
+
+_code_fingerprint = None
+
+def _numpy_column(values):
+    return isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biufmM'
+
+def _column_digest(digest, values):
+    """Add the dtype and the values of a column to digest"""
+    digest.update(f"{values.name}\0{values.dtype}\0{len(values)}\0".encode())
+    if _numpy_column(values):
+        digest.update(np.ascontiguousarray(values.to_numpy()).tobytes())
+    elif isinstance(values.dtype, pd.CategoricalDtype):
+        digest.update(np.ascontiguousarray(values.cat.codes.to_numpy()).tobytes())
+        _column_digest(digest, pd.Series(values.cat.categories, name='categories'))
+    elif pa is not None and hasattr(values.array, '__arrow_array__') and values.dtype.kind in 'OU':
+        # Arrow-backed strings: hash the offsets and UTF-8 data as they are
+        array = pa.array(values.array)
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        offset_type = np.int64 if pa.types.is_large_string(array.type) else np.int32
+        _, offsets, data = array.buffers()
+        offsets = np.frombuffer(offsets, dtype=offset_type)[array.offset:array.offset + len(array) + 1]
+        digest.update((offsets - offsets[0]).tobytes())
+        digest.update(memoryview(data)[offsets[0]:offsets[-1]])
+        digest.update(np.asarray(array.is_null()).tobytes())
+    else:
+        digest.update(pd.util.hash_pandas_object(values, index=False).to_numpy().tobytes())
+
+def frame_fingerprint(df):
+    """
+    SHA-256 of a DataFrame's columns, dtypes and values (not its index)
+
+    The same messages loaded with other dtypes (e.g. typed by the view cache instead of
+    read from the CSV) get another fingerprint.
+    """
+    digest = hashlib.sha256(f"frame-{CACHE_VERSION}\0".encode())
+    for col in df.columns:
+        _column_digest(digest, df[col])
+    return digest.hexdigest()
+
+def code_fingerprint():
+    """SHA-256 of the source of CODE_MODULES"""
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        digest = hashlib.sha256()
+        for module in CODE_MODULES:
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        _code_fingerprint = digest.hexdigest()
+    return _code_fingerprint
+
+class ResultCache:
+    """
+    Memoized results of one preprocessed frame, stored in cache_dir (nothing is cached when it is None)
+
+    Attributes:
+        last_hit: Whether the last get returned a stored result
+    """
+
+    def __init__(self, cache_dir, fingerprint, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        self.last_hit = False
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, kind, params):
+        # params keep their order: e.g. the order of departments is the order of the matrix rows
+        key = json.dumps([CACHE_VERSION, code_fingerprint(), self.fingerprint, kind, params], default=str)
+        return os.path.join(self.cache_dir, f"{kind}-{hashlib.sha256(key.encode()).hexdigest()}.pkl")
+
+    def get(self, kind, params, compute):
+        """
+        The stored result of compute for these parameters, computed and stored when missing
+
+        Args:
+            kind: Name of the result (e.g. 'response_times')
+            params: JSON-serializable parameters the result depends on
+            compute: Function computing the result
+
+        Returns:
+            The result of compute()
+        """
+        self.last_hit = False
+        if not self.cache_dir:
+            return compute()
+        path = self._path(kind, params)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            os.utime(path)
+            self.last_hit = True
+            return result
+        except FileNotFoundError:
+            pass
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            print(f"Ignoring unreadable cached result {path}: {e}")
+
+        result = compute()
+
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        replace_file(path, write)
+        self._evict(keep=path)
+        return result
+
+    def _evict(self, keep):
+        """Delete the least recently used results until the cache fits in max_bytes (keep is never deleted)"""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) == os.path.abspath(keep):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,229 @@
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from Utilities_2 import (
+    ConversationFrame,
+    calculate_response_times,
+    get_bot_repetitions,
+    get_bot_handle_metrics,
+    has_senders,
+    response_senders
+)
+
+# Chunked ingestion for exports that don't fit in memory.
+#
+# The CSV is read twice in chunks: the first pass counts messages per conversation and
+# cuts the sorted conversation IDs into contiguous ranges of about chunksize messages,
+# the second pass appends every chunk's rows to the on-disk partition of their range.
+# Each partition then holds whole conversations and is small enough to sort and
+# deduplicate in memory, so partitions come back in global (Conversation ID,
+# Message Sent Time) order, exactly like preprocess_data, with memory bounded by
+# max(chunksize, largest conversation).
+#
+# compute_streaming_metrics keeps that bound: every batch is reduced to the counts and
+# sums the metrics are made of, and its response times and repetitions are handed to a
+# callback (which appends them to the outputs) instead of being kept until the end.
+
+DEFAULT_CHUNKSIZE = 500_000
+
+def _partition_bounds(csv_path, chunksize):
+    """First pass: upper Conversation ID of every partition of about chunksize messages"""
+    counts = None
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        chunk_counts = chunk['Conversation ID'].value_counts()
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+    if counts is None or counts.empty:
+        return []
+    counts = counts.sort_index()
+    partition = (counts.cumsum().to_numpy() - 1) // chunksize
+    # Last conversation ID of each partition
+    last = np.r_[partition[1:] != partition[:-1], True]
+    return list(counts.index[last])
+
+def _write_partitions(csv_path, chunksize, bounds, tmp_dir):
+    """Second pass: append every chunk's rows to the partition file of their conversation range"""
+    paths = [os.path.join(tmp_dir, f"partition_{i}.pkl") for i in range(len(bounds) + 1)]
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        conv_ids = chunk['Conversation ID']
+        partition = np.full(len(chunk), len(bounds), dtype=np.int64)  # missing IDs go last
+        known = conv_ids.notna().to_numpy()
+        partition[known] = np.searchsorted(np.asarray(bounds), conv_ids[known].to_numpy(), side='left')
+        for i in np.unique(partition):
+            with open(paths[i], 'ab') as f:
+                pickle.dump(chunk[partition == i], f, protocol=pickle.HIGHEST_PROTOCOL)
+    return paths
+
+def _read_partition(path):
+    parts = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                parts.append(pickle.load(f))
+            except EOFError:
+                break
+    return pd.concat(parts, ignore_index=True)
+
+def iter_conversation_batches(csv_path, chunksize=DEFAULT_CHUNKSIZE, output_filename=None):
+    """
+    Externally sort and deduplicate a conversation export, yielding it in batches of whole conversations
+
+    Args:
+        csv_path: Path to the exported CSV
+        chunksize: Rows read per chunk, and target size of each batch
+        output_filename: Also write the sorted, deduplicated data here (like preprocess_data)
+
+    Yields:
+        DataFrame: Complete conversations sorted on ['Conversation ID', 'Message Sent Time']
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="conversations_")
+    try:
+        bounds = _partition_bounds(csv_path, chunksize)
+        paths = _write_partitions(csv_path, chunksize, bounds, tmp_dir)
+        header = True
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            batch = _read_partition(path)
+            os.remove(path)
+            # Stable sort, so duplicates keep their export order before drop_duplicates
+            batch = batch.sort_values(by=['Conversation ID', 'Message Sent Time'], kind='stable')
+            batch = batch.drop_duplicates(subset=['Conversation ID', 'Message Sent Time'], keep='first')
+            if output_filename:
+                batch.to_csv(output_filename, index=False, mode='w' if header else 'a', header=header)
+                header = False
+            yield batch
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def iter_conversations(csv_path, chunksize=DEFAULT_CHUNKSIZE, output_filename=None):
+    """
+    Yield one conversation at a time from an externally sorted export
+
+    Yields:
+        tuple: (conversation_id, DataFrame of its sorted, deduplicated messages)
+    """
+    for batch in iter_conversation_batches(csv_path, chunksize, output_filename):
+        for conversation_id, conversation_df in batch.groupby('Conversation ID', sort=False):
+            yield conversation_id, conversation_df
+
+def skill_bot_responses(responses, first_response, skill_filter, bot_filter="bot"):
+    """
+    Whether every response of a response-time table is one compute_metrics counts (its
+    sender contains the skill and the bot filter); None for tables without response times
+    """
+    if responses.empty or 'Response Time (mins)' not in responses.columns or not has_senders(responses):
+        return None
+    senders = response_senders(responses, first_response)
+    return (senders.str.contains(skill_filter, case=False, na=False)
+            & senders.str.contains(bot_filter, case=False, na=False)).to_numpy(dtype=bool)
+
+def response_totals(frt_df, non_initial_df, skill_filter, bot_filter="bot"):
+    """
+    The sums and counts compute_metrics reduces response-time tables to
+
+    Totals of tables holding different conversations add up to the totals of all of them.
+
+    Returns:
+        ndarray: Rows initial and non_initial, columns: minutes of the responses under 4
+        minutes, their count, and the count of responses of 4 minutes or more
+    """
+    totals = np.zeros((2, 3))
+    for i, (responses, first_response) in enumerate([(frt_df, True), (non_initial_df, False)]):
+        skill_bot = skill_bot_responses(responses, first_response, skill_filter, bot_filter)
+        if skill_bot is None:
+            continue
+        minutes = responses['Response Time (mins)'].to_numpy(dtype=np.float64)
+        fast = minutes[skill_bot & (minutes < 4)]
+        totals[i] += [fast.sum(), len(fast), (skill_bot & (minutes >= 4)).sum()]
+    return totals
+
+def summarize_response_times(totals):
+    """Response time metrics dict (as compute_metrics returns) from combined response_totals"""
+    (initial_minutes, initial_fast, initial_slow), (non_initial_minutes, non_initial_fast, non_initial_slow) = totals
+    metrics = {
+        'AVG initial': round(initial_minutes / initial_fast, 2) if initial_fast else 0,
+        'AVG non_initial': round(non_initial_minutes / non_initial_fast, 2) if non_initial_fast else 0,
+        'Count of >=4 mins initial': int(initial_slow),
+        'Count of >=4 mins non_initial': int(non_initial_slow)
+    }
+    print(f"Computed metrics:")
+    print(f"  AVG initial: {metrics['AVG initial']} minutes")
+    print(f"  AVG non_initial: {metrics['AVG non_initial']} minutes")
+    print(f"  Count of >=4 mins initial: {metrics['Count of >=4 mins initial']}")
+    print(f"  Count of >=4 mins non_initial: {metrics['Count of >=4 mins non_initial']}")
+    return metrics
+
+def summarize_repetitions(chats_with_reps, total_chats):
+    """Repetition metrics dict (as compute_metrics_Repetitions returns) from combined counts"""
+    percentage = (chats_with_reps / total_chats) * 100 if total_chats > 0 else 0
+    print(f"% of chats with at least one repetition: {chats_with_reps} / {total_chats} = {percentage:.2f}%")
+    return {
+        '% of Repetition': round(percentage, 2),
+        'Chats with repetitions': chats_with_reps,
+        'Total chats with bot interactions': total_chats
+    }
+
+def summarize_bot_handle(total_chats, fully_bot_conversations):
+    """Bot handle metrics dict (as compute_metrics_BotHandle returns) from combined counts"""
+    bot_handle_ratio = (fully_bot_conversations / total_chats) * 100 if total_chats > 0 else 0
+    print(f"Conversations handled fully by bot: {fully_bot_conversations}")
+    print(f"Bot Handle Ratio: {bot_handle_ratio:.2f}%")
+    return {
+        'Total chats': total_chats,
+        'Conversations Fully Handeled by Bot': fully_bot_conversations,
+        'Bot Handle Ratio': round(bot_handle_ratio, 2)
+    }
+
+def compute_streaming_metrics(csv_path, skill_filter, bot_filter="bot", chunksize=DEFAULT_CHUNKSIZE, output_filename=None,
+                              on_batch=None, similarity=None):
+    """
+    Run the response time, repetition and bot handle stages over an export batch by batch
+
+    Batches hold whole conversations, so their counts and sums combine exactly into the
+    same figures a full in-memory run gives (the averages to their two reported decimals).
+    Only those running totals are kept: every batch's response times and repetitions are
+    passed to on_batch and dropped, so memory stays bounded by the largest batch.
+
+    Args:
+        csv_path: Path to the exported CSV
+        skill_filter: Skill to filter by
+        bot_filter: Bot filter (default: "bot")
+        chunksize: Rows read per chunk, and target size of each batch
+        output_filename: Also write the sorted, deduplicated data here (like preprocess_data)
+        on_batch: on_batch(frt_df, non_initial_df, repetitions_df) is called with the results
+            of every batch, e.g. to append them to the outputs
+        similarity: Similarity threshold of near-duplicate repetitions (see get_bot_repetitions);
+            near-duplicates never span conversations, so batches find them all
+
+    Returns:
+        tuple: (metrics, repetition_metrics, bot_handle_metrics)
+    """
+    totals = np.zeros((2, 3))
+    chats_with_reps = repetition_total_chats = 0
+    total_chats = fully_bot_conversations = 0
+    for batch in iter_conversation_batches(csv_path, chunksize, output_filename):
+        frame = ConversationFrame(batch)
+        frt_df, non_initial_df = calculate_response_times(frame)
+        totals += response_totals(frt_df, non_initial_df, skill_filter, bot_filter)
+
+        repetitions_df, _, batch_reps, batch_chats = get_bot_repetitions(
+            frame, skill_filter, verbose=False, similarity=similarity
+        )
+        chats_with_reps += batch_reps
+        repetition_total_chats += batch_chats
+
+        batch_total, batch_fully_bot, _ = get_bot_handle_metrics(frame, skill_filter, verbose=False)
+        total_chats += batch_total
+        fully_bot_conversations += batch_fully_bot
+
+        if on_batch is not None:
+            on_batch(frt_df, non_initial_df, repetitions_df)
+
+    metrics = summarize_response_times(totals)
+    repetition_metrics = summarize_repetitions(chats_with_reps, repetition_total_chats)
+    bot_handle_metrics = summarize_bot_handle(total_chats, fully_bot_conversations)
+    return metrics, repetition_metrics, bot_handle_metrics
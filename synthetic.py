@@ -0,0 +1,156 @@
+import sys
+import numpy as np
+import pandas as pd
+
+# Deterministic synthetic conversation exports with the columns of the Tableau views,
+# for benchmarks and for checking faster implementations against the original loops.
+#
+# Everything is drawn from one seeded generator with vectorized NumPy calls, so the same
+# arguments always give the same rows and 10M rows take seconds rather than minutes.
+# The data is messy on purpose (sender and type spellings vary in case and whitespace,
+# agent names can be empty or missing, rows can be duplicated and shuffled) because the
+# metric functions normalize all of that.
+
+SENDER_SPELLINGS = {
+    'consumer': ['Consumer', 'consumer', ' Consumer '],
+    'bot': ['Bot', 'BOT', 'bot '],
+    'agent': ['Agent', 'agent'],
+    'system': ['System', 'SYSTEM'],
+}
+SKILLS = ['GPT_MV_PROSPECT', 'gpt_cc_prospect', 'filipina_outside', 'gpt_delighters', 'Doctors']
+AGENT_NAMES = ['Ann', 'Bob', 'Carla', 'Dan', 'Eve', '']
+CONSUMER_TEXTS = ['Hello', 'hello', 'How much is it?', 'I need help', 'Thanks', 'Bye']
+
+def generate_conversations(
+    n_rows=100_000,
+    mean_length=20,
+    bot_share=0.35,
+    agent_share=0.15,
+    system_share=0.05,
+    transfer_rate=0.03,
+    private_rate=0.05,
+    repetition_rate=0.1,
+    duplicate_rate=0.01,
+    skills=SKILLS,
+    messy=True,
+    shuffle=True,
+    seed=0,
+    start='2025-07-08',
+    time_format=None,
+):
+    """
+    Generate a conversation export
+
+    Args:
+        n_rows: Number of messages (before duplicates are added)
+        mean_length: Average messages per conversation (lengths are geometric)
+        bot_share, agent_share, system_share: Share of messages sent by each role (the rest are consumers)
+        transfer_rate: Share of messages that are transfers
+        private_rate: Share of messages that are private messages
+        repetition_rate: Chance that a bot message repeats the conversation's previous bot text
+        duplicate_rate: Share of rows exported twice
+        skills: Skills conversations are assigned to
+        messy: Vary the case and whitespace of sender and message type values
+        shuffle: Return the rows in random order (exports aren't sorted)
+        seed: Random seed
+        start: Day the conversations start on
+        time_format: strftime format of 'Message Sent Time' (default: ISO with milliseconds),
+            e.g. "%m/%d/%Y %I:%M:%S %p" for exports whose times don't sort as text
+
+    Returns:
+        DataFrame with 'Conversation ID', 'Message Sent Time', 'Sent By', 'Message Type',
+        'Skill', 'Agent Name ', 'TEXT' and 'MESSAGE_ID'
+    """
+    rng = np.random.default_rng(seed)
+
+    # Conversation lengths, trimmed so they add up to n_rows
+    lengths = rng.geometric(1 / mean_length, size=n_rows // max(mean_length, 1) + 16)
+    while lengths.sum() < n_rows:
+        lengths = np.concatenate([lengths, rng.geometric(1 / mean_length, size=len(lengths))])
+    ends = np.cumsum(lengths)
+    n_conversations = int(np.searchsorted(ends, n_rows)) + 1
+    lengths = lengths[:n_conversations]
+    lengths[-1] -= ends[n_conversations - 1] - n_rows
+    conversation = np.repeat(np.arange(n_conversations), lengths)
+    conversation_start = np.zeros(n_rows, dtype=bool)
+    conversation_start[np.concatenate([[0], ends[:n_conversations - 1]])] = True
+
+    # Times: each conversation starts during the day, messages follow every few minutes
+    start_ms = rng.integers(0, 86_400_000, size=n_conversations)
+    gaps = rng.exponential(120_000, size=n_rows).astype(np.int64)
+    elapsed = np.cumsum(gaps)
+    elapsed -= np.repeat(elapsed[conversation_start] - gaps[conversation_start], lengths)
+    sent_time = np.datetime64(start, 'ms') + (start_ms[conversation] + elapsed).astype('timedelta64[ms]')
+
+    # Roles, consumers always open the conversation
+    consumer_share = 1 - bot_share - agent_share - system_share
+    role = rng.choice(4, size=n_rows, p=[consumer_share, bot_share, agent_share, system_share])
+    role[conversation_start] = 0
+    role_names = np.array(list(SENDER_SPELLINGS))
+    if messy:
+        spelling = rng.integers(0, 3, size=n_rows)
+        sent_by = np.empty(n_rows, dtype=object)
+        for code, name in enumerate(role_names):
+            spellings = np.array(SENDER_SPELLINGS[name], dtype=object)
+            rows = role == code
+            sent_by[rows] = spellings[spelling[rows] % len(spellings)]
+    else:
+        sent_by = np.array(['Consumer', 'Bot', 'Agent', 'System'], dtype=object)[role]
+
+    # Message types
+    kind = rng.random(n_rows)
+    message_type = np.full(n_rows, 'Normal Message', dtype=object)
+    message_type[kind < transfer_rate + private_rate] = 'Private Message'
+    message_type[kind < transfer_rate] = 'Transfer'
+    if messy:
+        message_type[(kind > 0.98) & (message_type == 'Normal Message')] = 'normal message '
+
+    # Skills per conversation, sometimes changing for a message
+    conversation_skill = np.array(skills, dtype=object)[rng.integers(0, len(skills), size=n_conversations)]
+    skill = conversation_skill[conversation]
+    switched = rng.random(n_rows) < 0.05
+    skill[switched] = np.array(skills, dtype=object)[rng.integers(0, len(skills), size=int(switched.sum()))]
+
+    agent_name = np.full(n_rows, np.nan, dtype=object)
+    is_agent = role == 2
+    agent_name[is_agent] = np.array(AGENT_NAMES, dtype=object)[rng.integers(0, len(AGENT_NAMES), size=int(is_agent.sum()))]
+
+    # Bot texts are unique unless they repeat the previous bot text of the conversation
+    text = np.array(CONSUMER_TEXTS, dtype=object)[rng.integers(0, len(CONSUMER_TEXTS), size=n_rows)]
+    is_bot = role == 1
+    bot_text = pd.Series(np.where(is_bot, np.arange(n_rows), -1))
+    repeats = is_bot & (rng.random(n_rows) < repetition_rate)
+    bot_text[repeats | ~is_bot] = np.nan
+    bot_text = bot_text.groupby(conversation).ffill()
+    # A repeat with no earlier bot message in the conversation keeps its own text
+    bot_text = bot_text.fillna(pd.Series(np.arange(n_rows))).astype(np.int64)
+    text[is_bot] = 'Bot reply ' + pd.Series(bot_text[is_bot].to_numpy()).astype(str).to_numpy(dtype=object)
+
+    if time_format is None:
+        sent_time_text = np.char.replace(np.datetime_as_string(sent_time, unit='ms'), 'T', ' ')
+    else:
+        sent_time_text = pd.Series(sent_time).dt.strftime(time_format).to_numpy(dtype=object)
+
+    df = pd.DataFrame({
+        'Conversation ID': 10_000_000 + conversation,
+        'Message Sent Time': sent_time_text,
+        'Sent By': sent_by,
+        'Message Type': message_type,
+        'Skill': skill,
+        'Agent Name ': agent_name,
+        'TEXT': text,
+        'MESSAGE_ID': 500_000_000 + np.arange(n_rows),
+    })
+    if duplicate_rate:
+        df = pd.concat([df, df.sample(frac=duplicate_rate, random_state=seed)], ignore_index=True)
+    if shuffle:
+        df = df.sample(frac=1, random_state=seed).reset_index(drop=True)
+    return df
+
+if __name__ == "__main__":
+    # python synthetic.py <rows> <output.csv> [seed]
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    output = sys.argv[2] if len(sys.argv) > 2 else f"synthetic_{n_rows}.csv"
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    generate_conversations(n_rows, seed=seed).to_csv(output, index=False)
+    print(f"Wrote {n_rows} messages to {output}")
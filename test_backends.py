@@ -0,0 +1,47 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip("duckdb")
+
+from backends import compute_view
+from benchmark import NON_ISO_TIME_FORMAT
+from synthetic import generate_conversations
+
+# The duckdb backend must give the pandas backend's figures, tables and sorted messages,
+# with ISO times and with non-ISO ones (which both backends order as exported text).
+#
+#     python -m pytest -q test_backends.py
+
+DEPARTMENTS = {
+    "MV": "gpt_mv_prospect",
+    "CC": "gpt_cc_prospect",
+    "Filipina": "filipina_outside",
+    "Doctors": "Doctors",
+}
+
+def _same_frames(expected, actual):
+    if expected is None or actual is None:
+        assert expected is None and actual is None
+        return
+    pd.testing.assert_frame_equal(
+        expected.reset_index(drop=True), actual.reset_index(drop=True), check_dtype=False
+    )
+
+@pytest.mark.parametrize("time_format", [None, NON_ISO_TIME_FORMAT], ids=["iso", "non-iso"])
+def test_duckdb_matches_pandas(tmp_path, time_format):
+    view = os.path.join(tmp_path, "view.csv")
+    generate_conversations(3000, seed=1, time_format=time_format).to_csv(view, index=False)
+    sorted_outputs = {backend: os.path.join(tmp_path, f"view.sorted.{backend}.csv") for backend in ('pandas', 'duckdb')}
+
+    expected = compute_view(view, DEPARTMENTS, backend='pandas', sorted_output=sorted_outputs['pandas'])
+    actual = compute_view(view, DEPARTMENTS, backend='duckdb', sorted_output=sorted_outputs['duckdb'])
+
+    with open(sorted_outputs['pandas'], 'rb') as f, open(sorted_outputs['duckdb'], 'rb') as g:
+        assert f.read() == g.read()
+    pd.testing.assert_frame_equal(expected[0], actual[0], check_dtype=False)
+    _same_frames(expected[1], actual[1])
+    _same_frames(expected[2], actual[2])
+    assert expected[3].keys() == actual[3].keys()
+    for department in DEPARTMENTS:
+        _same_frames(expected[3][department], actual[3][department])
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import pandas as pd
+
+from Utilities_2 import preprocess_data, replace_file
+
+try:
+    import pyarrow  # noqa: F401 - Parquet engine for pandas
+except ImportError:
+    pyarrow = None
+
+# Typed cache of fetched views, so reruns on unchanged data skip re-parsing the CSV.
+#
+# Every view is stored under cache_dir as its preprocessed (sorted, deduplicated) frame with
+# the declared schema applied (<view>.sorted.parquet), next to <view>.json holding the
+# fingerprint of the CSV it came from. Parquet is used when pyarrow is installed, pickle
+# otherwise; both keep the datetime and categorical dtypes, so loading is a straight read
+# with no parsing. The sorted CSV preprocess_data would write (<view>.sorted.csv, with the
+# times spelled as exported) is kept too, so runs can still export it unchanged.
+#
+# The preprocessed frame is sorted and deduplicated on the times as exported, before the
+# schema is applied, exactly as preprocess_data does on the CSV: parsed times order
+# non-ISO exports (e.g. "7/8/2025 9:05:03 AM") differently, which would change the metrics.
+
+SCHEMA_VERSION = 3
+# Declared types of the export columns; other columns with 'skill' in their name are categorical too
+VIEW_SCHEMA = {
+    'Conversation ID': 'id',
+    'MESSAGE_ID': 'id',
+    'Message Sent Time': 'datetime',
+    'Sent By': 'category',
+    'Message Type': 'category',
+    'Skill': 'category',
+    'Agent Name ': 'category',
+    'TEXT': 'text',
+}
+FORMAT = 'parquet' if pyarrow is not None else 'pickle'
+
+def apply_schema(df):
+    """
+    Convert the export columns to their declared types
+
+    IDs and TEXT keep the type read_csv gives them (IDs are int64 when every value is
+    numeric), times become datetime64 and the low-cardinality text columns categoricals.
+    """
+    df = df.copy()
+    for col in df.columns:
+        kind = VIEW_SCHEMA.get(col, 'category' if 'skill' in col.lower() else None)
+        if kind == 'datetime':
+            df[col] = pd.to_datetime(df[col])
+        elif kind == 'category':
+            df[col] = df[col].astype('category')
+    return df
+
+def file_fingerprint(path):
+    """SHA-256 of the file contents and the schema version"""
+    digest = hashlib.sha256(f"schema-{SCHEMA_VERSION}".encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_table(df, path):
+    """Write a typed frame in the cache format (Parquet with pyarrow, pickle otherwise)"""
+    if FORMAT == 'parquet':
+        replace_file(path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+    else:
+        replace_file(path, lambda tmp_path: df.to_pickle(tmp_path))
+
+def read_table(path):
+    if FORMAT == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+def _paths(cache_dir, view_name):
+    suffix = 'parquet' if FORMAT == 'parquet' else 'pkl'
+    base = os.path.join(cache_dir, view_name)
+    return f"{base}.sorted.{suffix}", f"{base}.sorted.csv", f"{base}.json"
+
+def _read_metadata(metadata_path):
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    if metadata.get('schema_version') != SCHEMA_VERSION or metadata.get('format') != FORMAT:
+        return None
+    return metadata
+
+def _write_json(data, path):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+def load_view(view_name, csv_path, fetch, cache_dir="view_cache", max_age=None, sorted_output=None):
+    """
+    Get the preprocessed messages of a view, fetching and parsing only when the data changed
+
+    Args:
+        view_name: Tableau view to load
+        csv_path: Where fetch writes the exported CSV
+        fetch: fetch(view_name, csv_path) -> bool, e.g. fetch.fetch_data (None when csv_path is already fetched)
+        cache_dir: Directory of the typed cache
+        max_age: Seconds during which a cached view is used without fetching it again (default: always fetch)
+        sorted_output: Path to also write the sorted messages to as CSV, as preprocess_data
+            writes them (default: None)
+
+    Returns:
+        DataFrame: Sorted, deduplicated messages with the declared column types
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    sorted_path, sorted_csv_path, metadata_path = _paths(cache_dir, view_name)
+    metadata = _read_metadata(metadata_path)
+    cached = metadata is not None and os.path.exists(sorted_path) and os.path.exists(sorted_csv_path)
+
+    def export(df):
+        if sorted_output:
+            replace_file(sorted_output, lambda tmp_path: shutil.copyfile(sorted_csv_path, tmp_path))
+        return df
+
+    if cached and fetch is not None and max_age is not None and time.time() - metadata['fetched_at'] < max_age:
+        print(f"Using cached {view_name} fetched {int(time.time() - metadata['fetched_at'])}s ago")
+        return export(read_table(sorted_path))
+
+    if fetch is not None:
+        print(f"Fetching data for view: {view_name}")
+        if not fetch(view_name, csv_path):
+            raise RuntimeError(f"Failed to fetch data from Tableau for view: {view_name}")
+    fingerprint = file_fingerprint(csv_path)
+
+    if cached and metadata['fingerprint'] == fingerprint:
+        print(f"{view_name} is unchanged, loading the cached frame")
+        df = read_table(sorted_path)
+    else:
+        df = preprocess_data(pd.read_csv(csv_path), output_filename=None)
+        replace_file(sorted_csv_path, lambda tmp_path: df.to_csv(tmp_path, index=False))
+        df = apply_schema(df)
+        write_table(df, sorted_path)
+
+    metadata = {
+        'view_name': view_name,
+        'fingerprint': fingerprint,
+        'schema_version': SCHEMA_VERSION,
+        'format': FORMAT,
+        'rows': len(df),
+        'fetched_at': time.time(),
+    }
+    replace_file(metadata_path, lambda tmp_path: _write_json(metadata, tmp_path))
+    return export(df)
+
+def load_cached_view(view_name, cache_dir="view_cache"):
+    """The typed preprocessed frame of a view from the cache, or None if it isn't cached"""
+    sorted_path, _, metadata_path = _paths(cache_dir, view_name)
+    if _read_metadata(metadata_path) is None or not os.path.exists(sorted_path):
+        return None
+    return read_table(sorted_path)